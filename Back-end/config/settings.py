@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'forms.replicas.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -100,8 +101,32 @@ DATABASES = {
     }
 }
 
+# Optional read replicas (forms/replicas.py): comma-separated host[:port]
+# list, reached with the primary's credentials. GET requests of the
+# analysis, response list, export and public form endpoints read from a
+# replica whose replay lag is at most DB_REPLICA_MAX_LAG_SECONDS (checked
+# every DB_REPLICA_CHECK_SECONDS, giving up on connecting after
+# DB_REPLICA_CONNECT_TIMEOUT); a user's reads stay on the primary for
+# DB_PRIMARY_PIN_SECONDS after they write. Pins are kept in the cache, so
+# use a shared cache (REDIS_URL) with several web processes
+REPLICA_DATABASES = []
+for index, replica_host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = replica_host.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{index}')
+DATABASE_ROUTERS = ['forms.replicas.ReplicaRouter']
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv('DB_REPLICA_CHECK_SECONDS', '2'))
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+DB_PRIMARY_PIN_SECONDS = int(os.getenv('DB_PRIMARY_PIN_SECONDS', '10'))
+
 # Optional: legacy SQLite database alias for data migration
-# Allows commands like: python manage.py dumpdata --database=old > data.json
+# Copied into the current schema with: python manage.py migrate_legacy --from old --to default
 sqlite_path = (BASE_DIR / 'db.sqlite3')
 if sqlite_path.exists():
     DATABASES['old'] = {
@@ -128,6 +153,40 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (forms/hashers.py): new passwords, and existing ones at
+# the user's next login, are hashed with PASSWORD_HASHER (scrypt, or argon2
+# with `pip install argon2-cffi`); PBKDF2 hashes are still accepted
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'scrypt')
+PASSWORD_HASHERS = [
+    'forms.hashers.ScryptPasswordHasher',
+    'forms.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+if PASSWORD_HASHER == 'argon2':
+    # New hashes use the first hasher
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv('PASSWORD_SCRYPT_WORK_FACTOR', str(2 ** 14)))
+PASSWORD_SCRYPT_BLOCK_SIZE = int(os.getenv('PASSWORD_SCRYPT_BLOCK_SIZE', '8'))
+PASSWORD_SCRYPT_PARALLELISM = int(os.getenv('PASSWORD_SCRYPT_PARALLELISM', '1'))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', '2'))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', '102400'))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', '8'))
+
+# Login and signup hash in a pool of this many threads (forms/hashing.py);
+# beyond PASSWORD_HASH_QUEUE waiting calls they answer 429 at once (0
+# workers hashes on the request thread). Keep workers + queue well below
+# the web server's request threads so logins can't occupy all of them
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', '2'))
+
+# Bulk user provisioning (forms/provisioning.py, `manage.py provision_users`,
+# POST /api/auth/users/bulk/) hashes passwords in this many processes;
+# the endpoint hashes inside the request, holding a web worker, so it
+# accepts at most PROVISION_MAX_USERS users (larger files: the command)
+PROVISION_HASH_WORKERS = int(os.getenv('PROVISION_HASH_WORKERS', str(os.cpu_count() or 1)))
+PROVISION_MAX_USERS = int(os.getenv('PROVISION_MAX_USERS', '500'))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -159,7 +218,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'forms.authentication.ClaimsJWTAuthentication',
     ],
 }
 
@@ -191,3 +250,76 @@ SIMPLE_JWT = {
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
 }
+
+# Requests authenticate from token claims (forms/authentication.py); the
+# user's current token stamp is cached this long, which bounds how long a
+# revoked token keeps working when the cache isn't shared (REDIS_URL)
+AUTH_STAMP_CACHE_SECONDS = int(os.getenv('AUTH_STAMP_CACHE_SECONDS', '60'))
+
+# Form analysis
+# Extra stopwords (comma separated) ignored in text word/phrase frequencies,
+# on top of the built-in Persian and English lists in forms/text_analysis.py
+FORM_ANALYSIS_EXTRA_STOPWORDS_STR = os.getenv('FORM_ANALYSIS_EXTRA_STOPWORDS', '')
+FORM_ANALYSIS_EXTRA_STOPWORDS = [word.strip() for word in FORM_ANALYSIS_EXTRA_STOPWORDS_STR.split(',') if word.strip()]
+
+# Analysis result cache (forms/analysis_cache.py). Without REDIS_URL the
+# per-process local-memory cache is used, which only coalesces work within
+# one worker process.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+FORM_ANALYSIS_CACHE_TIMEOUT = int(os.getenv('FORM_ANALYSIS_CACHE_TIMEOUT', str(24 * 60 * 60)))
+# Seconds a request waits for another process computing the same analysis
+# before computing it itself; keep it below the server's request timeout
+FORM_ANALYSIS_CACHE_WAIT_TIMEOUT = float(os.getenv('FORM_ANALYSIS_CACHE_WAIT_TIMEOUT', '20'))
+# Forms with at least this many responses get the previous result while a
+# background refresh runs, instead of waiting for the recomputation
+FORM_ANALYSIS_STALE_WHILE_REVALIDATE_MIN_RESPONSES = int(
+    os.getenv('FORM_ANALYSIS_STALE_WHILE_REVALIDATE_MIN_RESPONSES', '50000')
+)
+
+# Approximate analysis (forms/approx.py): sketches are updated on every
+# submission, spread over this many row shards per question
+FORM_ANALYSIS_SKETCHES = os.getenv('FORM_ANALYSIS_SKETCHES', 'True') == 'True'
+FORM_ANALYSIS_SKETCH_SHARDS = int(os.getenv('FORM_ANALYSIS_SKETCH_SHARDS', '8'))
+
+# Background jobs (forms/jobs.py, `manage.py run_workers`): a running job
+# older than JOB_TIMEOUT seconds is assumed lost and requeued, up to
+# JOB_MAX_ATTEMPTS runs in total. Workers are separate processes, so
+# analysis refreshes only reach the web workers through a shared cache
+# (REDIS_URL)
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '3600'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Exact analysis of large forms runs per-question batches in a pool of this
+# many processes (1 disables the pool); forms below the threshold (responses
+# x questions) are analyzed inline
+FORM_ANALYSIS_WORKERS = int(os.getenv('FORM_ANALYSIS_WORKERS', str(os.cpu_count() or 1)))
+FORM_ANALYSIS_PARALLEL_MIN_ANSWERS = int(os.getenv('FORM_ANALYSIS_PARALLEL_MIN_ANSWERS', '200000'))
+
+# Files written by background export jobs
+EXPORT_ROOT = Path(os.getenv('EXPORT_ROOT', str(BASE_DIR / 'exports')))
+
+# Response change feed (forms/feed.py): responses inserted less than this
+# ago are held back so transactions that drew a lower sequence number can
+# commit; an import chunk (import_responses --chunk-size) should commit
+# well within it
+RESPONSE_FEED_SETTLE_SECONDS = float(os.getenv('RESPONSE_FEED_SETTLE_SECONDS', '1'))
+
+# Response archival (forms/archives.py, `manage.py archive_responses`):
+# unpublished forms without new responses for FORM_ARCHIVE_AFTER_DAYS have
+# their responses moved to files under ARCHIVE_ROOT
+ARCHIVE_ROOT = Path(os.getenv('ARCHIVE_ROOT', str(BASE_DIR / 'archives')))
+FORM_ARCHIVE_AFTER_DAYS = int(os.getenv('FORM_ARCHIVE_AFTER_DAYS', '365'))
+
+# Deleted forms, sections and questions are tombstoned and removed later by
+# a background job (forms/reaper.py, `manage.py reap_deleted`) in chunks of
+# this many rows, pausing between chunks to leave room for other queries
+TOMBSTONE_REAP_CHUNK_SIZE = int(os.getenv('TOMBSTONE_REAP_CHUNK_SIZE', '2000'))
+TOMBSTONE_REAP_PAUSE = float(os.getenv('TOMBSTONE_REAP_PAUSE', '0.05'))
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Form, Section, Question, Response, Answer
+from .models import Form, Section, Question, Response, Answer, Job
 
 
 @admin.register(Form)
@@ -34,3 +34,10 @@ class ResponseAdmin(admin.ModelAdmin):
 class AnswerAdmin(admin.ModelAdmin):
     list_display = ['question', 'response', 'value']
     list_filter = ['question__section__form']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'form', 'status', 'attempts', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
@@ -0,0 +1,626 @@
+"""
+Form analysis: per-question analysis of a form's answers, plus shared
+helpers (value labels and small statistics that work on aggregated
+(value, count) rows instead of individual answers).
+"""
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import math
+import multiprocessing
+import threading
+
+import django
+from django.conf import settings
+from django.db.models import Count, Q, TextField
+from django.db.models.fields.json import KT
+from django.db.models.functions import Cast
+
+from .models import Answer, choice_mask_values, typed_answer_values
+from . import text_analysis
+
+
+CHOICE_QUESTION_TYPES = ('single_choice', 'multi_choice')
+NUMERIC_QUESTION_TYPES = ('rating', 'scale')
+
+
+def value_labels(question):
+    """
+    Map answer values to display labels: option texts for choice
+    questions, scale labels for rating/scale questions.
+    """
+    if question.type in CHOICE_QUESTION_TYPES:
+        return {opt['value']: opt['text'] for opt in (question.options or [])}
+    if question.type in NUMERIC_QUESTION_TYPES:
+        scale = question.scale or {}
+        min_val = int(scale.get('min', 1))
+        max_val = int(scale.get('max', 5))
+        labels = scale.get('labels', [])
+        return {
+            i: labels[i - min_val] if i - min_val < len(labels) else str(i)
+            for i in range(min_val, max_val + 1)
+        }
+    return {}
+
+
+def value_categories(value, question):
+    """Categories an answer value falls into (several for multi choice)"""
+    if question.type == 'multi_choice':
+        return list(value) if isinstance(value, list) else []
+    if question.type in NUMERIC_QUESTION_TYPES:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return [int(value) if float(value).is_integer() else value]
+        return []
+    if isinstance(value, str):
+        return [value]
+    return []
+
+
+def weighted_median(value_counts):
+    """Median of a {value: count} distribution"""
+    total = sum(value_counts.values())
+    if not total:
+        return None
+    ordered = sorted(value_counts.items())
+    lower_rank = (total - 1) // 2
+    upper_rank = total // 2
+    seen = 0
+    lower = None
+    for value, count in ordered:
+        seen += count
+        if lower is None and seen > lower_rank:
+            lower = value
+        if seen > upper_rank:
+            return (lower + value) / 2
+    return None
+
+
+def chi_square(counts):
+    """
+    Pearson's chi-square test of independence for a contingency table
+    (list of rows of counts). Returns None when the table is degenerate.
+    """
+    row_totals = [sum(row) for row in counts]
+    column_totals = [sum(column) for column in zip(*counts)] if counts else []
+    total = sum(row_totals)
+    rows = [i for i, t in enumerate(row_totals) if t]
+    columns = [j for j, t in enumerate(column_totals) if t]
+    if total == 0 or len(rows) < 2 or len(columns) < 2:
+        return None
+
+    statistic = 0.0
+    for i in rows:
+        for j in columns:
+            expected = row_totals[i] * column_totals[j] / total
+            statistic += (counts[i][j] - expected) ** 2 / expected
+    dof = (len(rows) - 1) * (len(columns) - 1)
+    return {
+        'statistic': round(statistic, 4),
+        'dof': dof,
+        'p_value': round(chi_square_p_value(statistic, dof), 6),
+        'cramers_v': round(math.sqrt(statistic / (total * (min(len(rows), len(columns)) - 1))), 4),
+    }
+
+
+def chi_square_p_value(statistic, dof):
+    """Upper tail probability of the chi-square distribution (closed form for integer dof)"""
+    if statistic <= 0:
+        return 1.0
+    half = statistic / 2
+    if dof % 2 == 0:
+        term = 1.0
+        total = 1.0
+        for i in range(1, dof // 2):
+            term *= half / i
+            total += term
+        return min(1.0, math.exp(-half) * total)
+    total = math.erfc(math.sqrt(half))
+    for i in range(1, (dof - 1) // 2 + 1):
+        total += math.exp((i - 0.5) * math.log(half) - half - math.lgamma(i + 0.5))
+    return min(1.0, total)
+
+
+def build_form_analysis(form, response_filter):
+    """
+    Full (exact) analysis payload of a form over the filtered responses.
+    
+    Each question's answers are read as a compact column batch ((value,
+    count) rows grouped on the typed answer column, or raw token-count JSON
+    for text questions) and analyzed by ``analyze_columns``. Large forms
+    spread the batches over a process pool (FORM_ANALYSIS_WORKERS); results
+    are collected in question order, so the payload is the same either way.
+    
+    Archived responses (see archives.py) are read from their files in one
+    pass and their columns appended to each question's batch.
+    """
+    # Get all questions from all sections
+    all_questions = []
+    for section in form.sections.all():
+        for question in section.questions.all():
+            all_questions.append(question)
+    
+    archived_responses, archived = 0, {}
+    if form.archive_manifest:
+        archived_responses, archived = archived_columns(all_questions, response_filter.archived_records())
+    total_responses = response_filter.responses().count() + archived_responses
+    
+    if total_responses == 0:
+        return {
+            'total_responses': 0,
+            'filters': response_filter.describe(),
+            'questions': []
+        }
+    
+    def batches():
+        for question in all_questions:
+            answers = response_filter.answers(Answer.objects.filter(question=question))
+            columns = question_columns(question, answers)
+            if question.id in archived:
+                # Not popped: the serial fallback below reads the batches again
+                columns = merge_columns(columns, archived[question.id])
+            yield question, columns
+    
+    results = None
+    if _use_pool(total_responses * len(all_questions)):
+        try:
+            results = list(map_in_pool(_get_pool(), batches(), window=2 * settings.FORM_ANALYSIS_WORKERS))
+        except BrokenProcessPool:
+            # A pool process died; start a fresh pool next time
+            _reset_pool()
+    if results is None:
+        results = [analyze_columns(question, columns) for question, columns in batches()]
+    
+    # Analyze each question
+    question_analyses = []
+    for question, (total_answers, data, refreshed) in zip(all_questions, results):
+        if refreshed:
+            _save_token_counts(refreshed)
+        question_analyses.append({
+            'question_id': question.id,
+            'question_text': question.text,
+            'question_type': question.type,
+            'total_answers': total_answers,
+            'data': data
+        })
+    
+    return {
+        'total_responses': total_responses,
+        'filters': response_filter.describe(),
+        'questions': question_analyses
+    }
+
+
+def question_columns(question, answers):
+    """
+    The answer data a question's analysis needs, as plain lists that are
+    cheap to pickle. Choice and rating questions are aggregated in SQL on
+    their typed column: ``weighted`` holds (value, count) rows and
+    ``total`` the number of answers. Text questions carry the cached token
+    strings (``text_analysis.cached_tokens``) plus the (id, value) of
+    answers whose tokens are missing or outdated. While a question's typed columns are being
+    refreshed after a type change (``typed_values_pending``), its answers
+    are aggregated on their stored values instead.
+    """
+    if question.typed_values_pending and question.type not in text_analysis.TEXT_QUESTION_TYPES:
+        columns = {'total': 0, 'weighted': []}
+        counts = Counter()
+        # Grouped in SQL: only the distinct stored values are converted here
+        for value, count in answers.values_list('value').annotate(count=Count('id')).order_by():
+            add_stored_value(question, value, columns, counts, count)
+        columns['weighted'] += weighted_counts(question, counts)
+        return columns
+    if question.type not in text_analysis.TEXT_QUESTION_TYPES:
+        field = typed_field(question)
+        rows = list(answers.values_list(field).annotate(count=Count('id')).order_by())
+        weighted = [(typed_value(question, value), count) for value, count in rows if value is not None]
+        if question.type == 'multi_choice' and any(value is None for value, _ in rows):
+            # Selections without a mask (see models.choice_mask) are read as stored
+            weighted += [
+                (value, 1)
+                for value in answers.filter(value_choice_mask__isnull=True).values_list('value', flat=True)
+            ]
+        return {'total': sum(count for _, count in rows), 'weighted': weighted}
+    
+    current = answers.filter(token_counts__v=text_analysis.TOKEN_COUNTS_VERSION)
+    columns = {
+        # Token strings read straight from the JSON, never decoding it (see cached_tokens)
+        'tokens': [
+            tokens if int(length) else None
+            for length, tokens in (
+                current
+                .values_list(KT('token_counts__len'), KT('token_counts__tokens'))
+                .iterator(chunk_size=2000)
+            )
+        ],
+        'stale': list(
+            answers
+            # Not current: no tokens (NULL), or without a version or of an older one
+            .filter(~Q(token_counts__v=text_analysis.TOKEN_COUNTS_VERSION) | Q(token_counts__v__isnull=True))
+            .values_list('id', 'value')
+            .iterator(chunk_size=2000)
+        ),
+    }
+    if question.type == 'textarea' and question.typed_values_pending:
+        # String values, whose JSON encoding starts with a quote
+        columns['samples'] = list(
+            answers.annotate(value_json=Cast('value', TextField()))
+            .filter(value_json__startswith='"')
+            .values_list('value', flat=True)[:20]
+        )
+    elif question.type == 'textarea':
+        columns['samples'] = list(answers.filter(value_text__isnull=False).values_list('value_text', flat=True)[:20])
+    return columns
+
+
+def archived_columns(questions, records):
+    """
+    Column batches, shaped like question_columns, of the answers in
+    archived response records; returns (number of records, {question id:
+    columns}). Text answers whose cached counts are outdated are
+    tokenized here (archived answers can't be updated).
+    """
+    questions = {question.id: question for question in questions}
+    columns = {}
+    counts = {}
+    for question_id, question in questions.items():
+        if question.type in text_analysis.TEXT_QUESTION_TYPES:
+            columns[question_id] = {'tokens': [], 'stale': []}
+            if question.type == 'textarea':
+                columns[question_id]['samples'] = []
+        else:
+            columns[question_id] = {'total': 0, 'weighted': []}
+            counts[question_id] = Counter()
+    
+    total_records = 0
+    for record in records:
+        total_records += 1
+        for answer in record['answers']:
+            question = questions.get(answer['question_id'])
+            if question is None:
+                continue
+            value = answer['value']
+            batch = columns[question.id]
+            if question.type in text_analysis.TEXT_QUESTION_TYPES:
+                token_counts = answer['token_counts']
+                if not text_analysis.is_current(token_counts):
+                    token_counts = text_analysis.token_counts(value)
+                batch['tokens'].append(text_analysis.cached_tokens(token_counts))
+                if 'samples' in batch and isinstance(value, str) and len(batch['samples']) < 20:
+                    batch['samples'].append(value)
+                continue
+            add_stored_value(question, value, batch, counts[question.id])
+    
+    for question_id, typed_counts in counts.items():
+        columns[question_id]['weighted'] += weighted_counts(questions[question_id], typed_counts)
+    return total_records, columns
+
+
+def add_stored_value(question, value, columns, counts, count=1):
+    """Count a stored answer value of a choice or rating question as its typed column would hold it"""
+    columns['total'] += count
+    typed = typed_answer_values(question, value)[typed_field(question)]
+    if typed is not None:
+        counts[typed] += count
+    elif question.type == 'multi_choice':
+        # Read as stored, like selections without a mask in question_columns
+        columns['weighted'].append((value, count))
+
+
+def weighted_counts(question, counts):
+    """(value, count) rows of the typed values counted by add_stored_value"""
+    return [(typed_value(question, typed), count) for typed, count in counts.items()]
+
+
+def merge_columns(columns, other):
+    """Concatenate two column batches of the same question"""
+    if 'tokens' not in columns:
+        return {'total': columns['total'] + other['total'], 'weighted': columns['weighted'] + other['weighted']}
+    merged = {
+        'tokens': columns['tokens'] + other['tokens'],
+        'stale': columns['stale'] + other['stale'],
+    }
+    if 'samples' in columns:
+        merged['samples'] = (columns['samples'] + other['samples'])[:20]
+    return merged
+
+
+def typed_field(question):
+    """The Answer column holding the typed value of a question's answers"""
+    if question.type == 'single_choice':
+        return 'value_choice'
+    if question.type == 'multi_choice':
+        return 'value_choice_mask'
+    if question.type in NUMERIC_QUESTION_TYPES:
+        return 'value_num'
+    return 'value_text'
+
+
+def typed_value(question, value):
+    """An answer value as stored in its typed column, back in the shape of Answer.value"""
+    if value is None:
+        return None
+    if question.type == 'multi_choice':
+        return choice_mask_values(question, value)
+    if question.type in NUMERIC_QUESTION_TYPES and value.is_integer():
+        return int(value)
+    return value
+
+
+def analyze_columns(question, columns):
+    """
+    Analyze one question's column batch. Runs without database access, so
+    it can execute in a pool process. Returns (total_answers, data,
+    refreshed) where refreshed lists (answer_id, token_counts) computed for
+    stale text answers, for the caller to persist.
+    """
+    if question.type in text_analysis.TEXT_QUESTION_TYPES:
+        frequencies = text_analysis.TermFrequencies()
+        for tokens in columns['tokens']:
+            frequencies.add_tokens(tokens)
+        refreshed = []
+        for answer_id, value in columns['stale']:
+            # Answers saved before counts were cached (or by an older
+            # tokenizer): compute them once
+            counts = text_analysis.token_counts(value)
+            frequencies.add(counts)
+            refreshed.append((answer_id, counts))
+        total_answers = len(columns['tokens']) + len(columns['stale'])
+        data = _analyze_text(frequencies, columns.get('samples', []), short=question.type == 'text')
+        return total_answers, data, refreshed
+    
+    return columns['total'], analyze_question(question, columns['weighted'], columns['total']), []
+
+
+def analyze_question(question, weighted_values, total):
+    """Analyze (answer value, count) rows based on question type"""
+    if question.type == 'single_choice':
+        return _analyze_single_choice(question, weighted_values, total)
+    elif question.type == 'multi_choice':
+        return _analyze_multi_choice(question, weighted_values, total)
+    elif question.type in ['rating', 'scale']:
+        return _analyze_rating_scale(question, weighted_values)
+    return {}
+
+
+def _in_option_order(question, counts):
+    """A Counter with the question's options first, in form order (most_common breaks ties in this order)"""
+    positions = {value: i for i, value in enumerate(value_labels(question))}
+    ordered = sorted(counts, key=lambda value: (positions.get(value, len(positions)), str(value)))
+    return Counter({value: counts[value] for value in ordered})
+
+
+def _analyze_single_choice(question, weighted_values, total):
+    """Analyze single choice questions"""
+    option_counts = Counter()
+    for value, count in weighted_values:
+        if isinstance(value, str):
+            option_counts[value] += count
+    option_counts = _in_option_order(question, option_counts)
+    
+    # Get option texts
+    options_map = value_labels(question)
+    
+    distribution = []
+    for value, count in option_counts.most_common():
+        distribution.append({
+            'value': value,
+            'label': options_map.get(value, value),
+            'count': count,
+            'percentage': round((count / total) * 100, 1) if total else 0
+        })
+    
+    return {
+        'distribution': distribution,
+        'total': total
+    }
+
+
+def _analyze_multi_choice(question, weighted_values, total):
+    """Analyze multiple choice questions"""
+    option_counts = Counter()
+    total_selections = 0
+    co_occurrence = {}
+    
+    for values, count in weighted_values:
+        if isinstance(values, list):
+            total_selections += len(values) * count
+            for value in values:
+                option_counts[value] += count
+            
+            # Track co-occurrence
+            for i, v1 in enumerate(values):
+                if v1 not in co_occurrence:
+                    co_occurrence[v1] = Counter()
+                for v2 in values[i+1:]:
+                    co_occurrence[v1][v2] += count
+                    if v2 not in co_occurrence:
+                        co_occurrence[v2] = Counter()
+                    co_occurrence[v2][v1] += count
+    option_counts = _in_option_order(question, option_counts)
+    
+    options_map = value_labels(question)
+    
+    distribution = []
+    for value, count in option_counts.most_common():
+        distribution.append({
+            'value': value,
+            'label': options_map.get(value, value),
+            'count': count,
+            'percentage': round((count / total) * 100, 1) if total else 0
+        })
+    
+    # Build co-occurrence matrix
+    co_occurrence_matrix = []
+    for value1 in option_counts.keys():
+        row = []
+        for value2 in option_counts.keys():
+            if value1 == value2:
+                row.append(option_counts[value1])
+            else:
+                row.append(co_occurrence.get(value1, Counter()).get(value2, 0))
+        co_occurrence_matrix.append({
+            'option': value1,
+            'label': options_map.get(value1, value1),
+            'co_occurrences': row
+        })
+    
+    return {
+        'distribution': distribution,
+        'total_responses': total,
+        'total_selections': total_selections,
+        'average_selections': round(total_selections / total, 2) if total else 0,
+        'co_occurrence_matrix': co_occurrence_matrix
+    }
+
+
+def _analyze_rating_scale(question, weighted_values):
+    """Analyze rating/scale questions"""
+    value_counts = Counter()
+    for value, count in weighted_values:
+        if isinstance(value, (int, float)):
+            value_counts[float(value)] += count
+    n = sum(value_counts.values())
+    
+    if not n:
+        return {
+            'distribution': [],
+            'statistics': {}
+        }
+    
+    # Distribution
+    scale = question.scale or {}
+    min_val = scale.get('min', 1)
+    max_val = scale.get('max', 5)
+    labels_map = value_labels(question)
+    
+    distribution = []
+    for i in range(int(min_val), int(max_val) + 1):
+        count = value_counts[i]
+        distribution.append({
+            'value': i,
+            'label': labels_map.get(i, str(i)),
+            'count': count,
+            'percentage': round((count / n) * 100, 1)
+        })
+    
+    # Statistics
+    ordered = sorted(value_counts.items())
+    mean = sum(value * count for value, count in ordered) / n
+    seen = 0
+    for median, count in ordered:
+        seen += count
+        if seen > n // 2:
+            break
+    
+    # Calculate standard deviation
+    variance = sum(count * (value - mean) ** 2 for value, count in ordered) / n
+    std_dev = variance ** 0.5
+    
+    # NPS-style scoring (promoters vs detractors)
+    promoters = sum(count for value, count in ordered if value >= max_val - 1)
+    detractors = sum(count for value, count in ordered if value <= min_val + 1)
+    nps_score = ((promoters - detractors) / n) * 100
+    
+    return {
+        'distribution': distribution,
+        'statistics': {
+            'mean': round(mean, 2),
+            'median': round(median, 2),
+            'std_dev': round(std_dev, 2),
+            'min': ordered[0][0],
+            'max': ordered[-1][0],
+            'nps_score': round(nps_score, 1),
+            'promoters': promoters,
+            'detractors': detractors
+        },
+        'total': n
+    }
+
+
+def _analyze_text(frequencies, sample_values, short=False):
+    """Analyze text/textarea questions from their merged term frequencies"""
+    if not frequencies.total:
+        return {
+            'total': 0,
+            'frequency': [],
+            'word_cloud': []
+        }
+    
+    if short:
+        # For short text: frequency analysis
+        frequency = frequencies.top_words(20)
+        
+        return {
+            'total': frequencies.total,
+            'frequency': frequency,
+            'bigrams': frequencies.top_bigrams(10),
+            'word_cloud': frequency[:10]  # Top 10 for word cloud
+        }
+    else:
+        # For long text: word and phrase frequency plus a few samples
+        frequency = frequencies.top_words(30)
+        samples = [value.strip() for value in sample_values if isinstance(value, str) and value.strip()]
+        
+        return {
+            'total': frequencies.total,
+            'frequency': frequency,
+            'bigrams': frequencies.top_bigrams(15),
+            'word_cloud': frequency[:15],
+            'sample_responses': samples[:5]  # Show first 5 responses as samples
+        }
+
+
+def _save_token_counts(refreshed):
+    stale_answers = [Answer(id=answer_id, token_counts=counts) for answer_id, counts in refreshed]
+    Answer.objects.bulk_update(stale_answers, ['token_counts'], batch_size=1000)
+
+
+# Process pool for large forms. Spawned (not forked) so workers never share
+# the web process's database connections or threads; it is created on
+# first use and kept for the life of the process.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _use_pool(estimated_answers):
+    return (
+        settings.FORM_ANALYSIS_WORKERS > 1
+        and estimated_answers >= settings.FORM_ANALYSIS_PARALLEL_MIN_ANSWERS
+        # Daemonic processes (e.g. multiprocessing.Pool workers) can't have children
+        and not multiprocessing.current_process().daemon
+    )
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.FORM_ANALYSIS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def map_in_pool(pool, batches, window):
+    """
+    analyze_columns over (question, columns) batches in the pool, yielding
+    results in input order. At most ``window`` batches are in flight, so
+    only a bounded number of columns is held in memory.
+    """
+    pending = deque()
+    for question, columns in batches:
+        pending.append(pool.submit(analyze_columns, question, columns))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,221 @@
+"""
+Cache for computed form analysis payloads.
+
+Entries are keyed by (form, form revision, filter hash) and remember the
+watermark they cover: the latest response ``seq`` of the form and its
+submission counter, which submissions bump in the cache as they commit
+(``record_submission_on_commit``) so a response committing after one
+with a higher seq still counts. Reading the current watermark is one
+probe of the (form, seq) index plus a cache read whatever the number of
+responses, so a new submission (or import) makes the entry stale
+without any explicit invalidation, while editing the form changes its
+revision.
+
+Concurrent misses for the same key are coalesced: threads in a process
+share a lock per key, and processes coordinate through a short-lived lock
+entry in the cache (``cache.add`` is atomic on every backend), so only one
+computation runs per key; a lock entry holds a token of its holder, so a
+computation only releases the lock it acquired. A request waiting for
+another process gives up after ``FORM_ANALYSIS_CACHE_WAIT_TIMEOUT``
+seconds and computes the payload itself. For forms with many
+responses a stale entry is served immediately while one background
+refresh recomputes it (stale-while-revalidate).
+
+Hit/miss counters are kept in the cache as well and exposed through
+``stats()``. Configure a shared cache (``REDIS_URL``) in production so
+coalescing and counters work across worker processes.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Max
+
+from .models import Response as FormResponse
+
+
+CACHE_VERSION = 1
+LOCK_TIMEOUT = 300  # seconds; a crashed computation releases the key after this
+WAIT_INTERVAL = 0.05
+COUNTERS = ('hit', 'miss', 'stale', 'coalesced')
+
+# key -> [lock, number of threads using it]; entries are dropped by the last user
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def watermark(form):
+    """Latest response seq and submission counter of the form"""
+    latest = FormResponse.objects.filter(form=form).aggregate(latest=Max('seq'))['latest']
+    return latest, _submissions(form.id)
+
+
+def record_submission_on_commit(form_id):
+    """Bump the form's submission counter once the current transaction commits"""
+    def bump():
+        try:
+            cache.incr(_submissions_key(form_id))
+        except ValueError:
+            # Not counted yet (or evicted): the next read starts a fresh counter
+            pass
+    transaction.on_commit(bump)
+
+
+def cache_key(form, response_filter):
+    return f'form-analysis:{form.id}:{form.updated_at.timestamp()}:{response_filter.cache_key()}'
+
+
+def get_or_compute(key, current_watermark, compute, allow_stale=None):
+    """
+    Return (payload, state) for the key, where state is one of COUNTERS.
+    ``compute`` is called at most once per key at a time. ``allow_stale``
+    is called with a stale cached payload and says whether it may be
+    served while it is recomputed in the background.
+    """
+    entry = cache.get(key, version=CACHE_VERSION)
+    if entry is not None and entry['watermark'] == current_watermark:
+        _count('hit')
+        return entry['payload'], 'hit'
+
+    if entry is not None and allow_stale is not None and allow_stale(entry['payload']):
+        token = _acquire(key)
+        if token is not None:
+            # Run in a copy of this context, so the refresh reads from the same database (see replicas.py)
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(_refresh_in_background, key, token, current_watermark, compute),
+                daemon=True,
+            ).start()
+        _count('stale')
+        return entry['payload'], 'stale'
+
+    with _local_lock(key):
+        # Another thread of this process may have just filled the entry
+        entry = cache.get(key, version=CACHE_VERSION)
+        if entry is not None and entry['watermark'] == current_watermark:
+            _count('coalesced')
+            return entry['payload'], 'coalesced'
+        token = _acquire(key)
+        if token is not None:
+            # Threads of this process wait on the local lock meanwhile
+            return _compute(key, token, current_watermark, compute), 'miss'
+
+    # Another process is computing this key: wait for its result without the local lock
+    deadline = time.monotonic() + settings.FORM_ANALYSIS_CACHE_WAIT_TIMEOUT
+    while token is None:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key, version=CACHE_VERSION)
+        if entry is not None and entry['watermark'] == current_watermark:
+            _count('coalesced')
+            return entry['payload'], 'coalesced'
+        if time.monotonic() > deadline:
+            # Compute without the lock, which stays its holder's
+            break
+        token = _acquire(key)
+    return _compute(key, token, current_watermark, compute), 'miss'
+
+
+def peek(key, current_watermark):
+    """The cached payload if it is fresh, without computing anything"""
+    entry = cache.get(key, version=CACHE_VERSION)
+    if entry is not None and entry['watermark'] == current_watermark:
+        return entry['payload']
+    return None
+
+
+def store(key, current_watermark, payload):
+    cache.set(
+        key,
+        {'watermark': current_watermark, 'payload': payload},
+        timeout=settings.FORM_ANALYSIS_CACHE_TIMEOUT,
+        version=CACHE_VERSION,
+    )
+
+
+def stats():
+    values = cache.get_many([_counter_key(name) for name in COUNTERS])
+    counts = {name: values.get(_counter_key(name), 0) for name in COUNTERS}
+    lookups = sum(counts.values())
+    counts['hit_ratio'] = round((counts['hit'] + counts['coalesced']) / lookups, 4) if lookups else None
+    return counts
+
+
+def _compute(key, token, current_watermark, compute):
+    try:
+        payload = compute()
+        store(key, current_watermark, payload)
+    finally:
+        if token is not None:
+            _release(key, token)
+    _count('miss')
+    return payload
+
+
+def _refresh_in_background(key, token, current_watermark, compute):
+    try:
+        store(key, current_watermark, compute())
+    finally:
+        _release(key, token)
+        connections.close_all()
+
+
+def _acquire(key):
+    """A token holding the key's lock, or None when another computation holds it"""
+    token = uuid.uuid4().hex
+    if cache.add(f'{key}:lock', token, timeout=LOCK_TIMEOUT, version=CACHE_VERSION):
+        return token
+    return None
+
+
+def _release(key, token):
+    # Past LOCK_TIMEOUT the lock may have expired and been taken by another computation
+    if cache.get(f'{key}:lock', version=CACHE_VERSION) == token:
+        cache.delete(f'{key}:lock', version=CACHE_VERSION)
+
+
+def _submissions_key(form_id):
+    return f'form-analysis:submissions:{form_id}'
+
+
+def _submissions(form_id):
+    key = _submissions_key(form_id)
+    value = cache.get(key)
+    if value is None:
+        # Start from a value an evicted counter can't have reached, so old entries stay stale
+        cache.add(key, time.time_ns(), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+@contextlib.contextmanager
+def _local_lock(key):
+    with _local_locks_guard:
+        entry = _local_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _local_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _local_locks[key]
+
+
+def _counter_key(name):
+    return f'form-analysis:stats:{name}'
+
+
+def _count(name):
+    key = _counter_key(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
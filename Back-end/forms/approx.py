@@ -0,0 +1,362 @@
+"""
+Approximate analysis for very large forms (``GET /forms/{id}/analysis/?approx=1``).
+
+Every question keeps mergeable sketch state in ``QuestionSketch`` rows that
+are updated when responses are submitted, so an approximate analysis reads
+a handful of small rows per question no matter how many answers exist:
+
+- choice questions: exact option (and option pair) counters
+- rating/scale: exact counts and moments, KLL sketch for quantiles
+- text/textarea: count-min sketches of word and phrase (bigram) frequencies,
+  reservoir of samples
+
+Each submission updates one of ``FORM_ANALYSIS_SKETCH_SHARDS`` shards picked
+at random, so concurrent submissions rarely wait on the same row lock;
+reads merge the shards. Every reported metric carries its error bound.
+
+Sketches only grow: they cover every response ever recorded for the form
+and ignore analysis filters. ``manage.py rebuild_sketches`` recomputes
+them from the stored answers (e.g. after deleting responses).
+"""
+import logging
+import random
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .analysis import CHOICE_QUESTION_TYPES, NUMERIC_QUESTION_TYPES, value_labels
+from .models import Answer, Question, QuestionSketch
+from .sketches import CountMinSketch, KLLSketch, ReservoirSample
+from . import archives, text_analysis
+
+
+SAMPLE_TEXT_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionSketchState:
+    """Sketch state of one question, serialized into QuestionSketch.state"""
+
+    def __init__(self, question_type, state=None):
+        self.question_type = question_type
+        state = state or {}
+        self.n = state.get('n', 0)
+        if question_type in CHOICE_QUESTION_TYPES:
+            self.counts = defaultdict(int, state.get('counts', {}))
+            self.selections = state.get('selections', 0)
+            self.pairs = defaultdict(lambda: defaultdict(int))
+            for first, row in state.get('pairs', {}).items():
+                self.pairs[first].update(row)
+        elif question_type in NUMERIC_QUESTION_TYPES:
+            self.counts = defaultdict(int, state.get('counts', {}))
+            self.total = state.get('sum', 0.0)
+            self.total_squares = state.get('sum_sq', 0.0)
+            self.kll = KLLSketch.from_state(state.get('kll'))
+        else:
+            self.cms = CountMinSketch.from_state(state.get('cms'))
+            # Sketches recorded before phrases were tracked have no bigram state;
+            # bigram_n counts the answers the phrase sketch actually covers
+            self.bigram_cms = CountMinSketch.from_state(state.get('bigram_cms'))
+            self.bigram_n = state.get('bigram_n', 0)
+            self.samples = ReservoirSample.from_state(state.get('samples'))
+
+    def add(self, value, token_counts=None):
+        if self.question_type == 'single_choice':
+            if isinstance(value, str):
+                self.n += 1
+                self.counts[value] += 1
+        elif self.question_type == 'multi_choice':
+            if isinstance(value, list):
+                self.n += 1
+                self.selections += len(value)
+                for i, first in enumerate(value):
+                    self.counts[first] += 1
+                    for second in value[i + 1:]:
+                        self.pairs[first][second] += 1
+                        self.pairs[second][first] += 1
+        elif self.question_type in NUMERIC_QUESTION_TYPES:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.n += 1
+                self.counts[str(value)] += 1
+                self.total += value
+                self.total_squares += value * value
+                self.kll.update(value)
+        else:
+            if not text_analysis.is_current(token_counts):
+                token_counts = text_analysis.token_counts(value)
+            tokens = text_analysis.cached_tokens(token_counts)
+            if tokens is None:
+                return
+            self.n += 1
+            self.bigram_n += 1
+            tokens = tokens.split()
+            for term, count in Counter(tokens).items():
+                self.cms.add(term, count)
+            for (first, second), count in Counter(zip(tokens, tokens[1:])).items():
+                self.bigram_cms.add(f'{first} {second}', count)
+            self.samples.add(value.strip()[:SAMPLE_TEXT_LENGTH])
+
+    def merge(self, other):
+        self.n += other.n
+        if self.question_type in CHOICE_QUESTION_TYPES:
+            self.selections += other.selections
+            for value, count in other.counts.items():
+                self.counts[value] += count
+            for first, row in other.pairs.items():
+                for second, count in row.items():
+                    self.pairs[first][second] += count
+        elif self.question_type in NUMERIC_QUESTION_TYPES:
+            for value, count in other.counts.items():
+                self.counts[value] += count
+            self.total += other.total
+            self.total_squares += other.total_squares
+            self.kll.merge(other.kll)
+        else:
+            self.cms.merge(other.cms)
+            self.bigram_cms.merge(other.bigram_cms)
+            self.bigram_n += other.bigram_n
+            self.samples.merge(other.samples)
+
+    def to_state(self):
+        state = {'n': self.n}
+        if self.question_type in CHOICE_QUESTION_TYPES:
+            state.update(counts=dict(self.counts), selections=self.selections,
+                         pairs={first: dict(row) for first, row in self.pairs.items()})
+        elif self.question_type in NUMERIC_QUESTION_TYPES:
+            state.update(counts=dict(self.counts), sum=self.total, sum_sq=self.total_squares,
+                         kll=self.kll.to_state())
+        else:
+            state.update(cms=self.cms.to_state(), bigram_cms=self.bigram_cms.to_state(),
+                         bigram_n=self.bigram_n, samples=self.samples.to_state())
+        return state
+
+    def summarize(self, question):
+        """Analysis data in the shape of the exact analysis, plus error bounds"""
+        if self.question_type == 'single_choice':
+            return self._summarize_single_choice(question)
+        if self.question_type == 'multi_choice':
+            return self._summarize_multi_choice(question)
+        if self.question_type in NUMERIC_QUESTION_TYPES:
+            return self._summarize_rating_scale(question)
+        return self._summarize_text(short=self.question_type == 'text')
+
+    def _distribution(self, question):
+        options_map = value_labels(question)
+        return [
+            {
+                'value': value,
+                'label': options_map.get(value, value),
+                'count': count,
+                'percentage': round((count / self.n) * 100, 1) if self.n else 0
+            }
+            for value, count in sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        ]
+
+    def _summarize_single_choice(self, question):
+        return {
+            'distribution': self._distribution(question),
+            'total': self.n,
+            'error': {'count': 0}
+        }
+
+    def _summarize_multi_choice(self, question):
+        options_map = value_labels(question)
+        values = [value for value, _ in sorted(self.counts.items(), key=lambda item: item[1], reverse=True)]
+        return {
+            'distribution': self._distribution(question),
+            'total_responses': self.n,
+            'total_selections': self.selections,
+            'average_selections': round(self.selections / self.n, 2) if self.n else 0,
+            'co_occurrence_matrix': [
+                {
+                    'option': first,
+                    'label': options_map.get(first, first),
+                    'co_occurrences': [
+                        self.counts[first] if first == second else self.pairs.get(first, {}).get(second, 0)
+                        for second in values
+                    ]
+                }
+                for first in values
+            ],
+            'error': {'count': 0}
+        }
+
+    def _summarize_rating_scale(self, question):
+        if not self.n:
+            return {'distribution': [], 'statistics': {}}
+        counts = defaultdict(int)
+        for value, count in self.counts.items():
+            number = float(value)
+            counts[int(number) if number.is_integer() else number] += count
+        scale = question.scale or {}
+        min_val = scale.get('min', 1)
+        max_val = scale.get('max', 5)
+        labels_map = value_labels(question)
+        mean = self.total / self.n
+        variance = max(self.total_squares / self.n - mean ** 2, 0)
+        promoters = sum(count for value, count in counts.items() if value >= max_val - 1)
+        detractors = sum(count for value, count in counts.items() if value <= min_val + 1)
+        return {
+            'distribution': [
+                {
+                    'value': i,
+                    'label': labels_map.get(i, str(i)),
+                    'count': counts.get(i, 0),
+                    'percentage': round((counts.get(i, 0) / self.n) * 100, 1)
+                }
+                for i in range(int(min_val), int(max_val) + 1)
+            ],
+            'statistics': {
+                'mean': round(mean, 2),
+                'median': round(self.kll.quantile(0.5), 2),
+                'p25': round(self.kll.quantile(0.25), 2),
+                'p75': round(self.kll.quantile(0.75), 2),
+                'p90': round(self.kll.quantile(0.9), 2),
+                'std_dev': round(variance ** 0.5, 2),
+                'min': min(counts),
+                'max': max(counts),
+                'nps_score': round(((promoters - detractors) / self.n) * 100, 1),
+                'promoters': promoters,
+                'detractors': detractors
+            },
+            'total': self.n,
+            'error': {
+                'count': 0,
+                'quantile_rank_error': self.kll.rank_error
+            }
+        }
+
+    def _summarize_text(self, short):
+        if not self.n:
+            return {'total': 0, 'frequency': [], 'word_cloud': []}
+        stopwords = text_analysis.get_stopwords()
+        size = 20 if short else 30
+        frequency = []
+        for word, count in self.cms.most_common():
+            if text_analysis.is_term(word, stopwords):
+                frequency.append({'word': word, 'count': count})
+                if len(frequency) == size:
+                    break
+        bigrams = []
+        for phrase, count in self.bigram_cms.most_common():
+            if all(text_analysis.is_term(word, stopwords) for word in phrase.split(' ')):
+                bigrams.append({'phrase': phrase, 'count': count})
+                if len(bigrams) == (10 if short else 15):
+                    break
+        data = {
+            'total': self.n,
+            'frequency': frequency,
+            'bigrams': bigrams,
+            'word_cloud': frequency[:10 if short else 15],
+            'error': {
+                'count_overestimate': self.cms.error_bound,
+                'bigram_count_overestimate': self.bigram_cms.error_bound,
+                'confidence': self.cms.confidence
+            }
+        }
+        if self.bigram_n < self.n:
+            data['error']['bigrams'] = (
+                f'covers {self.bigram_n} of {self.n} answers; run manage.py rebuild_sketches'
+            )
+        if not short:
+            data['sample_responses'] = self.samples.items[:5]
+            data['error']['samples'] = 'uniform random sample'
+        return data
+
+
+def record_answers_on_commit(answers):
+    """
+    record_answers once the current transaction commits. A failure is
+    logged, not raised: the submission is already stored, and
+    ``manage.py rebuild_sketches`` brings the sketches back in line.
+    """
+    def record():
+        try:
+            record_answers(answers)
+        except Exception:
+            logger.exception('Could not record %d answers in the analysis sketches', len(answers))
+    transaction.on_commit(record)
+
+
+def record_answers(answers):
+    """Fold newly created answers (with their question loaded) into the sketches"""
+    by_question = defaultdict(list)
+    for answer in answers:
+        by_question[answer.question].append(answer)
+    if not by_question:
+        return
+    questions = {question.id: question for question in by_question}
+    shard = random.randrange(settings.FORM_ANALYSIS_SKETCH_SHARDS)
+    with transaction.atomic():
+        QuestionSketch.objects.bulk_create(
+            [QuestionSketch(question_id=question_id, shard=shard) for question_id in questions],
+            ignore_conflicts=True
+        )
+        rows = list(
+            QuestionSketch.objects
+            .select_for_update()
+            .filter(question_id__in=questions, shard=shard)
+            .order_by('question_id')
+        )
+        now = timezone.now()
+        for row in rows:
+            question = questions[row.question_id]
+            state = QuestionSketchState(question.type, row.state)
+            for answer in by_question[question]:
+                state.add(answer.value, answer.token_counts)
+            row.state = state.to_state()
+            row.updated_at = now
+        QuestionSketch.objects.bulk_update(rows, ['state', 'updated_at'])
+
+
+def rebuild(form):
+    """Recompute the sketches of a form's questions from its stored (and archived) answers"""
+    questions = list(Question.objects.filter(section__form=form))
+    states = {question.id: QuestionSketchState(question.type) for question in questions}
+    for record in archives.iter_records(form):
+        for answer in record['answers']:
+            if answer['question_id'] in states:
+                states[answer['question_id']].add(answer['value'], answer['token_counts'])
+    archived_until = form.archived_until()
+    for question in questions:
+        state = states[question.id]
+        answers = Answer.objects.filter(form=form, question=question).values_list('value', 'token_counts')
+        if archived_until is not None:
+            answers = answers.filter(submitted_at__gt=archived_until)
+        for value, token_counts in answers.iterator(chunk_size=2000):
+            state.add(value, token_counts)
+        with transaction.atomic():
+            QuestionSketch.objects.filter(question=question).delete()
+            QuestionSketch.objects.create(question=question, shard=0, state=state.to_state())
+    return len(questions)
+
+
+def analyze_form(form, total_responses):
+    """Approximate analysis payload built only from the persisted sketches"""
+    states = {}
+    for row in QuestionSketch.objects.filter(question__section__form=form).select_related('question'):
+        shard_state = QuestionSketchState(row.question.type, row.state)
+        if row.question_id in states:
+            states[row.question_id].merge(shard_state)
+        else:
+            states[row.question_id] = shard_state
+
+    question_analyses = []
+    for section in form.sections.all():
+        for question in section.questions.all():
+            state = states.get(question.id) or QuestionSketchState(question.type)
+            question_analyses.append({
+                'question_id': question.id,
+                'question_text': question.text,
+                'question_type': question.type,
+                'total_answers': state.n,
+                'data': state.summarize(question)
+            })
+    return {
+        'total_responses': total_responses,
+        'approximate': True,
+        'questions': question_analyses
+    }
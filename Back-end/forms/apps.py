@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FormsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'forms'
+    
+    def ready(self):
+        # Connects the receiver dropping cached token stamps when a user is saved
+        from . import authentication  # noqa: F401
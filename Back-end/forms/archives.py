@@ -0,0 +1,327 @@
+"""
+Cold-storage archival of closed forms' responses (``manage.py archive_responses``).
+
+A form that is unpublished and has received no responses for
+FORM_ARCHIVE_AFTER_DAYS has its responses streamed, oldest first, into an
+archive file under ARCHIVE_ROOT: gzip-compressed NDJSON (one response per
+line, answers inlined, like the change feed) or a zstd-compressed Parquet
+table in long format (one row per answer, values as JSON). The file's
+SHA-256 is computed while it is written and checked, together with the
+response and answer counts, by reading it back before anything is deleted.
+Then a segment entry is appended to ``Form.archive_manifest`` and the rows
+are deleted in chunks.
+
+Each segment covers the form's responses up to its ``until`` timestamp.
+``filters.ResponseFilter`` keeps database queries to responses after the
+newest segment, and ``iter_records`` reads the segments back, so analysis,
+exports and sketch rebuilds see archived and live responses alike.
+"""
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import exports
+from .models import Answer, Form, Response as FormResponse
+
+
+ARCHIVE_FORMATS = ('ndjson', 'parquet')
+ARCHIVE_EXTENSIONS = {'ndjson': 'ndjson.gz', 'parquet': 'parquet'}
+READ_CHUNK_SIZE = 2000
+PARQUET_ROW_GROUP_SIZE = 100000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_path(name):
+    """Where archive files live (ARCHIVE_ROOT)"""
+    return settings.ARCHIVE_ROOT / name
+
+
+def eligible_forms(older_than_days=None):
+    """Unpublished forms with live responses, none of them (nor the form) touched within the retention window"""
+    days = settings.FORM_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now() - timedelta(days=days)
+    return (
+        Form.objects
+        .exclude(status='published')
+        .filter(updated_at__lt=cutoff)
+        .annotate(latest=Max('responses__submitted_at'))
+        .filter(latest__lt=cutoff)
+    )
+
+
+class _HashingWriter:
+    """Write-only file wrapper that hashes what passes through it"""
+
+    closed = False
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def _record_rows(responses):
+    """(response fields, [(question_id, value, token_counts)]) per response, oldest first"""
+    rows = (
+        responses
+        .order_by('submitted_at', 'id')
+        .values_list(
+            'id', 'seq', 'submitted_at', 'user_id', 'ip_address',
+            'answers__question_id', 'answers__value', 'answers__token_counts',
+        )
+        .iterator(chunk_size=READ_CHUNK_SIZE)
+    )
+    current = None
+    for response_id, seq, submitted_at, user_id, ip_address, question_id, value, token_counts in rows:
+        if current is None or current[0]['id'] != response_id:
+            if current is not None:
+                yield current
+            current = (
+                {'id': response_id, 'seq': seq, 'submitted_at': submitted_at,
+                 'user_id': user_id, 'ip_address': ip_address},
+                [],
+            )
+        if question_id is not None:
+            current[1].append((question_id, value, token_counts))
+    if current is not None:
+        yield current
+
+
+def _write_ndjson(output, records):
+    counts = [0, 0]
+    with gzip.GzipFile(fileobj=output, mode='wb', mtime=0) as compressed:
+        for response, answers in records:
+            line = json.dumps({
+                **response,
+                'id': str(response['id']),
+                # Full precision (DjangoJSONEncoder would cut it to milliseconds)
+                'submitted_at': response['submitted_at'].isoformat(),
+                'answers': [
+                    {'question_id': str(question_id), 'value': value, 'token_counts': token_counts}
+                    for question_id, value, token_counts in answers
+                ],
+            }, ensure_ascii=False)
+            compressed.write(line.encode() + b'\n')
+            counts[0] += 1
+            counts[1] += len(answers)
+    return counts
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        pa.field('response_id', pa.string(), nullable=False),
+        pa.field('seq', pa.int64()),
+        pa.field('submitted_at', pa.timestamp('us', tz='UTC'), nullable=False),
+        pa.field('user_id', pa.string()),
+        pa.field('ip_address', pa.string()),
+        pa.field('question_id', pa.string()),  # null for a response without answers
+        pa.field('value', pa.string()),  # JSON
+        pa.field('token_counts', pa.string()),  # JSON
+    ])
+
+
+def _write_parquet(output, records):
+    pa = exports.require_pyarrow()
+    schema = _parquet_schema(pa)
+    counts = [0, 0]
+    columns = {name: [] for name in schema.names}
+
+    def add_row(response, question_id=None, value=None, token_counts=None):
+        columns['response_id'].append(str(response['id']))
+        columns['seq'].append(response['seq'])
+        columns['submitted_at'].append(response['submitted_at'])
+        columns['user_id'].append(response['user_id'])
+        columns['ip_address'].append(response['ip_address'])
+        columns['question_id'].append(str(question_id) if question_id else None)
+        columns['value'].append(json.dumps(value, ensure_ascii=False) if question_id else None)
+        columns['token_counts'].append(json.dumps(token_counts) if token_counts is not None else None)
+
+    writer = pa.parquet.ParquetWriter(pa.PythonFile(output, mode='w'), schema, compression='zstd')
+    for response, answers in records:
+        for answer in answers:
+            add_row(response, *answer)
+        if not answers:
+            add_row(response)
+        counts[0] += 1
+        counts[1] += len(answers)
+        if len(columns['response_id']) >= PARQUET_ROW_GROUP_SIZE:
+            writer.write_table(pa.table(columns, schema=schema))
+            columns = {name: [] for name in schema.names}
+    if columns['response_id']:
+        writer.write_table(pa.table(columns, schema=schema))
+    writer.close()
+    return counts
+
+
+def archive_form(form, file_format='ndjson', chunk_size=2000):
+    """
+    Archive all of a form's live responses into a new segment and delete
+    them; returns the segment. Nothing is deleted unless the file reads
+    back with the expected checksum and counts.
+    """
+    if file_format not in ARCHIVE_FORMATS:
+        raise ArchiveError(f'Unknown archive format: {file_format}')
+    if file_format == 'parquet':
+        exports.require_pyarrow()
+    purge_archived(form, chunk_size)
+    responses = FormResponse.objects.filter(form=form)
+    stats = responses.aggregate(count=Count('id'), since=Min('submitted_at'), until=Max('submitted_at'))
+    if not stats['count']:
+        raise ArchiveError(f'Form {form.id} has no responses to archive')
+    until = stats['until']
+    responses = responses.filter(submitted_at__lte=until)
+    expected = (responses.count(), Answer.objects.filter(form=form, submitted_at__lte=until).count())
+
+    name = f'form-{form.id}/{until:%Y%m%dT%H%M%S%f}.{ARCHIVE_EXTENSIONS[file_format]}'
+    path = archive_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    with open(partial, 'wb') as raw:
+        output = _HashingWriter(raw)
+        writer = _write_ndjson if file_format == 'ndjson' else _write_parquet
+        written = tuple(writer(output, _record_rows(responses)))
+        raw.flush()
+        os.fsync(raw.fileno())
+    if written != expected:
+        partial.unlink()
+        raise ArchiveError(f'Wrote {written} (responses, answers), expected {expected}; responses changed meanwhile?')
+
+    segment = {
+        'file': name,
+        'format': file_format,
+        'sha256': output.sha256.hexdigest(),
+        'bytes': output.size,
+        'responses': expected[0],
+        'answers': expected[1],
+        'since': stats['since'].isoformat(),
+        'until': until.isoformat(),
+        'archived_at': timezone.now().isoformat(),
+    }
+    try:
+        verify_segment(segment, path=partial)
+    except ArchiveError:
+        partial.unlink()
+        raise
+    os.replace(partial, path)
+
+    with transaction.atomic():
+        form = Form.objects.select_for_update().get(id=form.id)
+        form.archive_manifest = [*form.archive_manifest, segment]
+        form.save(update_fields=['archive_manifest'])
+    purge_archived(form, chunk_size)
+    return segment
+
+
+def purge_archived(form, chunk_size=2000):
+    """Delete the live rows of responses covered by the form's archive segments; returns how many"""
+    until = form.archived_until()
+    if until is None:
+        return 0
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                FormResponse.objects
+                .filter(form=form, submitted_at__lte=until)
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return deleted
+            Answer.objects.filter(response_id__in=ids).delete()
+            FormResponse.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def verify_segment(segment, path=None):
+    """Check a segment file's checksum and counts against its manifest entry"""
+    path = path or archive_path(segment['file'])
+    if not path.exists():
+        raise ArchiveError(f'{path} is missing')
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            sha256.update(block)
+    if sha256.hexdigest() != segment['sha256']:
+        raise ArchiveError(f'{path}: checksum mismatch')
+    responses = answers = 0
+    for record in _read_segment(segment, path):
+        responses += 1
+        answers += len(record['answers'])
+    if (responses, answers) != (segment['responses'], segment['answers']):
+        raise ArchiveError(
+            f"{path}: holds {responses} responses and {answers} answers, "
+            f"expected {segment['responses']} and {segment['answers']}"
+        )
+
+
+def iter_records(form, since=None, until=None):
+    """
+    The form's archived responses, oldest first, as dicts: id, seq,
+    submitted_at (datetime), user_id, ip_address and answers, a list of
+    {question_id, value, token_counts}. Segments entirely outside
+    [since, until) are skipped; records within read segments are not
+    filtered.
+    """
+    for segment in form.archive_manifest:
+        if since is not None and parse_datetime(segment['until']) < since:
+            continue
+        if until is not None and parse_datetime(segment['since']) >= until:
+            continue
+        yield from _read_segment(segment, archive_path(segment['file']))
+
+
+def _read_segment(segment, path):
+    if segment['format'] == 'ndjson':
+        with gzip.open(path, 'rt', encoding='utf-8') as source:
+            for line in source:
+                record = json.loads(line)
+                record['submitted_at'] = parse_datetime(record['submitted_at'])
+                yield _with_uuids(record)
+        return
+
+    pa = exports.require_pyarrow()
+    current = None
+    for batch in pa.parquet.ParquetFile(path).iter_batches(batch_size=READ_CHUNK_SIZE):
+        for row in batch.to_pylist():
+            if current is None or current['id'] != row['response_id']:
+                if current is not None:
+                    yield _with_uuids(current)
+                current = {
+                    'id': row['response_id'], 'seq': row['seq'], 'submitted_at': row['submitted_at'],
+                    'user_id': row['user_id'], 'ip_address': row['ip_address'], 'answers': [],
+                }
+            if row['question_id'] is not None:
+                current['answers'].append({
+                    'question_id': row['question_id'],
+                    'value': json.loads(row['value']),
+                    'token_counts': json.loads(row['token_counts']) if row['token_counts'] else None,
+                })
+    if current is not None:
+        yield _with_uuids(current)
+
+
+def _with_uuids(record):
+    record['id'] = uuid.UUID(record['id'])
+    for answer in record['answers']:
+        answer['question_id'] = uuid.UUID(answer['question_id'])
+    return record
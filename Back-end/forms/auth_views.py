@@ -1,13 +1,25 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.contrib.auth.hashers import make_password
+from .authentication import ClaimsRefreshToken
+from . import hashing, provisioning
 from rest_framework.views import APIView
 
 
+def hashing_busy_response():
+    """429 for a login or signup turned away by the full hashing pool (see hashing.py)"""
+    return Response(
+        {'detail': 'Too many sign-ins in progress. Try again shortly.'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': '1'}
+    )
+
+
 class SignupView(APIView):
     """
     User registration endpoint
@@ -39,12 +51,14 @@ class SignupView(APIView):
             )
         
         try:
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password
+            # Same as User.objects.create_user, with the password hashed in the hashing pool
+            user = User(
+                username=User.normalize_username(username),
+                email=User.objects.normalize_email(email)
             )
-            refresh = RefreshToken.for_user(user)
+            user.password = hashing.run(make_password, password)
+            user.save()
+            refresh = ClaimsRefreshToken.for_user(user)
             
             return Response({
                 'refresh': str(refresh),
@@ -55,6 +69,8 @@ class SignupView(APIView):
                     'email': user.email,
                 }
             }, status=status.HTTP_201_CREATED)
+        except hashing.HashingBusy:
+            return hashing_busy_response()
         except Exception as e:
             return Response(
                 {'detail': f'Error creating user: {str(e)}'},
@@ -79,7 +95,10 @@ class LoginView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        user = authenticate(username=username, password=password)
+        try:
+            user = hashing.run(authenticate, username=username, password=password)
+        except hashing.HashingBusy:
+            return hashing_busy_response()
         
         if user is None:
             return Response(
@@ -87,7 +106,7 @@ class LoginView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         
         return Response({
             'refresh': str(refresh),
@@ -116,5 +135,42 @@ class UserView(APIView):
         }, status=status.HTTP_200_OK)
 
 
-
-
+class BulkUserProvisionView(APIView):
+    """
+    Create users in bulk (admins only); see forms/provisioning.py
+    POST /api/auth/users/bulk/
+    """
+    permission_classes = [IsAdminUser]
+    
+    def post(self, request):
+        users = request.data.get('users')
+        if not isinstance(users, list) or not users:
+            return Response(
+                {'detail': 'users must be a non-empty list.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(users) > settings.PROVISION_MAX_USERS:
+            return Response(
+                {'detail': f'At most {settings.PROVISION_MAX_USERS} users per request; use manage.py provision_users for more.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        def records():
+            for number, data in enumerate(users, start=1):
+                try:
+                    yield number, provisioning.clean_record(data)
+                except provisioning.InvalidRecord as e:
+                    yield number, e
+        
+        try:
+            report = provisioning.provision(records())
+        finally:
+            # Don't keep hashing processes alive in the web worker between requests
+            provisioning.reset_pool()
+        return Response({
+            'created': report['created'],
+            'existing': report['existing'],
+            'rejected': report['rejected'],
+            'forms_assigned': report['forms_assigned'],
+            'messages': [{'record': number, 'detail': message} for number, message in report['messages']],
+        }, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_200_OK)
@@ -0,0 +1,271 @@
+"""
+Response exports in wide format: one row per response, one column per
+question (in section and question order).
+
+Rows are pivoted on the fly from a single ordered query over responses
+joined with their answers, read through a server-side cursor
+(``iterator(chunk_size=...)``), so memory use does not depend on the
+number of responses and the first bytes go out before the query is
+exhausted.
+
+Formats: CSV, and typed columnar Parquet or Arrow IPC stream for
+analytics pipelines (requires the optional ``pyarrow`` package).
+
+Exports select responses with a ``filters.ResponseFilter``; archived
+responses (see archives.py) are read from their files and come first.
+"""
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import Question
+
+
+EXPORT_CHUNK_SIZE = 2000
+STREAM_BATCH_ROWS = 500
+MULTI_VALUE_SEPARATOR = ';'
+RESPONSE_COLUMNS = ['response_id', 'submitted_at', 'user_id']
+ROW_GROUP_SIZE = 50000
+ARROW_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def export_questions(form):
+    """The form's questions in section and question order"""
+    return list(
+        Question.objects
+        .filter(section__form=form)
+        .order_by('section__order', 'section__created_at', 'order', 'id')
+    )
+
+
+def iter_response_rows(responses):
+    """
+    Yield (response_id, submitted_at, user_id, {question_id: value}) for
+    each response, oldest first
+    """
+    rows = (
+        responses
+        .order_by('submitted_at', 'id')
+        .values_list('id', 'submitted_at', 'user_id', 'answers__question_id', 'answers__value')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    current = None
+    for response_id, submitted_at, user_id, question_id, value in rows:
+        # Ordering by id keeps a response's answers on consecutive rows
+        if current is None or current[0] != response_id:
+            if current is not None:
+                yield current
+            current = (response_id, submitted_at, user_id, {})
+        if question_id is not None:
+            current[3][question_id] = value
+    if current is not None:
+        yield current
+
+
+def response_rows(response_filter):
+    """
+    Yield (response_id, submitted_at, user_id, {question_id: value}) for
+    each filtered response, oldest first: the archived ones, then those
+    in the database
+    """
+    for record in response_filter.archived_records():
+        answers = {answer['question_id']: answer['value'] for answer in record['answers']}
+        yield record['id'], record['submitted_at'], record['user_id'], answers
+    yield from iter_response_rows(response_filter.responses())
+
+
+def format_value(value):
+    """An answer value as a CSV cell"""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return MULTI_VALUE_SEPARATOR.join(str(item) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+class _Echo:
+    """File-like object whose write() hands back the CSV line"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(form, response_filter):
+    """The export as CSV lines: a header, then one line per response"""
+    questions = export_questions(form)
+    writer = csv.writer(_Echo())
+    yield writer.writerow(RESPONSE_COLUMNS + [question.text for question in questions])
+    for response_id, submitted_at, user_id, answers in response_rows(response_filter):
+        yield writer.writerow(
+            [str(response_id), submitted_at.isoformat(), user_id or '']
+            + [format_value(answers.get(question.id)) for question in questions]
+        )
+
+
+def stream_csv(form, response_filter):
+    """
+    CSV chunks for a StreamingHttpResponse. Starts with a BOM so
+    spreadsheet applications read the (Persian) text as UTF-8; the header
+    is sent on its own, later lines in batches.
+    """
+    lines = csv_lines(form, response_filter)
+    yield '\ufeff' + next(lines)
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= STREAM_BATCH_ROWS:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImproperlyConfigured('Parquet/Arrow exports require pyarrow (pip install pyarrow)')
+    return pyarrow
+
+
+def arrow_schema(questions):
+    """
+    Arrow schema of the export. Question columns are named by question id
+    (texts need not be unique) and carry the text and type as field
+    metadata. Types: int64 for rating/scale with whole-number bounds
+    (float64 otherwise; values that don't fit an int64 column are written
+    as null), dictionary-encoded strings for single choice, list<string>
+    for multi choice and strings for text and anything else.
+    """
+    pa = require_pyarrow()
+    fields = [
+        pa.field('response_id', pa.string(), nullable=False),
+        pa.field('submitted_at', pa.timestamp('us', tz='UTC'), nullable=False),
+        pa.field('user_id', pa.string()),
+    ]
+    for question in questions:
+        fields.append(pa.field(
+            str(question.id),
+            _arrow_type(pa, question),
+            metadata={'question_text': question.text, 'question_type': question.type},
+        ))
+    return pa.schema(fields)
+
+
+def _arrow_type(pa, question):
+    if question.type in ('rating', 'scale'):
+        scale = question.scale or {}
+        bounds = [scale.get('min', 1), scale.get('max', 5), scale.get('step', 1)]
+        if all(float(bound).is_integer() for bound in bounds):
+            return pa.int64()
+        return pa.float64()
+    if question.type == 'single_choice':
+        return pa.dictionary(pa.int32(), pa.string())
+    if question.type == 'multi_choice':
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+def _arrow_value(value, arrow_type, pa):
+    if value is None:
+        return None
+    if pa.types.is_integer(arrow_type):
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        return int(value) if is_number and float(value).is_integer() else None
+    if pa.types.is_floating(arrow_type):
+        return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+    if pa.types.is_list(arrow_type):
+        return [str(item) for item in value] if isinstance(value, list) else None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def arrow_tables(questions, schema, rows, batch_size=ROW_GROUP_SIZE):
+    """Yield response rows (see response_rows) as pyarrow Tables of up to batch_size rows"""
+    pa = require_pyarrow()
+    question_types = [(question.id, schema.field(str(question.id)).type) for question in questions]
+    columns = [[] for _ in schema]
+    for response_id, submitted_at, user_id, answers in rows:
+        columns[0].append(str(response_id))
+        columns[1].append(submitted_at)
+        columns[2].append(user_id)
+        for index, (question_id, arrow_type) in enumerate(question_types, start=3):
+            columns[index].append(_arrow_value(answers.get(question_id), arrow_type, pa))
+        if len(columns[0]) >= batch_size:
+            yield pa.table(columns, schema=schema)
+            columns = [[] for _ in schema]
+    if columns[0]:
+        yield pa.table(columns, schema=schema)
+
+
+class _ChunkSink:
+    """Write-only file-like object collecting bytes until they are drained"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_arrow(form, response_filter, file_format='parquet'):
+    """
+    The export as a Parquet file (zstd-compressed, one row group per
+    ROW_GROUP_SIZE responses) or an Arrow IPC stream, in byte chunks of
+    one row group each. Neither format needs a seekable output, so the
+    chunks can go straight into a StreamingHttpResponse or a file.
+    """
+    pa = require_pyarrow()
+    questions = export_questions(form)
+    schema = arrow_schema(questions)
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode='w')
+    if file_format == 'parquet':
+        writer = pa.parquet.ParquetWriter(output, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+    for table in arrow_tables(questions, schema, response_rows(response_filter)):
+        writer.write_table(table)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def write_export(form, response_filter, path, file_format):
+    """Write the export in the given format ('csv', 'parquet' or 'arrow') to a file"""
+    if file_format == 'csv':
+        with open(path, 'w', encoding='utf-8', newline='') as output:
+            for chunk in stream_csv(form, response_filter):
+                output.write(chunk)
+    else:
+        with open(path, 'wb') as output:
+            for chunk in stream_arrow(form, response_filter, file_format):
+                output.write(chunk)
+
+
+def export_path(name):
+    """Where background exports are written (EXPORT_ROOT)"""
+    root = settings.EXPORT_ROOT
+    root.mkdir(parents=True, exist_ok=True)
+    return root / name
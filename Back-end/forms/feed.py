@@ -0,0 +1,81 @@
+"""
+Change feed of a form's responses (``GET /forms/{id}/responses/feed/``).
+
+Responses carry a monotonic ``seq`` (see ``models.next_response_seqs``);
+a consumer passes the last seq it has seen as ``since`` and gets the
+responses after it, oldest first, as NDJSON with the answers inlined. Each
+poll is one range scan of the (form, seq) index plus one answer query per
+batch, so it costs O(new responses) no matter how large the form is.
+
+Sequence numbers are drawn when a response is inserted, not when it
+commits, so a slow transaction can make a lower seq visible after a
+higher one. Rows inserted less than RESPONSE_FEED_SETTLE_SECONDS ago
+(``inserted_at``, set when the seq is drawn inside the inserting
+transaction) are held back to give such transactions time to commit.
+This goes by insert time, not ``submitted_at``: imported responses carry
+historical submission times but commit like any other insert.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Answer, Response as FormResponse
+
+
+ANSWER_BATCH_SIZE = 500
+WAIT_INTERVAL = 0.5
+
+
+def pending(form, since, limit):
+    """(id, seq, submitted_at, user_id) of up to ``limit`` responses after ``since``"""
+    settled = timezone.now() - timedelta(seconds=settings.RESPONSE_FEED_SETTLE_SECONDS)
+    return list(
+        FormResponse.objects
+        .filter(form=form, seq__gt=since)
+        # Rows inserted before inserted_at existed are long settled
+        .filter(Q(inserted_at__lte=settled) | Q(inserted_at__isnull=True))
+        .order_by('seq')
+        .values_list('id', 'seq', 'submitted_at', 'user_id')[:limit]
+    )
+
+
+def wait_for(form, since, limit, timeout):
+    """``pending`` that long-polls for up to ``timeout`` seconds while there is nothing new"""
+    deadline = time.monotonic() + timeout
+    rows = pending(form, since, limit)
+    while not rows and time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        rows = pending(form, since, limit)
+    return rows
+
+
+def ndjson_lines(rows):
+    """One JSON line per response, answers inlined, fetched in batches"""
+    for start in range(0, len(rows), ANSWER_BATCH_SIZE):
+        batch = rows[start:start + ANSWER_BATCH_SIZE]
+        answers = {}
+        for response_id, question_id, value in (
+            Answer.objects
+            .filter(
+                response_id__in=[row[0] for row in batch],
+                # Lets partitioned tables skip months outside the batch
+                submitted_at__range=(min(row[2] for row in batch), max(row[2] for row in batch)),
+            )
+            .values_list('response_id', 'question_id', 'value')
+        ):
+            answers.setdefault(response_id, []).append({'question_id': question_id, 'value': value})
+        yield ''.join(
+            json.dumps({
+                'seq': seq,
+                'id': response_id,
+                'submitted_at': submitted_at,
+                'user_id': user_id,
+                'answers': answers.get(response_id, []),
+            }, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            for response_id, seq, submitted_at, user_id in batch
+        )
@@ -0,0 +1,171 @@
+"""
+Sparse fieldsets and expansion control for API responses.
+
+``?fields=id,title,sections.title`` limits a response to the listed
+fields; dotted paths select fields of nested objects, and naming a
+nested field alone includes all of its fields. ``?expand=`` controls
+the nested and computed fields a serializer declares as
+``expandable_fields``: without the parameter they are all included, as
+before; with it, only those listed are (``?expand=sections`` includes
+the sections without their questions, ``?expand=sections.questions``
+both, ``?expand=`` neither). With ``fields``, expandable fields are
+included when listed in either parameter.
+
+Serializers using SparseFieldsMixin drop the other fields before
+anything is evaluated. Views using SparseFieldsViewMixin pass the
+selection to the serializer's ``prepare_queryset`` for GET requests, so
+the queryset only loads (``only``), joins and prefetches what the
+selected fields read and unrequested nested data is never queried.
+Serializers bound to input data are never pruned.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import ListSerializer
+
+
+def _paths(value):
+    return {path.strip() for path in value.split(',') if path.strip()}
+
+
+def _heads(paths):
+    return {path.split('.', 1)[0] for path in paths}
+
+
+def _tails(paths, name):
+    prefix = f'{name}.'
+    return {path[len(prefix):] for path in paths if path.startswith(prefix)}
+
+
+class Selection:
+    """Requested ``fields`` and ``expand`` paths, each None when not given"""
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None:
+            return cls()
+        params = request.query_params
+        return cls(
+            fields=_paths(params['fields']) if 'fields' in params else None,
+            expand=_paths(params['expand']) if 'expand' in params else None,
+        )
+
+    def includes(self, name, expandable=False):
+        if expandable and self.expand is not None and name in _heads(self.expand):
+            return True
+        if self.fields is not None:
+            return name in _heads(self.fields)
+        return not expandable or self.expand is None
+
+    def child(self, name):
+        """Selection within the nested field ``name``"""
+        if self.fields is None or name in self.fields or name not in _heads(self.fields):
+            fields = None
+        else:
+            fields = _tails(self.fields, name)
+        expand = None if self.expand is None else _tails(self.expand, name)
+        return Selection(fields, expand)
+
+
+class SparseFieldsMixin:
+    """
+    ModelSerializer mixin dropping the fields its Selection doesn't
+    include. The root serializer takes the selection from the
+    ``selection`` context entry; nested ones get theirs from their parent.
+    ``field_columns`` lists the model columns read by fields that aren't
+    model fields, ``required_columns`` those always needed (e.g. the
+    foreign key a prefetch joins on).
+    """
+    expandable_fields = []
+    field_columns = {}
+    required_columns = []
+
+    @classmethod
+    def includes(cls, selection, name):
+        return selection.includes(name, name in cls.expandable_fields)
+
+    @classmethod
+    def selected_columns(cls, selection):
+        """Model columns read by the selected fields"""
+        model = cls.Meta.model
+        columns = {model._meta.pk.name, *cls.required_columns}
+        for name in cls.Meta.fields:
+            if not cls.includes(selection, name):
+                continue
+            if name in cls.field_columns:
+                columns.update(cls.field_columns[name])
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.add(name)
+        return columns
+
+    @classmethod
+    def prepare_queryset(cls, queryset, selection):
+        """
+        The queryset loading what the selected fields read, prefetching the
+        selected nested serializers' relations with their own
+        prepare_queryset
+        """
+        queryset = queryset.only(*cls.selected_columns(selection))
+        for name, field in cls._declared_fields.items():
+            nested = field.child if isinstance(field, ListSerializer) else field
+            if isinstance(nested, SparseFieldsMixin) and cls.includes(selection, name):
+                related = nested.prepare_queryset(nested.Meta.model._default_manager.all(), selection.child(name))
+                queryset = queryset.prefetch_related(Prefetch(field.source or name, queryset=related))
+        return queryset
+
+    def _selection(self):
+        selection = getattr(self, 'selection', None)
+        if selection is not None:
+            return selection
+        root = self.parent.parent if isinstance(self.parent, ListSerializer) else self.parent
+        if root is None:
+            return self.context.get('selection') or Selection()
+        return Selection()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if hasattr(root, 'initial_data'):
+            # Validating input: every writable field counts
+            return fields
+        selection = self._selection()
+        for name in list(fields):
+            if not self.includes(selection, name):
+                del fields[name]
+        for name, field in fields.items():
+            nested = field.child if isinstance(field, ListSerializer) else field
+            if isinstance(nested, SparseFieldsMixin):
+                nested.selection = selection.child(name)
+        return fields
+
+
+class SparseFieldsViewMixin:
+    """
+    GenericAPIView mixin handing the request's Selection to the serializer
+    (context ``selection``) and, for GET requests, to its
+    ``prepare_queryset`` (after filter_queryset, so views keep defining
+    get_queryset as usual).
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['selection'] = Selection.from_request(getattr(self, 'request', None))
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if self.request.method in SAFE_METHODS and issubclass(serializer_class, SparseFieldsMixin):
+            queryset = serializer_class.prepare_queryset(queryset, Selection.from_request(self.request))
+        return queryset
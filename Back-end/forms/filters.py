@@ -0,0 +1,224 @@
+"""
+Response subsets for analysis endpoints, selected by query parameters:
+
+    ?since=2025-01-01&until=2025-02-01&tz=Asia/Tehran
+        submitted_at range; naive dates/datetimes are read in ``tz``
+    ?answer=<question_id>:<value>   (repeatable)
+        only respondents whose answer to the question is ``value``
+        (or includes it, for multi choice questions)
+
+The subset is always expressed as a Response queryset, so it reaches the
+database as a single semi-join instead of a materialized list of ids.
+Answer predicates compare the typed answer columns (see
+``models.typed_answer_values``), so they use the (question, value_*)
+indexes.
+
+Responses moved to archive files (see archives.py) are no longer in the
+database: queries only cover responses after the form's newest archive
+segment, and ``archived_records`` applies the same filter to the archived
+ones.
+"""
+from datetime import datetime, time
+import hashlib
+import json
+import uuid
+import zoneinfo
+
+from django.db import connection
+from django.db.models import Exists, F, Min, OuterRef, Q, TextField
+from django.db.models.functions import Cast
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from . import archives, partitions
+from .analysis import NUMERIC_QUESTION_TYPES, typed_field
+from .models import Answer, Question, Response as FormResponse, choice_mask, typed_answer_values
+
+
+def parse_timezone(name):
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValidationError({'detail': f"Unknown time zone: {name}"})
+
+
+def parse_datetime_param(param, value, tzinfo):
+    """Parse an ISO date or datetime; naive values are read in the given time zone"""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({'detail': f"Invalid '{param}' date: {value}"})
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=tzinfo)
+    return parsed
+
+
+class ResponseFilter:
+    """Date range and answer predicates selecting a subset of a form's responses"""
+
+    def __init__(self, form, since=None, until=None, predicates=()):
+        self.form = form
+        self.since = since
+        self.until = until
+        self.predicates = list(predicates)  # [(question, value)]
+
+    @classmethod
+    def from_query_params(cls, form, params):
+        tzinfo = parse_timezone(params.get('tz', 'UTC'))
+        since = params.get('since')
+        until = params.get('until')
+        since = parse_datetime_param('since', since, tzinfo) if since else None
+        until = parse_datetime_param('until', until, tzinfo) if until else None
+
+        raw_predicates = []
+        for raw in params.getlist('answer'):
+            question_id, separator, value = raw.partition(':')
+            try:
+                question_id = uuid.UUID(question_id)
+            except ValueError:
+                separator = ''
+            if not separator:
+                raise ValidationError({'detail': f"Invalid answer filter '{raw}'. Use <question_id>:<value>"})
+            raw_predicates.append((question_id, value))
+
+        questions = Question.objects.filter(section__form=form).in_bulk(
+            {question_id for question_id, _ in raw_predicates}
+        ) if raw_predicates else {}
+        predicates = []
+        for question_id, value in raw_predicates:
+            question = questions.get(question_id)
+            if question is None:
+                raise ValidationError({'detail': f"Question '{question_id}' does not belong to this form"})
+            if question.type in NUMERIC_QUESTION_TYPES:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValidationError({'detail': f"Answer filter for '{question_id}' must be a number"})
+                value = int(value) if value.is_integer() else value
+            predicates.append((question, value))
+        return cls(form, since=since, until=until, predicates=predicates)
+
+    @property
+    def is_empty(self):
+        return self.since is None and self.until is None and not self.predicates
+
+    def responses(self):
+        """The filtered responses of the form"""
+        queryset = FormResponse.objects.filter(form=self.form, **self.date_range())
+        for question, value in self.predicates:
+            queryset = queryset.filter(Exists(self._matching_answers(question, value)))
+        return queryset
+
+    def date_range(self):
+        """submitted_at range lookups (plain range predicates, index friendly), after the archived responses"""
+        lookups = {}
+        if self.since is not None:
+            lookups['submitted_at__gte'] = self.since
+        if self.until is not None:
+            lookups['submitted_at__lt'] = self.until
+        archived_until = self.form.archived_until()
+        if archived_until is not None:
+            lookups['submitted_at__gt'] = archived_until
+        return lookups
+
+    def archived_records(self):
+        """The form's archived responses in the subset, oldest first (see archives.iter_records)"""
+        for record in archives.iter_records(self.form, since=self.since, until=self.until):
+            if self.matches(record):
+                yield record
+
+    def matches(self, record):
+        """Whether an archived response record is in the subset"""
+        if self.since is not None and record['submitted_at'] < self.since:
+            return False
+        if self.until is not None and record['submitted_at'] >= self.until:
+            return False
+        if not self.predicates:
+            return True
+        values = {answer['question_id']: answer['value'] for answer in record['answers']}
+        for question, value in self.predicates:
+            if question.id not in values:
+                return False
+            stored = values[question.id]
+            if question.type == 'multi_choice':
+                if not isinstance(stored, list) or value not in stored:
+                    return False
+            elif typed_answer_values(question, stored)[typed_field(question)] != value:
+                return False
+        return True
+
+    def answers(self, queryset):
+        """
+        Restrict an Answer queryset (of this form's questions) to the
+        filtered responses. The form and date range are applied to the
+        answers' own form and submitted_at, so a form's answers are read
+        from one (form, question) or (form, submitted_at) index range and,
+        on partitioned tables, only the partitions it covers are scanned.
+        """
+        queryset = queryset.filter(form=self.form, **self.answer_date_range())
+        if not self.predicates:
+            return queryset
+        return queryset.filter(response__in=self.responses())
+
+    def answer_date_range(self):
+        """
+        submitted_at lookups for answers: the date range, bounded below by
+        the form's first response when the tables are partitioned (answers
+        can't be older, so older partitions are pruned)
+        """
+        lookups = self.date_range()
+        if self.since is None and partitions.is_partitioned():
+            first = (
+                FormResponse.objects.filter(form=self.form)
+                .aggregate(first=Min('submitted_at'))['first']
+            )
+            if first is not None:
+                lookups['submitted_at__gte'] = first
+        return lookups
+
+    def describe(self):
+        return {
+            'since': self.since.isoformat() if self.since else None,
+            'until': self.until.isoformat() if self.until else None,
+            'answers': [
+                {'question_id': str(question.id), 'value': value}
+                for question, value in self.predicates
+            ],
+        }
+
+    def cache_key(self):
+        """Stable hash of the filter, for caching per-filter results"""
+        encoded = json.dumps(self.describe(), sort_keys=True)
+        return hashlib.sha1(encoded.encode()).hexdigest()
+
+    @staticmethod
+    def _matching_answers(question, value):
+        """
+        Answers to the question matching the predicate, compared on their
+        typed column, or on the stored value while it is being refreshed
+        after a type change (``typed_values_pending``)
+        """
+        answers = Answer.objects.filter(response=OuterRef('pk'), question=question)
+        if question.type != 'multi_choice':
+            if question.typed_values_pending:
+                return answers.filter(value=value)
+            return answers.filter(**{typed_field(question): value})
+        mask = choice_mask(question, [value])
+        selected = Q(GreaterThan(F('value_choice_mask').bitand(mask), 0)) if mask else Q(pk__in=[])
+        # Selections without a mask (see models.choice_mask) are matched on the stored value
+        if connection.features.supports_json_field_contains:
+            untyped = Q(value__contains=[value])
+        else:
+            # Backends without JSON containment (SQLite): match the encoded element
+            answers = answers.annotate(value_json=Cast('value', TextField()))
+            untyped = Q(value_json__contains=json.dumps(value))
+        if question.typed_values_pending:
+            return answers.filter(untyped)
+        return answers.filter(selected | Q(value_choice_mask__isnull=True) & untyped)
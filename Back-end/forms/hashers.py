@@ -0,0 +1,24 @@
+"""
+Memory-hard password hashers with parameters from settings
+(PASSWORD_SCRYPT_*, PASSWORD_ARGON2_*). Django rehashes a password at
+the user's next successful login when its algorithm isn't the preferred
+one (PASSWORD_HASHER) or its parameters differ from these, so PBKDF2
+hashes and hashes made with older parameters are upgraded transparently.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+    block_size = settings.PASSWORD_SCRYPT_BLOCK_SIZE
+    parallelism = settings.PASSWORD_SCRYPT_PARALLELISM
+    # scrypt needs 128 * work_factor * block_size bytes; OpenSSL refuses more than 32 MiB unless allowed
+    maxmem = 2 * 128 * work_factor * block_size
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Needs `pip install argon2-cffi`"""
+    time_cost = settings.PASSWORD_ARGON2_TIME_COST
+    memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST  # KiB
+    parallelism = settings.PASSWORD_ARGON2_PARALLELISM
@@ -0,0 +1,71 @@
+"""
+Password hashing off the request threads.
+
+Login and signup run their hashing (``authenticate``, ``make_password``)
+in a bounded pool of PASSWORD_HASH_WORKERS threads: the hashers (scrypt,
+Argon2, PBKDF2) release the GIL while they hash, so hashes run in
+parallel and the Python side of other requests keeps going. At most
+PASSWORD_HASH_QUEUE more calls may wait for a thread; past that ``run``
+raises HashingBusy at once and the views answer 429, so a burst of
+logins can't tie up every web worker and starve form submissions.
+PASSWORD_HASH_WORKERS=0 hashes on the request thread, unbounded.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+_lock = threading.Lock()
+_executor = None
+_slots = None  # Running plus waiting calls allowed
+
+
+class HashingBusy(Exception):
+    pass
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash'
+            )
+            _slots = threading.BoundedSemaphore(settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE)
+        return _executor, _slots
+
+
+def reset():
+    """Shut the pool down; the next call starts one with the current settings"""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = _slots = None
+
+
+def _call(func, args, kwargs):
+    # Pool threads outlive requests: give their database connections the request lifecycle
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run(func, *args, **kwargs):
+    """Call func in the hashing pool and wait for its result; raises HashingBusy when the pool is full"""
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return func(*args, **kwargs)
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy
+    try:
+        future = executor.submit(_call, func, args, kwargs)
+    except BaseException:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future.result()
@@ -0,0 +1,264 @@
+"""
+Bulk import of historical responses (``manage.py import_responses``).
+
+Records come from CSV (one row per response, one column per question, as
+written by the CSV export) or NDJSON (one response per line, as written by
+the change feed). Columns and answer keys are matched to questions by id
+or by exact question text. Every answer is checked with the same rules as
+``AnswerSerializer`` (``serializers.validate_answer_value``); invalid
+records are skipped and counted against an error budget.
+
+Records are inserted in chunks, one transaction per chunk, with
+PostgreSQL ``COPY`` (plain ``bulk_create`` elsewhere). Response ids are
+derived from the source name and record number and each chunk replaces
+responses with its ids, so importing the same file again (or resuming
+after a chunk that was committed but not checkpointed) never duplicates
+responses.
+"""
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers as drf_serializers
+
+from .exports import MULTI_VALUE_SEPARATOR, RESPONSE_COLUMNS
+from .models import Answer, Question, Response as FormResponse, next_response_seqs
+from .serializers import derived_answer_fields, validate_answer_value
+
+
+IMPORT_NAMESPACE = uuid.UUID('5b0c6f8e-3f5e-4a0c-9d7e-2f1f0c3b9a61')
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+class QuestionResolver:
+    """Find a form's questions by id or exact text"""
+
+    def __init__(self, form):
+        self.questions = list(Question.objects.filter(section__form=form))
+        self.by_id = {str(question.id): question for question in self.questions}
+        self.by_text = {}
+        for question in self.questions:
+            self.by_text.setdefault(question.text.strip(), []).append(question)
+
+    def resolve(self, key):
+        key = str(key).strip()
+        if key in self.by_id:
+            return self.by_id[key]
+        matches = self.by_text.get(key, [])
+        if len(matches) > 1:
+            raise InvalidRecord(f"'{key}' matches {len(matches)} questions; use the question id")
+        if not matches:
+            raise InvalidRecord(f"No question with id or text '{key}'")
+        return matches[0]
+
+
+def parse_submitted_at(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise InvalidRecord(f"Invalid submitted_at: {value!r}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def csv_cell_value(question, cell):
+    """Typed answer value of a CSV cell (None for an empty cell)"""
+    if cell == '':
+        return None
+    if question.type == 'multi_choice':
+        return [item for item in cell.split(MULTI_VALUE_SEPARATOR) if item]
+    if question.type in ('rating', 'scale'):
+        try:
+            number = float(cell)
+        except ValueError:
+            raise InvalidRecord(f"'{question.text}': not a number: {cell!r}")
+        return int(number) if number.is_integer() else number
+    return cell
+
+
+def read_csv(path, resolver):
+    """Yield (record_number, record or InvalidRecord) from a CSV file"""
+    with open(path, encoding='utf-8-sig', newline='') as source:
+        reader = csv.reader(source)
+        header = next(reader, [])
+        columns = []
+        for name in header:
+            if name in RESPONSE_COLUMNS:
+                columns.append(name)
+            else:
+                # An unknown column fails the whole import, not one record
+                columns.append(resolver.resolve(name))
+        for number, row in enumerate(reader, start=1):
+            if len(row) != len(columns):
+                yield number, InvalidRecord(f'Expected {len(columns)} columns, got {len(row)}')
+                continue
+            record = {'answers': []}
+            try:
+                for column, cell in zip(columns, row):
+                    if column == 'submitted_at':
+                        record['submitted_at'] = parse_submitted_at(cell)
+                    elif column == 'user_id':
+                        record['user_id'] = cell or None
+                    elif isinstance(column, Question):
+                        value = csv_cell_value(column, cell)
+                        if value is not None:
+                            record['answers'].append((column, value))
+            except InvalidRecord as e:
+                yield number, e
+                continue
+            yield number, record
+
+
+def read_ndjson(path, resolver):
+    """
+    Yield (record_number, record or InvalidRecord) from an NDJSON file of
+    {"submitted_at", "user_id", "answers"} objects, where answers is an
+    object keyed by question id/text or a list of {"question_id", "value"}
+    """
+    with open(path, encoding='utf-8') as source:
+        for number, line in enumerate(source, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise InvalidRecord('Each line must be a JSON object')
+                answers = data.get('answers') or {}
+                if isinstance(answers, list):
+                    answers = {item.get('question_id'): item.get('value') for item in answers}
+                yield number, {
+                    'submitted_at': parse_submitted_at(data.get('submitted_at')),
+                    'user_id': data.get('user_id'),
+                    'answers': [
+                        (resolver.resolve(key), value) for key, value in answers.items() if value is not None
+                    ],
+                }
+            except (ValueError, AttributeError) as e:
+                yield number, InvalidRecord(f'Invalid JSON record: {e}')
+            except InvalidRecord as e:
+                yield number, e
+
+
+def validate_record(record, archived_until=None):
+    if archived_until is not None and record.get('submitted_at') and record['submitted_at'] <= archived_until:
+        # That range of the form's responses lives in archive files now (see archives.py)
+        raise InvalidRecord(f"submitted_at is not after the archived responses ({archived_until.isoformat()})")
+    seen = set()
+    for question, value in record['answers']:
+        if question.id in seen:
+            raise InvalidRecord(f"'{question.text}' is answered twice")
+        seen.add(question.id)
+        try:
+            validate_answer_value(question, value)
+        except drf_serializers.ValidationError as e:
+            raise InvalidRecord(f"'{question.text}': {'; '.join(map(str, e.detail))}")
+
+
+def response_id(form, source_name, number):
+    return uuid.uuid5(IMPORT_NAMESPACE, f'{form.id}:{source_name}:{number}')
+
+
+def insert_chunk(form, source_name, chunk):
+    """
+    Insert a chunk of (record_number, record) in one transaction; returns
+    the number of answers written. Rows are built as plain dicts of
+    column values: constructing model instances would cost more than the
+    insert itself.
+    """
+    now = timezone.now()
+    responses = []
+    answers = []
+    for number, record in chunk:
+        response_row = {
+            'id': response_id(form, source_name, number),
+            'form_id': form.id,
+            'user_id': record.get('user_id'),
+            'submitted_at': record.get('submitted_at') or now,
+        }
+        responses.append(response_row)
+        for question, value in record['answers']:
+            answers.append({
+                'id': uuid.uuid4(),
+                'response_id': response_row['id'],
+                'question_id': question.id,
+                'value': value,
+                'form_id': form.id,
+                'submitted_at': response_row['submitted_at'],
+                **derived_answer_fields(question, value),
+            })
+
+    with transaction.atomic():
+        FormResponse.objects.filter(id__in=[row['id'] for row in responses]).delete()
+        # Drawn in the transaction: the feed holds these rows back by inserted_at
+        # (not their historical submitted_at) until the chunk has had time to commit
+        inserted_at = timezone.now()
+        for response_row, seq in zip(responses, next_response_seqs(len(responses))):
+            response_row['seq'] = seq
+            response_row['inserted_at'] = inserted_at
+        insert_rows(FormResponse, responses)
+        insert_rows(Answer, answers)
+    return len(answers)
+
+
+def insert_rows(model, rows, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk insert rows (dicts keyed by field attname) as they are, including
+    auto_now/auto_now_add timestamps: COPY on PostgreSQL, bulk_create
+    elsewhere
+    """
+    if connections[using].vendor == 'postgresql':
+        copy_rows(model, rows, using)
+        return
+    model.objects.using(using).bulk_create([model(**row) for row in rows], batch_size=1000)
+    # bulk_create stamps auto_now(_add) fields with the current time
+    stamped = [
+        field.name for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    if stamped and rows:
+        model.objects.using(using).bulk_update([model(**row) for row in rows], stamped, batch_size=1000)
+
+
+def copy_rows(model, rows, using=DEFAULT_DB_ALIAS):
+    """
+    Insert rows (dicts keyed by field attname; missing fields get their
+    default) with PostgreSQL COPY in text format
+    """
+    connection = connections[using]
+    fields = model._meta.concrete_fields
+    encoders = [(field, field.get_internal_type() == 'JSONField') for field in fields]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(
+            _copy_value(row[field.attname] if field.attname in row else field.get_default(), is_json)
+            for field, is_json in encoders
+        ))
+        buffer.write('\n')
+    buffer.seek(0)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN', buffer)
+
+
+def _copy_value(value, is_json):
+    if value is None:
+        return '\\N'
+    if is_json:
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, bool):
+        value = 't' if value else 'f'
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
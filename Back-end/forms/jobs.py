@@ -0,0 +1,184 @@
+"""
+Database-backed background job queue.
+
+Web requests enqueue jobs (``enqueue``) and return immediately; workers
+started with ``manage.py run_workers`` claim queued jobs and run their
+handler. On PostgreSQL a job is claimed with ``SELECT ... FOR UPDATE SKIP
+LOCKED`` so any number of workers can poll the table without blocking each
+other. Backends without SKIP LOCKED (SQLite) claim with a conditional
+``UPDATE ... WHERE status = 'queued'`` instead, which is equally safe but
+may retry when two workers race for the same row.
+
+Handlers are registered with ``@handler('<kind>')``, receive the Job and
+return a JSON-serializable result stored on it.
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import QueryDict
+from django.utils import timezone
+
+from . import analysis_cache, approx, exports, reaper
+from .analysis import build_form_analysis
+from .filters import ResponseFilter
+from .models import RETYPE_JOB_KIND, Job, Question, refresh_typed_values
+
+
+HANDLERS = {}
+
+logger = logging.getLogger(__name__)
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, form=None, payload=None, user=None):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(kind=kind, form=form, payload=payload or {}, created_by=user)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker=None):
+    """Mark the oldest queued job as running and return it, or None"""
+    worker = worker or worker_name()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (
+                Job.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='queued')
+                .order_by('created_at')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = 'running'
+            job.attempts += 1
+            job.locked_by = worker
+            job.started_at = timezone.now()
+            job.save(update_fields=['status', 'attempts', 'locked_by', 'started_at'])
+            return job
+
+    candidates = (
+        Job.objects
+        .filter(status='queued')
+        .order_by('created_at')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = Job.objects.filter(id=job_id, status='queued').update(
+            status='running', attempts=F('attempts') + 1, locked_by=worker, started_at=timezone.now()
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run(job_id):
+    """Run a claimed job and record its outcome"""
+    job = Job.objects.select_related('form').get(id=job_id)
+    try:
+        result = HANDLERS[job.kind](job)
+    except Exception as e:
+        # Job.error is shown to API clients; the traceback goes to the worker log
+        logger.exception('Job %s (%s) failed', job.id, job.kind)
+        job.status = 'failed'
+        job.error = f'{type(e).__name__}; see the worker log for details'
+        # Keep any progress the handler saved in result
+        update_fields = ['status', 'error', 'finished_at']
+    else:
+        job.status = 'succeeded'
+        job.result = result
+        job.error = None
+        update_fields = ['status', 'result', 'error', 'finished_at']
+    job.finished_at = timezone.now()
+    job.save(update_fields=update_fields)
+    return job.status
+
+
+def requeue_stale():
+    """Requeue jobs whose worker died mid-run; give up after JOB_MAX_ATTEMPTS"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    stale = Job.objects.filter(status='running', started_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status='failed', error='Job timed out', finished_at=timezone.now()
+    )
+    requeued = stale.update(status='queued', locked_by=None)
+    return requeued, failed
+
+
+@handler('analysis.refresh')
+def refresh_analysis(job):
+    """Recompute a form's analysis (optionally filtered) into the analysis cache"""
+    form = job.form
+    response_filter = ResponseFilter.from_query_params(form, QueryDict(job.payload.get('query', '')))
+    current_watermark = analysis_cache.watermark(form)
+    payload = build_form_analysis(form, response_filter)
+    analysis_cache.store(analysis_cache.cache_key(form, response_filter), current_watermark, payload)
+    return {'total_responses': payload['total_responses'], 'watermark': list(current_watermark)}
+
+
+@handler('sketches.rebuild')
+def rebuild_sketches(job):
+    return {'questions': approx.rebuild(job.form)}
+
+
+@handler('export.csv')
+@handler('export.parquet')
+@handler('export.arrow')
+def export_responses(job):
+    """Write an export of a form to EXPORT_ROOT (download at /jobs/{id}/download/)"""
+    form = job.form
+    file_format = job.kind.split('.', 1)[1]
+    response_filter = ResponseFilter.from_query_params(form, QueryDict(job.payload.get('query', '')))
+    path = exports.export_path(f'form-{form.id}-{job.id}.{file_format}')
+    exports.write_export(form, response_filter, path, file_format)
+    return {'file': path.name, 'size': path.stat().st_size}
+
+
+@handler(reaper.REAP_JOB_KIND)
+def reap_deleted(job):
+    """
+    Delete soft-deleted forms, sections and questions with their answers
+    (see reaper.py). Progress is saved on the job after every chunk; past
+    half of JOB_TIMEOUT the job stops and queues a follow-up.
+    """
+    def save_progress(counts):
+        Job.objects.filter(id=job.id).update(result=counts)
+
+    run = reaper.Reaper(max_seconds=settings.JOB_TIMEOUT / 2, progress=save_progress)
+    try:
+        run.run()
+    except reaper.OutOfTime:
+        reaper.schedule(job.created_by)
+        return {**run.counts, 'done': False}
+    return {**run.counts, 'done': True}
+
+
+@handler(RETYPE_JOB_KIND)
+def refresh_typed_answer_values(job):
+    """
+    Recompute the typed columns of a question's answers after its type
+    changed (see models.schedule_typed_values_refresh), then let analysis
+    read them again
+    """
+    question = Question.all_objects.filter(id=job.payload['question_id']).first()
+    if question is None:
+        return {'answers': 0}
+    count = refresh_typed_values(question)
+    # Changed again meanwhile: the job queued by that change clears it
+    Question.all_objects.filter(id=question.id, type=question.type).update(typed_values_pending=False)
+    return {'answers': count}
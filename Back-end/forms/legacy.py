@@ -0,0 +1,321 @@
+"""
+Copy of the legacy database (integer primary keys, the schema of
+migrations 0001-0003, e.g. the ``old`` SQLite alias) into the current
+schema (``manage.py migrate_legacy``).
+
+Tables are copied in dependency order, each in primary-key ranges of
+``chunk_size`` rows that worker processes copy independently: a chunk
+is read with plain SQL, converted and bulk inserted in one transaction,
+then read back from the target and compared with the source. Legacy ids
+map to deterministic UUIDs (``legacy_uuid``), so any worker can resolve
+foreign keys without shared state and copying a chunk twice replaces it
+instead of duplicating it. Users keep their integer ids.
+
+The checksum of a chunk is the SHA-256 of its rows' copied columns in a
+canonical encoding, sorted; a table's checksum combines its chunks' in
+key order. Derived columns (typed answer values, token counts, change
+feed positions) are recomputed and not part of the checksum.
+"""
+import hashlib
+import json
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .imports import insert_rows
+from .models import Answer, Form, Question, Response as FormResponse, Section, next_response_seqs
+from .serializers import derived_answer_fields
+
+
+LEGACY_NAMESPACE = uuid.UUID('0d6f3c9e-8a51-4c4f-b6f2-7f3e1d2a9c48')
+
+
+class LegacyError(Exception):
+    pass
+
+
+def legacy_uuid(table, pk):
+    """UUID primary key of a legacy row"""
+    return uuid.uuid5(LEGACY_NAMESPACE, f'{table}:{pk}')
+
+
+def _datetime(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if timezone.is_naive(value):
+        # Legacy timestamps are stored in UTC
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def _json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _user(row, target):
+    return {
+        'id': row['id'],
+        'password': row['password'],
+        'last_login': _datetime(row['last_login']),
+        'is_superuser': bool(row['is_superuser']),
+        'username': row['username'],
+        'first_name': row['first_name'],
+        'last_name': row['last_name'],
+        'email': row['email'],
+        'is_staff': bool(row['is_staff']),
+        'is_active': bool(row['is_active']),
+        'date_joined': _datetime(row['date_joined']),
+    }
+
+
+def _form(row, target):
+    return {
+        'id': legacy_uuid('forms_form', row['id']),
+        'title': row['title'],
+        'description': row['description'],
+        'status': row['status'],
+        'uuid': uuid.UUID(str(row['uuid'])),
+        'welcome_message': row.get('welcome_message'),
+        'thank_you_message': row.get('thank_you_message'),
+        'created_by_id': row.get('created_by_id'),
+        'created_at': _datetime(row['created_at']),
+        'updated_at': _datetime(row['updated_at']),
+    }
+
+
+def _section(row, target):
+    return {
+        'id': legacy_uuid('forms_section', row['id']),
+        'form_id': legacy_uuid('forms_form', row['form_id']),
+        'title': row['title'],
+        'description': row['description'],
+        'order': row['order'],
+        'created_at': _datetime(row['created_at']),
+    }
+
+
+def _question(row, target):
+    converted = {
+        'id': legacy_uuid('forms_question', row['id']),
+        'section_id': legacy_uuid('forms_section', row['section_id']),
+        'text': row['text'],
+        'type': row['type'],
+        'options': _json(row['options']),
+        'required': bool(row['required']),
+        'order': row['order'],
+        'min_length': row['min_length'],
+        'max_length': row['max_length'],
+        'scale': _json(row['scale']),
+        'visibility': _json(row['visibility']),
+        'exclusive_options': _json(row['exclusive_options']),
+    }
+    question = Question(options=converted['options'])
+    question.register_choice_keys()
+    converted['choice_keys'] = question.choice_keys
+    return converted
+
+
+def _response(row, target):
+    return {
+        'id': legacy_uuid('forms_response', row['id']),
+        'form_id': legacy_uuid('forms_form', row['form_id']),
+        'user_id': row['user_id'],
+        'submitted_at': _datetime(row['submitted_at']),
+        'ip_address': row['ip_address'],
+    }
+
+
+_questions = {}  # Target questions by id, per worker process
+
+
+def _answer(row, target):
+    question_id = legacy_uuid('forms_question', row['question_id'])
+    if question_id not in _questions:
+        _questions.update(Question.objects.using(target).in_bulk([question_id]))
+    value = _json(row['value'])
+    return {
+        'id': legacy_uuid('forms_answer', row['id']),
+        'response_id': legacy_uuid('forms_response', row['response_id']),
+        'question_id': question_id,
+        'value': value,
+        'form_id': legacy_uuid('forms_form', row['form_id']),
+        'submitted_at': _datetime(row['submitted_at']),
+        **derived_answer_fields(_questions[question_id], value),
+    }
+
+
+class LegacyTable:
+    """How one legacy table is read and converted"""
+
+    def __init__(self, table, model, convert, checked, select=None, optional=()):
+        self.table = table
+        self.model = model
+        self.convert = convert
+        self.checked = checked  # Target fields copied from the source (the checksum)
+        self.select = select  # Custom SELECT (joins); default: the table's columns
+        self.optional = optional  # Columns added by later legacy migrations
+
+
+TABLES = [
+    LegacyTable('auth_user', User, _user, [
+        'id', 'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name',
+        'email', 'is_staff', 'is_active', 'date_joined',
+    ]),
+    LegacyTable('forms_form', Form, _form, [
+        'id', 'title', 'description', 'status', 'uuid', 'welcome_message', 'thank_you_message',
+        'created_by_id', 'created_at', 'updated_at',
+    ], optional=('welcome_message', 'thank_you_message', 'created_by_id')),
+    LegacyTable('forms_section', Section, _section, [
+        'id', 'form_id', 'title', 'description', 'order', 'created_at',
+    ]),
+    LegacyTable('forms_question', Question, _question, [
+        'id', 'section_id', 'text', 'type', 'options', 'required', 'order', 'min_length', 'max_length',
+        'scale', 'visibility', 'exclusive_options',
+    ]),
+    LegacyTable('forms_response', FormResponse, _response, [
+        'id', 'form_id', 'user_id', 'submitted_at', 'ip_address',
+    ]),
+    LegacyTable('forms_answer', Answer, _answer, [
+        'id', 'response_id', 'question_id', 'value', 'form_id', 'submitted_at',
+    ], select=(
+        'SELECT a.id, a.response_id, a.question_id, a.value, r.form_id, r.submitted_at '
+        'FROM forms_answer a JOIN forms_response r ON r.id = a.response_id'
+    )),
+]
+TABLES_BY_NAME = {table.table: table for table in TABLES}
+
+
+def source_columns(source, table):
+    """Columns of a legacy table, checked against what the copy needs"""
+    spec = TABLES_BY_NAME[table]
+    connection = connections[source]
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            raise LegacyError(f'{source} has no table {table}')
+        columns = [column.name for column in connection.introspection.get_table_description(cursor, table)]
+    if spec.select is None:
+        # Legacy columns are named like the target fields' attnames
+        missing = set(spec.checked) - set(spec.optional) - set(columns)
+        if missing:
+            raise LegacyError(f'{source}.{table} is not a legacy table (missing {", ".join(sorted(missing))})')
+    return columns
+
+
+def chunk_bounds(source, table, chunk_size):
+    """Inclusive (first id, last id) ranges of up to chunk_size rows, in id order"""
+    connection = connections[source]
+    quoted = connection.ops.quote_name(table)
+    bounds = []
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(id) FROM {quoted}')
+        first = cursor.fetchone()[0]
+        while first is not None:
+            cursor.execute(
+                f'SELECT id FROM {quoted} WHERE id >= %s ORDER BY id LIMIT 1 OFFSET %s', [first, chunk_size - 1]
+            )
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(f'SELECT MAX(id) FROM {quoted}')
+                bounds.append((first, cursor.fetchone()[0]))
+                break
+            bounds.append((first, row[0]))
+            cursor.execute(f'SELECT MIN(id) FROM {quoted} WHERE id > %s', [row[0]])
+            first = cursor.fetchone()[0]
+    return bounds
+
+
+def source_count(source, table):
+    connection = connections[source]
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
+
+
+def _canonical(value):
+    if isinstance(value, datetime):
+        return value.astimezone(dt_timezone.utc).isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def rows_checksum(rows):
+    """SHA-256 of rows (tuples of field values), independent of their order"""
+    encoded = sorted(
+        json.dumps([_canonical(value) for value in row], sort_keys=True, ensure_ascii=False) for row in rows
+    )
+    digest = hashlib.sha256()
+    for line in encoded:
+        digest.update(line.encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def combine_checksums(checksums):
+    digest = hashlib.sha256()
+    for checksum in checksums:
+        digest.update(checksum.encode())
+    return digest.hexdigest()
+
+
+def copy_chunk(source, target, table, columns, first, last):
+    """
+    Copy the legacy rows with ids in [first, last] and verify them; runs
+    in a worker process. Returns {'rows', 'source', 'target'} with the
+    chunk's row count and the checksums of the source rows (as converted)
+    and of the rows read back from the target.
+    """
+    spec = TABLES_BY_NAME[table]
+    source_connection = connections[source]
+    if spec.select:
+        query = f'{spec.select} WHERE a.id BETWEEN %s AND %s ORDER BY a.id'
+    else:
+        quoted = ', '.join(source_connection.ops.quote_name(column) for column in columns)
+        query = f'SELECT {quoted} FROM {source_connection.ops.quote_name(table)} WHERE id BETWEEN %s AND %s ORDER BY id'
+    with source_connection.cursor() as cursor:
+        cursor.execute(query, [first, last])
+        names = [column[0] for column in cursor.description]
+        rows = [spec.convert(dict(zip(names, values)), target) for values in cursor.fetchall()]
+
+    model = spec.model
+    ids = [row['id'] for row in rows]
+    with transaction.atomic(using=target):
+        if model is User:
+            # Never delete users: their forms would go with them
+            model.objects.using(target).bulk_create(
+                [model(**row) for row in rows], batch_size=1000, ignore_conflicts=True
+            )
+        else:
+            if model is FormResponse:
+                inserted_at = timezone.now()
+                for row, seq in zip(rows, next_response_seqs(len(rows), using=target)):
+                    row['seq'] = seq
+                    row['inserted_at'] = inserted_at
+            # A chunk copied before (an interrupted run) is replaced
+            model.objects.using(target).filter(id__in=ids).delete()
+            insert_rows(model, rows, using=target)
+
+    copied = model.objects.using(target).filter(id__in=ids).values_list(*spec.checked)
+    return {
+        'rows': len(rows),
+        'source': rows_checksum([tuple(row[field] for field in spec.checked) for row in rows]),
+        'target': rows_checksum(copied.iterator(chunk_size=2000)),
+    }
+
+
+def reset_sequences(target):
+    """Move the target's id sequences (users keep their ids) past the copied rows"""
+    from django.core.management.color import no_style
+
+    connection = connections[target]
+    statements = connection.ops.sequence_reset_sql(no_style(), [User])
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import archives
+from forms.models import Form
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the responses of closed forms (unpublished, no responses for FORM_ARCHIVE_AFTER_DAYS) into '
+        'compressed archive files under ARCHIVE_ROOT and delete them from the database. Analysis and '
+        'exports keep reading them from the files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('form_ids', nargs='*', help='Archive these forms regardless of the retention window')
+        parser.add_argument('--older-than-days', type=int, help='Retention window (default FORM_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--format', dest='file_format', choices=archives.ARCHIVE_FORMATS, default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Responses deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='List the forms that would be archived')
+        parser.add_argument('--verify', action='store_true', help="Only check existing archive files' checksums")
+
+    def handle(self, *args, **options):
+        if options['form_ids']:
+            try:
+                forms = list(Form.objects.filter(id__in=options['form_ids']))
+            except ValidationError:
+                forms = []
+            if len(forms) != len(set(options['form_ids'])):
+                raise CommandError('Unknown form id')
+        elif options['verify']:
+            forms = Form.objects.exclude(archive_manifest=[])
+        else:
+            forms = archives.eligible_forms(options['older_than_days'])
+
+        if options['verify']:
+            self._verify(forms)
+            return
+
+        if options['dry_run']:
+            days = options['older_than_days'] or settings.FORM_ARCHIVE_AFTER_DAYS
+            for form in forms:
+                self.stdout.write(f'{form.id} {form.title}')
+            self.stdout.write(f'{len(forms)} forms to archive (retention window {days} days)')
+            return
+
+        archived = 0
+        for form in forms:
+            try:
+                segment = archives.archive_form(form, options['file_format'], options['chunk_size'])
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+            except archives.ArchiveError as e:
+                self.stderr.write(f'{form.id}: {e}')
+                continue
+            archived += 1
+            self.stdout.write(
+                f"{form.id}: {segment['responses']} responses, {segment['answers']} answers "
+                f"-> {segment['file']} ({segment['bytes']:,} bytes)"
+            )
+        self.stdout.write(self.style.SUCCESS(f'{archived} forms archived'))
+
+    def _verify(self, forms):
+        failures = 0
+        for form in forms:
+            for segment in form.archive_manifest:
+                try:
+                    archives.verify_segment(segment)
+                except (archives.ArchiveError, ImproperlyConfigured) as e:
+                    failures += 1
+                    self.stderr.write(f'{form.id}: {e}')
+                else:
+                    self.stdout.write(f"{form.id}: {segment['file']} OK")
+        if failures:
+            raise CommandError(f'{failures} archive files failed verification')
+        self.stdout.write(self.style.SUCCESS('All archive files verified'))
@@ -0,0 +1,133 @@
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.test import Client, override_settings
+
+from forms import hashing
+from forms.models import Form, Question, Section
+
+
+PASSWORD = 'benchmark-password-1234'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark login throughput against form submission latency under mixed load: login clients post '
+        'to /api/auth/login/ while submit clients post responses, all served by a fixed number of web '
+        'worker threads, once hashing on the request threads and once through the hashing pool. Creates '
+        'a throwaway user and form (in the configured database) and deletes them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+        parser.add_argument('--web-workers', type=int, default=8, help='Request threads, like a WSGI server')
+        parser.add_argument('--login-clients', type=int, default=16)
+        parser.add_argument('--submit-clients', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=settings.PASSWORD_HASH_WORKERS, help='Hashing pool threads')
+        parser.add_argument('--queue', type=int, default=settings.PASSWORD_HASH_QUEUE, help='Hashing pool queue depth')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:8]}', password=PASSWORD)
+        form = Form.objects.create(title='Login benchmark', status='published', created_by=user)
+        section = Section.objects.create(form=form, title='Benchmark')
+        question = Question.objects.create(section=section, text='Benchmark', type='text')
+        self.stdout.write(
+            f"{options['web_workers']} web workers, {options['login_clients']} login clients, "
+            f"{options['submit_clients']} submit clients, {options['seconds']:g} s per run, "
+            f"hasher {settings.PASSWORD_HASHER}"
+        )
+        runs = [
+            ('submissions only', 0, 0, 0),
+            ('inline hashing', options['login_clients'], 0, 0),
+            (
+                f"hashing pool ({options['workers']} threads, queue {options['queue']})",
+                options['login_clients'], options['workers'], options['queue'],
+            ),
+        ]
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for label, login_clients, workers, queue in runs:
+                    with override_settings(PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE=queue):
+                        hashing.reset()
+                        samples = self._run(form, question, user.username, login_clients, options)
+                    self._report(label, samples, options['seconds'])
+        finally:
+            hashing.reset()
+            # The form, its responses and answers go with the user
+            user.delete()
+
+    def _run(self, form, question, username, login_clients, options):
+        """(status, seconds) per request kind; latency includes waiting for a web worker"""
+        server = ThreadPoolExecutor(max_workers=options['web_workers'])
+        samples = {'login': [], 'submit': []}
+        stop = time.monotonic() + options['seconds']
+
+        def serve(kind):
+            client = Client()
+            try:
+                if kind == 'login':
+                    return client.post(
+                        '/api/auth/login/', {'username': username, 'password': PASSWORD},
+                        content_type='application/json',
+                    )
+                return client.post(
+                    f'/api/responses/submit/{form.id}/',
+                    {'answers': [{'question_id': str(question.id), 'value': 'ok'}]},
+                    content_type='application/json',
+                )
+            finally:
+                # What the WSGI handler does at the end of a request
+                close_old_connections()
+
+        def run_client(kind):
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                response = server.submit(serve, kind).result()
+                samples[kind].append((response.status_code, time.perf_counter() - started))
+                if response.status_code == 429:
+                    # Well-behaved clients wait before retrying
+                    time.sleep(min(float(response['Retry-After']), max(0, stop - time.monotonic())))
+
+        clients = [
+            threading.Thread(target=run_client, args=(kind,))
+            for kind, count in (('login', login_clients), ('submit', options['submit_clients']))
+            for _ in range(count)
+        ]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        server.shutdown()
+        connections.close_all()
+        return samples
+
+    def _report(self, label, samples, seconds):
+        self.stdout.write(f'{label}:')
+        logins = samples['login']
+        if logins:
+            succeeded = [latency for status, latency in logins if status == 200]
+            rejected = sum(1 for status, _ in logins if status == 429)
+            self.stdout.write(
+                f'  logins  {len(succeeded) / seconds:8.1f}/s  rejected (429) {rejected / seconds:8.1f}/s  '
+                f'{self._percentiles(succeeded)}'
+            )
+        submitted = [latency for status, latency in samples['submit'] if status == 201]
+        failed = len(samples['submit']) - len(submitted)
+        self.stdout.write(
+            f'  submits {len(submitted) / seconds:8.1f}/s  {self._percentiles(submitted)}'
+            + (f'  ({failed} failed)' if failed else '')
+        )
+
+    @staticmethod
+    def _percentiles(latencies):
+        if len(latencies) < 2:
+            return 'p50/p95 -'
+        cuts = statistics.quantiles(latencies, n=20)
+        return f'p50 {cuts[9] * 1000:7.1f} ms  p95 {cuts[18] * 1000:7.1f} ms  max {max(latencies) * 1000:7.1f} ms'
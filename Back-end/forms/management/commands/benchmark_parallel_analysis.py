@@ -0,0 +1,101 @@
+from collections import Counter
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import analysis, text_analysis
+from forms.models import Question
+
+from .benchmark_text_analysis import ENGLISH_WORDS, PERSIAN_WORDS
+
+
+QUESTION_TYPES = ['single_choice'] * 8 + ['multi_choice'] * 4 + ['rating'] * 4 + ['text'] * 2 + ['textarea'] * 2
+OPTIONS = [{'value': f'o{i}', 'text': f'Option {i}'} for i in range(6)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark exact form analysis of a synthetic form inline vs across 1..N pool processes '
+        '(column batches are generated in memory, so database reads are not included)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=200)
+        parser.add_argument('--responses', type=int, default=5000)
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        responses = options['responses']
+        vocabulary = PERSIAN_WORDS * 3 + ENGLISH_WORDS
+        texts = [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(3, 60))) for _ in range(500)]
+        cached_tokens = [text_analysis.cached_tokens(text_analysis.token_counts(text)) for text in texts]
+
+        batches = []
+        for i in range(options['questions']):
+            question = Question(
+                text=f'Question {i}', type=QUESTION_TYPES[i % len(QUESTION_TYPES)], order=i,
+                options=OPTIONS, scale={'min': 1, 'max': 10}
+            )
+            # Choice and rating answers arrive grouped by their typed column
+            if question.type == 'single_choice':
+                counts = Counter(rng.choice(OPTIONS)['value'] for _ in range(responses))
+                columns = {'total': responses, 'weighted': list(counts.items())}
+            elif question.type == 'multi_choice':
+                counts = Counter(
+                    tuple(option['value'] for option in rng.sample(OPTIONS, rng.randint(1, 4)))
+                    for _ in range(responses)
+                )
+                columns = {'total': responses, 'weighted': [(list(values), count) for values, count in counts.items()]}
+            elif question.type == 'rating':
+                counts = Counter(rng.randint(1, 10) for _ in range(responses))
+                columns = {'total': responses, 'weighted': list(counts.items())}
+            else:
+                # One answer in ten has no cached token counts yet
+                stale = responses // 10
+                columns = {
+                    'tokens': [rng.choice(cached_tokens) for _ in range(responses - stale)],
+                    'stale': [(n, rng.choice(texts)) for n in range(stale)],
+                    'samples': texts[:20],
+                }
+            batches.append((question, columns))
+        self.stdout.write(
+            f'{len(batches)} questions x {responses} responses = {len(batches) * responses} answers'
+        )
+
+        started = time.perf_counter()
+        expected = [analysis.analyze_columns(question, columns) for question, columns in batches]
+        inline = time.perf_counter() - started
+        self.stdout.write(f'inline:       {inline:7.2f} s')
+
+        for workers in range(1, options['max_workers'] + 1):
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+            # Start every process before timing
+            list(pool.map(time.sleep, [0.5] * workers))
+            started = time.perf_counter()
+            results = list(analysis.map_in_pool(pool, batches, window=2 * workers))
+            elapsed = time.perf_counter() - started
+            pool.shutdown()
+            # Results are merged in question order, so they must match inline exactly
+            mismatched = [
+                question.text for (question, _), result, inline_result in zip(batches, results, expected)
+                if result != inline_result
+            ]
+            if len(results) != len(expected) or mismatched:
+                raise CommandError(
+                    f'{workers} processes: results differ from the inline analysis '
+                    f'({len(results)} of {len(expected)} questions; differing: {", ".join(mismatched[:5]) or "none"})'
+                )
+            self.stdout.write(f'{workers:2d} processes: {elapsed:7.2f} s  ({inline / elapsed:.2f}x inline)')
+        if (os.cpu_count() or 1) < options['max_workers']:
+            self.stdout.write(self.style.WARNING(
+                f'Only {os.cpu_count()} CPUs available; runs with more processes than CPUs cannot scale'
+            ))
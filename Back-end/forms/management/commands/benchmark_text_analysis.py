@@ -0,0 +1,81 @@
+import random
+import re
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forms import analysis, text_analysis
+from forms.models import Answer, Form, Question, Response as FormResponse, Section
+from forms.serializers import build_answer
+
+
+PERSIAN_WORDS = [
+    'اپلیکیشن', 'سرعت', 'خوب', 'عالی', 'کند', 'پرداخت', 'کیف', 'پول', 'تجربه',
+    'مشکل', 'ورود', 'صفحه', 'طراحی', 'پشتیبانی', 'بهتر', 'سریع', 'امکانات',
+    'می‌خواهم', 'مي‌خواهم', 'كاربر', 'کاربر', 'و', 'از', 'به', 'در', 'که', 'این',
+]
+ENGLISH_WORDS = ['app', 'Fast', 'slow', 'payment', 'login', 'the', 'and', 'UI', 'great']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark text analysis of a textarea question: re-tokenizing the stored answers vs reading '
+        'their cached tokens, both read from the database (the answers are inserted in a transaction '
+        'that is rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=100_000)
+        parser.add_argument('--words', type=int, default=40, help='Average words per answer')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = PERSIAN_WORDS * 3 + ENGLISH_WORDS
+        texts = [
+            ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, options['words'] * 2)))
+            for _ in range(options['answers'])
+        ]
+        self.stdout.write(f'{len(texts)} textarea answers, {sum(map(len, texts)) / 1e6:.1f}M characters')
+
+        with transaction.atomic():
+            form = Form.objects.create(title='Text analysis benchmark')
+            section = Section.objects.create(form=form, title='Benchmark')
+            question = Question.objects.create(section=section, text='Feedback', type='textarea')
+            responses = FormResponse.objects.bulk_create(
+                [FormResponse(form=form) for _ in texts], batch_size=2000
+            )
+            started = time.perf_counter()
+            answers = [build_answer(response, question, text) for response, text in zip(responses, texts)]
+            tokenize = time.perf_counter() - started
+            Answer.objects.bulk_create(answers, batch_size=2000)
+            answers = Answer.objects.filter(question=question)
+
+            started = time.perf_counter()
+            word_freq = Counter()
+            for value in answers.values_list('value', flat=True).iterator(chunk_size=2000):
+                word_freq.update(re.findall(r'\b\w+\b', value.lower()))
+            word_freq.most_common(30)
+            legacy = time.perf_counter() - started
+
+            started = time.perf_counter()
+            columns = analysis.question_columns(question, answers)
+            total, data, refreshed = analysis.analyze_columns(question, columns)
+            cached = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'legacy unigrams, re-tokenized per request:  {legacy * 1000:9.1f} ms')
+        self.stdout.write(f'pipeline, reading cached tokens:           {cached * 1000:9.1f} ms')
+        self.stdout.write(f'submit-time tokenization: {tokenize / len(texts) * 1e6:.1f} us per answer')
+        self.stdout.write(f'distinct raw tokens: {len(word_freq)}, terms: {len(data["frequency"])} shown')
+        self.stdout.write('top terms: ' + ', '.join(f"{w['word']}={w['count']}" for w in data['frequency'][:8]))
+        if refreshed:
+            self.stdout.write(self.style.WARNING(f'{len(refreshed)} answers had no cached tokens'))
+        ratio = legacy / cached if cached <= legacy else cached / legacy
+        verdict = 'faster' if cached <= legacy else 'slower'
+        style = self.style.SUCCESS if cached <= legacy else self.style.WARNING
+        self.stdout.write(style(
+            f'cached tokens (normalized, stopwords, bigrams) vs legacy re-tokenizing: {ratio:.1f}x {verdict}'
+        ))
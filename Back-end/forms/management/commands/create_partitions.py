@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from forms import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the response and answer partitions of the current and coming months (run monthly, '
+        'e.g. from cron). Rows already in the default partitions for those months are moved over.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError('The response table is not partitioned; run partition_tables first')
+        current = partitions.month_start(timezone.now())
+        for offset in range(options['months_ahead'] + 1):
+            month = partitions.add_months(current, offset)
+            try:
+                created = partitions.create_month(month)
+            except partitions.PartitionError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"{month:%Y-%m}: {'created' if created else 'exists'}")
@@ -0,0 +1,41 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from forms import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Detach the response and answer partitions of months before a cutoff. Detached months stay in '
+        'the database as plain tables (invisible to the application) unless --drop is passed.'
+    )
+
+    def add_arguments(self, parser):
+        cutoff = parser.add_mutually_exclusive_group(required=True)
+        cutoff.add_argument('--before', help='First month to keep, as YYYY-MM')
+        cutoff.add_argument('--keep-months', type=int, help='Keep the current month and this many before it')
+        parser.add_argument('--drop', action='store_true', help='Drop the detached tables')
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError('The response table is not partitioned; run partition_tables first')
+        if options['before']:
+            try:
+                year, month = options['before'].split('-')
+                cutoff = date(int(year), int(month), 1)
+            except ValueError:
+                raise CommandError('--before must be a month as YYYY-MM')
+        else:
+            cutoff = partitions.add_months(partitions.month_start(timezone.now()), -options['keep_months'])
+
+        months = [month for month in partitions.partition_months() if month < cutoff]
+        for month in months:
+            try:
+                tables = partitions.detach_month(month, drop=options['drop'])
+            except partitions.PartitionError as e:
+                raise CommandError(str(e))
+            action = 'dropped' if options['drop'] else 'detached'
+            self.stdout.write(f"{month:%Y-%m}: {action} {', '.join(tables)}")
+        self.stdout.write(self.style.SUCCESS(f'{len(months)} months before {cutoff:%Y-%m} removed from the tables'))
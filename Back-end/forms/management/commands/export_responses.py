@@ -0,0 +1,38 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import exports
+from forms.filters import ResponseFilter
+from forms.models import Form
+
+
+class Command(BaseCommand):
+    help = 'Export the responses of a form as CSV, Parquet or Arrow IPC stream (one row per response)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('form_id')
+        parser.add_argument('path', help='Output file; the format defaults to its extension')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'parquet', 'arrow'])
+
+    def handle(self, *args, **options):
+        try:
+            form = Form.objects.get(id=options['form_id'])
+        except (Form.DoesNotExist, ValueError):
+            raise CommandError(f"Form {options['form_id']} does not exist")
+        file_format = options['file_format'] or options['path'].rsplit('.', 1)[-1]
+        if file_format not in ('csv', 'parquet', 'arrow'):
+            raise CommandError('Pass --format csv, parquet or arrow')
+
+        response_filter = ResponseFilter(form)
+        started = time.perf_counter()
+        try:
+            exports.write_export(form, response_filter, options['path'], file_format)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+        total = response_filter.responses().count() + form.archived_response_count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {total} responses to {options['path']} in {elapsed:.1f}s"
+        ))
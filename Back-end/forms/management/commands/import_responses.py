@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import approx, imports
+from forms.models import Form
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical responses into a form from CSV (one column per question, id or text as header) '
+        'or NDJSON (one response per line). See forms/imports.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('form_id')
+        parser.add_argument('path')
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'ndjson'],
+                            help='Default: from the file extension')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Responses per transaction')
+        parser.add_argument('--max-errors', type=int, default=0,
+                            help='Abort after more than this many invalid records')
+        parser.add_argument('--max-error-rate', type=float,
+                            help='Abort once more than this fraction of records is invalid (checked after 1000)')
+        parser.add_argument('--rejects', help='Write invalid records (record number and reason) to this file')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+        parser.add_argument('--skip-sketches', action='store_true',
+                            help="Don't rebuild the approximate-analysis sketches afterwards")
+
+    def handle(self, *args, **options):
+        try:
+            form = Form.objects.get(id=options['form_id'])
+        except (Form.DoesNotExist, ValueError):
+            raise CommandError(f"Form {options['form_id']} does not exist")
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        file_format = options['file_format'] or path.rsplit('.', 1)[-1].lower()
+        readers = {'csv': imports.read_csv, 'ndjson': imports.read_ndjson, 'jsonl': imports.read_ndjson}
+        if file_format not in readers:
+            raise CommandError('Pass --format csv or ndjson')
+
+        source_name = os.path.basename(path)
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        progress = {'source': source_name, 'record': 0, 'responses': 0, 'answers': 0, 'errors': 0}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as checkpoint:
+                saved = json.load(checkpoint)
+            if saved.get('source') != source_name:
+                raise CommandError(f'{checkpoint_path} belongs to another file; pass --restart')
+            progress = saved
+            self.stdout.write(f"Resuming after record {progress['record']}")
+
+        rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+        resolver = imports.QuestionResolver(form)
+        archived_until = form.archived_until()
+        started = time.perf_counter()
+        answers_this_run = 0
+        chunk = []
+        processed = 0
+        errors = 0
+
+        def flush():
+            nonlocal chunk, answers_this_run
+            if not chunk:
+                return
+            written = imports.insert_chunk(form, source_name, chunk)
+            answers_this_run += written
+            progress['responses'] += len(chunk)
+            progress['answers'] += written
+            progress['record'] = chunk[-1][0]
+            chunk = []
+            with open(checkpoint_path, 'w') as checkpoint:
+                json.dump(progress, checkpoint)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{progress['responses']} responses, {progress['answers']} answers, "
+                f"{progress['errors']} rejected, {answers_this_run / elapsed:,.0f} answers/s"
+            )
+
+        try:
+            for number, record in readers[file_format](path, resolver):
+                if number <= progress['record']:
+                    continue
+                processed += 1
+                if not isinstance(record, imports.InvalidRecord):
+                    try:
+                        imports.validate_record(record, archived_until)
+                    except imports.InvalidRecord as e:
+                        record = e
+                if isinstance(record, imports.InvalidRecord):
+                    errors += 1
+                    if rejects:
+                        rejects.write(f'{number}\t{record}\n')
+                    if self._over_budget(errors, processed, options):
+                        flush()
+                        raise CommandError(
+                            f"Error budget exceeded at record {number} ({errors} invalid records): "
+                            f"{record}. Records before it are committed; fix the file and rerun to resume."
+                        )
+                    progress['errors'] += 1
+                    continue
+                chunk.append((number, record))
+                if len(chunk) >= options['chunk_size']:
+                    flush()
+            flush()
+        except imports.InvalidRecord as e:
+            raise CommandError(str(e))
+        finally:
+            if rejects:
+                rejects.close()
+
+        elapsed = time.perf_counter() - started
+        if settings.FORM_ANALYSIS_SKETCHES and not options['skip_sketches']:
+            approx.rebuild(form)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress['responses']} responses ({progress['answers']} answers) in {elapsed:.1f}s, "
+            f"{progress['errors']} records rejected"
+        ))
+
+    def _over_budget(self, errors, processed, options):
+        if options['max_error_rate'] is not None:
+            return processed >= 1000 and errors / processed > options['max_error_rate']
+        return errors > options['max_errors']
@@ -0,0 +1,131 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from forms import legacy
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy users, forms, sections, questions, responses and answers from the legacy database (integer '
+        'ids) into the current schema, in id-ordered chunks across worker processes, verifying row counts '
+        'and checksums per table. Rerunning with the same checkpoint file resumes an interrupted copy.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='source', default='old', help='Legacy database alias (default old)')
+        parser.add_argument('--to', dest='target', default='default', help='Target database alias (default default)')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes copying chunks')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows per chunk')
+        parser.add_argument(
+            '--checkpoint', default='migrate_legacy.checkpoint.json', help='File recording the copied chunks'
+        )
+
+    def handle(self, *args, **options):
+        source, target = options['source'], options['target']
+        for alias in (source, target):
+            if alias not in settings.DATABASES:
+                raise CommandError(f'Unknown database alias {alias}')
+        if source == target:
+            raise CommandError('--from and --to must be different databases')
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+
+        workers = options['workers']
+        if workers > 1 and connections[target].vendor == 'sqlite':
+            self.stderr.write('SQLite allows a single writer: copying with one worker')
+            workers = 1
+
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = self._load_checkpoint(source, target, options['chunk_size'])
+        try:
+            columns = {spec.table: legacy.source_columns(source, spec.table) for spec in legacy.TABLES}
+        except legacy.LegacyError as e:
+            raise CommandError(str(e))
+
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        failures = []
+        try:
+            # Tables in dependency order: a table's chunks all finish before the next table starts
+            for spec in legacy.TABLES:
+                if not self._copy_table(executor, spec, columns[spec.table], source, target, options['chunk_size']):
+                    failures.append(spec.table)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        legacy.reset_sequences(target)
+
+        if failures:
+            raise CommandError(f"Verification failed for {', '.join(failures)}; rerun to copy them again")
+        self.stdout.write(self.style.SUCCESS('Legacy data copied and verified'))
+
+    def _copy_table(self, executor, spec, columns, source, target, chunk_size):
+        """Copy the table's pending chunks, then verify it; returns whether it matches"""
+        done = self.checkpoint['tables'].setdefault(spec.table, {})
+        bounds = legacy.chunk_bounds(source, spec.table, chunk_size)
+        pending = [(first, last) for first, last in bounds if f'{first}-{last}' not in done]
+        if len(pending) < len(bounds):
+            self.stdout.write(f'{spec.table}: {len(bounds) - len(pending)} of {len(bounds)} chunks already copied')
+
+        args = [(source, target, spec.table, columns, first, last) for first, last in pending]
+        if executor is None:
+            results = ((arg, legacy.copy_chunk(*arg)) for arg in args)
+        else:
+            futures = {executor.submit(legacy.copy_chunk, *arg): arg for arg in args}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+        for arg, result in results:
+            first, last = arg[-2:]
+            if result['source'] != result['target']:
+                # Not checkpointed: the next run copies the chunk again
+                self.stderr.write(f'{spec.table}: checksum mismatch in ids {first}-{last}')
+                continue
+            done[f'{first}-{last}'] = result
+            self._save_checkpoint()
+
+        expected = legacy.source_count(source, spec.table)
+        copied = [done.get(f'{first}-{last}') for first, last in bounds]
+        if None in copied:
+            self.stderr.write(f'{spec.table}: {copied.count(None)} chunks not copied')
+            return False
+        rows = sum(chunk['rows'] for chunk in copied)
+        source_checksum = legacy.combine_checksums(chunk['source'] for chunk in copied)
+        target_checksum = legacy.combine_checksums(chunk['target'] for chunk in copied)
+        if rows != expected or source_checksum != target_checksum:
+            self.stderr.write(
+                f'{spec.table}: {rows} rows copied of {expected}, checksum {source_checksum[:12]} '
+                f'source / {target_checksum[:12]} target'
+            )
+            return False
+        self.stdout.write(f'{spec.table}: {rows} rows, checksum {source_checksum[:12]} OK')
+        return True
+
+    def _load_checkpoint(self, source, target, chunk_size):
+        key = {'from': source, 'to': target, 'chunk_size': chunk_size}
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return {**key, 'tables': {}}
+        if {name: checkpoint.get(name) for name in key} != key:
+            raise CommandError(
+                f'{self.checkpoint_path} belongs to another copy '
+                f"(--from {checkpoint.get('from')} --to {checkpoint.get('to')} --chunk-size {checkpoint.get('chunk_size')})"
+            )
+        return checkpoint
+
+    def _save_checkpoint(self):
+        partial = f'{self.checkpoint_path}.tmp'
+        with open(partial, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(partial, self.checkpoint_path)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the response and answer tables to monthly range partitions on submitted_at (PostgreSQL). '
+        'Copies every row inside one transaction that locks both tables; see forms/partitions.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Also create partitions for this many months after the current one')
+
+    def handle(self, *args, **options):
+        try:
+            months = partitions.convert(months_ahead=options['months_ahead'])
+        except partitions.PartitionError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned {", ".join(partitions.PARTITIONED_TABLES)} into {len(months)} months '
+            f'({months[0]:%Y-%m} to {months[-1]:%Y-%m}) plus default partitions'
+        ))
@@ -0,0 +1,58 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import provisioning
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users in bulk from a CSV file with a header row: username, password (or an encoded '
+        'password_hash), and optionally email, first_name, last_name and forms (public form UUIDs '
+        'separated by ";" to hand over to the user). Existing usernames are skipped. See forms/provisioning.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users per transaction')
+        parser.add_argument('--workers', type=int, default=settings.PROVISION_HASH_WORKERS,
+                            help='Password hashing processes')
+        parser.add_argument('--rejects', help='Write skipped and invalid records (record number and reason) to this file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        started = time.perf_counter()
+
+        def progress(report):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{report['created']} created, {report['existing']} existing, {report['rejected']} rejected, "
+                f"{report['created'] / elapsed:,.0f} users/s"
+            )
+
+        try:
+            report = provisioning.provision(
+                provisioning.read_csv(path), chunk_size=options['chunk_size'],
+                workers=options['workers'], progress=progress if options['verbosity'] >= 1 else None,
+            )
+        except provisioning.InvalidRecord as e:
+            raise CommandError(str(e))
+        finally:
+            provisioning.reset_pool()
+
+        if options['rejects']:
+            with open(options['rejects'], 'w', encoding='utf-8') as rejects:
+                for number, message in report['messages']:
+                    rejects.write(f'{number}\t{message}\n')
+        elif options['verbosity'] >= 1:
+            for number, message in report['messages']:
+                self.stderr.write(f'{number}: {message}')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']} users in {elapsed:.1f}s ({report['forms_assigned']} forms assigned), "
+            f"{report['existing']} existing skipped, {report['rejected']} records rejected"
+        ))
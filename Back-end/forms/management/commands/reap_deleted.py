@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from forms import reaper
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete soft-deleted forms, sections and questions with their responses and answers, in chunks '
+        '(see forms/reaper.py)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, help='Rows per delete (default TOMBSTONE_REAP_CHUNK_SIZE)')
+        parser.add_argument('--pause', type=float, help='Seconds between chunks (default TOMBSTONE_REAP_PAUSE)')
+        parser.add_argument('--max-seconds', type=float, help='Stop after this long; the next run continues')
+
+    def handle(self, *args, **options):
+        run = reaper.Reaper(
+            chunk_size=options['chunk_size'], pause=options['pause'], max_seconds=options['max_seconds'],
+            progress=self._progress if options['verbosity'] > 1 else None,
+        )
+        try:
+            counts = run.run()
+        except reaper.OutOfTime:
+            self.stdout.write(self._summary(run.counts))
+            self.stdout.write(self.style.WARNING('Stopped at --max-seconds; run again to continue'))
+            return
+        self.stdout.write(self._summary(counts))
+        self.stdout.write(self.style.SUCCESS('Nothing left to delete'))
+
+    def _progress(self, counts):
+        self.stdout.write(self._summary(counts))
+
+    @staticmethod
+    def _summary(counts):
+        return ', '.join(f'{count} {name}' for name, count in counts.items()) + ' deleted'
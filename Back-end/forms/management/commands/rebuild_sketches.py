@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from forms import approx
+from forms.models import Form
+
+
+class Command(BaseCommand):
+    help = 'Recompute the approximate-analysis sketches of forms from their stored answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('form_ids', nargs='*', help='Form ids (default: all forms)')
+
+    def handle(self, *args, **options):
+        forms = Form.objects.all()
+        if options['form_ids']:
+            forms = forms.filter(id__in=options['form_ids'])
+            if forms.count() != len(set(options['form_ids'])):
+                raise CommandError('Some form ids do not exist')
+        for form in forms.iterator():
+            question_count = approx.rebuild(form)
+            self.stdout.write(f'{form.id}: rebuilt sketches for {question_count} questions')
+        self.stdout.write(self.style.SUCCESS('Done'))
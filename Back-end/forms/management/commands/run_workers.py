@@ -0,0 +1,82 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+
+from forms import jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+def _pool(concurrency):
+    return ProcessPoolExecutor(
+        max_workers=concurrency,
+        # Spawned, not forked: children open their own database connections
+        # instead of inheriting (and closing) the daemon's
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (see forms/jobs.py) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        worker = jobs.worker_name()
+        pool = _pool(concurrency)
+        running = {}
+        self.stdout.write(f'{worker}: running jobs with {concurrency} processes')
+        try:
+            while True:
+                requeued, failed = jobs.requeue_stale()
+                if requeued or failed:
+                    self.stdout.write(f'Requeued {requeued} stale jobs, gave up on {failed}')
+
+                while len(running) < concurrency:
+                    job = jobs.claim(worker)
+                    if job is None:
+                        break
+                    running[pool.submit(jobs.run, job.id)] = job
+                    self.stdout.write(f'Started {job.kind} {job.id}')
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        # The job stays 'running' and is requeued once it times out
+                        outcome = 'lost (worker process died)'
+                        broken = True
+                    except Exception:
+                        # e.g. a database error before the job's outcome was recorded; it stays
+                        # 'running' and is requeued once it times out, and the daemon keeps going
+                        logger.exception('Job %s (%s) raised in the worker', job.id, job.kind)
+                        outcome = 'error (see the log)'
+                    self.stdout.write(f'Finished {job.kind} {job.id}: {outcome}')
+                if broken:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = _pool(concurrency)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping; waiting for running jobs')
+        finally:
+            pool.shutdown(wait=True)
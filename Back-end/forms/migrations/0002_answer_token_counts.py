@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:46
+
+from django.db import migrations, models
+
+from forms.text_analysis import TEXT_QUESTION_TYPES, token_counts
+
+
+def backfill_token_counts(apps, schema_editor):
+    Answer = apps.get_model('forms', 'Answer')
+    answers = Answer.objects.filter(question__type__in=TEXT_QUESTION_TYPES).only('id', 'value')
+    batch = []
+    for answer in answers.iterator(chunk_size=2000):
+        answer.token_counts = token_counts(answer.value)
+        batch.append(answer)
+        if len(batch) >= 2000:
+            Answer.objects.bulk_update(batch, ['token_counts'])
+            batch = []
+    if batch:
+        Answer.objects.bulk_update(batch, ['token_counts'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='token_counts',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_token_counts, migrations.RunPython.noop),
+    ]
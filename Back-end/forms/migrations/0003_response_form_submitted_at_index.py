@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0002_answer_token_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['form', 'submitted_at'], name='forms_respo_form_id_72f51e_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-19 09:52
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0003_response_form_submitted_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionSketch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('state', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sketches', to='forms.question')),
+            ],
+            options={
+                'unique_together': {('question', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+RESPONSE_SEQUENCE = 'forms_response_seq'  # forms.models.RESPONSE_SEQUENCE
+
+
+def backfill_seq(apps, schema_editor):
+    Response = apps.get_model('forms', 'Response')
+    responses = Response.objects.order_by('submitted_at', 'id').only('id')
+    batch = []
+    seq = 0
+    for response in responses.iterator(chunk_size=2000):
+        seq += 1
+        response.seq = seq
+        batch.append(response)
+        if len(batch) >= 2000:
+            Response.objects.bulk_update(batch, ['seq'])
+            batch = []
+    if batch:
+        Response.objects.bulk_update(batch, ['seq'])
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE SEQUENCE IF NOT EXISTS {RESPONSE_SEQUENCE}')
+        schema_editor.execute(f"SELECT setval('{RESPONSE_SEQUENCE}', %s, %s)", [max(seq, 1), seq > 0])
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP SEQUENCE IF EXISTS {RESPONSE_SEQUENCE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0005_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='seq',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_seq, drop_sequence),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['form', 'seq'], name='forms_respo_form_id_3abb0c_idx'),
+        ),
+    ]
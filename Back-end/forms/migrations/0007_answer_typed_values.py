@@ -0,0 +1,105 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:10
+
+from django.db import migrations, models
+
+
+CHOICE_MASK_BITS = 63  # forms.models.CHOICE_MASK_BITS
+TYPED_FIELDS = ['value_num', 'value_text', 'value_choice', 'value_choice_mask']
+
+
+def typed_values(question_type, choice_keys, value):
+    # forms.models.typed_answer_values as of this migration
+    typed = dict.fromkeys(TYPED_FIELDS)
+    if question_type == 'multi_choice':
+        if isinstance(value, list):
+            mask = 0
+            for item in value:
+                index = choice_keys.index(item) if isinstance(item, str) and item in choice_keys else None
+                if index is None or index >= CHOICE_MASK_BITS or mask >> index & 1:
+                    mask = None
+                    break
+                mask |= 1 << index
+            typed['value_choice_mask'] = mask
+    elif question_type == 'single_choice':
+        if isinstance(value, str):
+            typed['value_choice'] = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        typed['value_num'] = float(value)
+    elif isinstance(value, str):
+        typed['value_text'] = value
+    return typed
+
+
+def backfill_typed_values(apps, schema_editor):
+    Question = apps.get_model('forms', 'Question')
+    Answer = apps.get_model('forms', 'Answer')
+    questions = {}
+    for question in Question.objects.all():
+        keys = []
+        for option in question.options or []:
+            value = option.get('value') if isinstance(option, dict) else None
+            if isinstance(value, str) and value not in keys:
+                keys.append(value)
+        question.choice_keys = keys
+        question.save(update_fields=['choice_keys'])
+        questions[question.id] = question
+
+    batch = []
+    for answer in Answer.objects.only('id', 'question_id', 'value').iterator(chunk_size=2000):
+        question = questions[answer.question_id]
+        for field, typed in typed_values(question.type, question.choice_keys, answer.value).items():
+            setattr(answer, field, typed)
+        batch.append(answer)
+        if len(batch) >= 2000:
+            Answer.objects.bulk_update(batch, TYPED_FIELDS)
+            batch = []
+    if batch:
+        Answer.objects.bulk_update(batch, TYPED_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0006_response_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='value_choice',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='value_choice_mask',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='value_num',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='value_text',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='choice_keys',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(backfill_typed_values, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'value_num'], name='forms_answe_questio_671693_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'value_choice'], name='forms_answe_questio_d28f77_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'value_choice_mask'], name='forms_answe_questio_b0eea9_idx'),
+        ),
+    ]
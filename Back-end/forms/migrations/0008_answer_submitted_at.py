@@ -0,0 +1,34 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+def backfill_submitted_at(apps, schema_editor):
+    Answer = apps.get_model('forms', 'Answer')
+    Response = apps.get_model('forms', 'Response')
+    Answer.objects.filter(submitted_at__isnull=True).update(
+        submitted_at=models.Subquery(
+            Response.objects.filter(id=models.OuterRef('response_id')).values('submitted_at')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0007_answer_typed_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='submitted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_submitted_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='submitted_at',
+            field=models.DateTimeField(editable=False),
+        ),
+    ]
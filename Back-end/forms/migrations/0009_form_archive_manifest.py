@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0008_answer_submitted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form',
+            name='archive_manifest',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_form(apps, schema_editor):
+    Answer = apps.get_model('forms', 'Answer')
+    Response = apps.get_model('forms', 'Response')
+    Answer.objects.filter(form__isnull=True).update(
+        form=models.Subquery(
+            Response.objects.filter(id=models.OuterRef('response_id')).values('form_id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0009_form_archive_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='form',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='forms.form'),
+        ),
+        migrations.RunPython(backfill_form, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='form',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='forms.form'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['form', 'question'], name='forms_answe_form_id_9ed1df_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['form', 'submitted_at'], name='forms_answe_form_id_2c69da_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0010_answer_form'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='question',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='section',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='form',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='question',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True)), fields=('section', 'order'), name='unique_active_question_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='section',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True)), fields=('form', 'order'), name='unique_active_section_order'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0011_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='typed_values_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
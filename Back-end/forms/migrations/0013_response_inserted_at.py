@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0012_question_typed_values_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='inserted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
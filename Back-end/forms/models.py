@@ -1,8 +1,33 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import uuid
 
 
+class ActiveQuerySet(models.QuerySet):
+    def soft_delete(self):
+        """
+        Tombstone the rows (deleted_at): they are hidden at once and
+        removed with their answers later, in chunks (see reaper.py)
+        """
+        return self.update(deleted_at=timezone.now())
+
+
+class ActiveManager(models.Manager.from_queryset(ActiveQuerySet)):
+    """Default manager hiding soft-deleted rows; ``all_objects`` still sees them"""
+    
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class SectionQuerySet(ActiveQuerySet):
+    def soft_delete(self):
+        # Questions are looked up by section__form: hide them along with their section
+        Question.all_objects.filter(section__in=self, deleted_at__isnull=True).soft_delete()
+        return super().soft_delete()
+
+
 class Form(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
@@ -19,12 +44,26 @@ class Form(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='forms', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    archive_manifest = models.JSONField(default=list, blank=True, editable=False)  # Archived response files, oldest first (see archives.py)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)  # Soft-deleted, awaiting the reaper
+    
+    objects = ActiveManager()
+    all_objects = ActiveQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return self.title
+    
+    def archived_until(self):
+        """Latest submitted_at covered by the archive files, or None if nothing is archived"""
+        if not self.archive_manifest:
+            return None
+        return max(parse_datetime(segment['until']) for segment in self.archive_manifest)
+    
+    def archived_response_count(self):
+        return sum(segment['responses'] for segment in self.archive_manifest)
 
 
 class Section(models.Model):
@@ -34,10 +73,19 @@ class Section(models.Model):
     description = models.TextField(blank=True, null=True)
     order = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)  # Soft-deleted, awaiting the reaper
+    
+    objects = ActiveManager.from_queryset(SectionQuerySet)()
+    all_objects = SectionQuerySet.as_manager()
     
     class Meta:
         ordering = ['order', 'created_at']
-        unique_together = ['form', 'order']
+        constraints = [
+            # Tombstoned sections don't hold on to their position
+            models.UniqueConstraint(
+                fields=['form', 'order'], condition=models.Q(deleted_at__isnull=True), name='unique_active_section_order'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.form.title} - {self.title}"
@@ -65,13 +113,56 @@ class Question(models.Model):
     scale = models.JSONField(default=dict, blank=True, null=True)  # For rating/scale: {"min": 1, "max": 5, "labels": [...]}
     visibility = models.JSONField(default=dict, blank=True, null=True)  # {"dependsOn": "q1_3", "showIfIn": ["many", "some"]}
     exclusive_options = models.JSONField(default=list, blank=True, null=True)  # ["none"] - options that exclude others
+    choice_keys = models.JSONField(default=list, blank=True, editable=False)  # Every option value ever offered, append-only: bit i of Answer.value_choice_mask is choice_keys[i]
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)  # Soft-deleted, awaiting the reaper
+    typed_values_pending = models.BooleanField(default=False, editable=False)  # Type changed, answers' typed columns not refreshed yet: analysis reads value
+    
+    objects = ActiveManager()
+    all_objects = ActiveQuerySet.as_manager()
     
     class Meta:
         ordering = ['order', 'id']
-        unique_together = ['section', 'order']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['section', 'order'], condition=models.Q(deleted_at__isnull=True), name='unique_active_question_order'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.section.title} - {self.text[:50]}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_type = instance.__dict__.get('type')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        if self.register_choice_keys() and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'choice_keys'}
+        saved_type = getattr(self, '_saved_type', None)
+        retyped = saved_type is not None and saved_type != self.type
+        if retyped:
+            # The typed columns of existing answers depend on the question type
+            self.typed_values_pending = True
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'typed_values_pending'}
+        super().save(*args, **kwargs)
+        if retyped:
+            schedule_typed_values_refresh(self)
+        self._saved_type = self.type
+    
+    def register_choice_keys(self):
+        """Append option values missing from choice_keys; returns whether any were added"""
+        keys = list(self.choice_keys or [])
+        for option in self.options or []:
+            value = option.get('value') if isinstance(option, dict) else None
+            if isinstance(value, str) and value not in keys:
+                keys.append(value)
+        if keys == (self.choice_keys or []):
+            return False
+        self.choice_keys = keys
+        return True
 
 
 class Response(models.Model):
@@ -80,12 +171,48 @@ class Response(models.Model):
     user_id = models.CharField(max_length=255, blank=True, null=True)
     submitted_at = models.DateTimeField(auto_now_add=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
+    seq = models.BigIntegerField(blank=True, null=True, editable=False)  # Change feed position (see next_response_seqs)
+    inserted_at = models.DateTimeField(blank=True, null=True, editable=False)  # When seq was drawn, in the inserting transaction; the feed settles on it (null: older rows)
     
     class Meta:
         ordering = ['-submitted_at']
+        indexes = [
+            models.Index(fields=['form', 'submitted_at']),
+            models.Index(fields=['form', 'seq']),
+        ]
     
     def __str__(self):
         return f"Response to {self.form.title} - {self.submitted_at}"
+    
+    def save(self, *args, **kwargs):
+        if self.seq is None:
+            self.seq = next_response_seqs(1)[0]
+            self.inserted_at = timezone.now()
+        super().save(*args, **kwargs)
+    
+    def partition_answers(self):
+        """This response's answers, looked up in its month's partition only (see partitions.py)"""
+        return self.answers.filter(submitted_at=self.submitted_at)
+
+
+RESPONSE_SEQUENCE = 'forms_response_seq'
+
+
+def next_response_seqs(count, using=DEFAULT_DB_ALIAS):
+    """
+    Reserve ``count`` increasing change-feed sequence numbers for new
+    responses (callers of bulk_create assign them explicitly, with
+    ``inserted_at``, inside the transaction inserting the rows). PostgreSQL
+    draws them from a database sequence; other backends continue from the
+    current maximum, which is only safe with a single writer (development).
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{RESPONSE_SEQUENCE}') FROM generate_series(1, %s)", [count])
+            return sorted(row[0] for row in cursor.fetchall())
+    current = Response.objects.using(using).aggregate(current=models.Max('seq'))['current'] or 0
+    return list(range(current + 1, current + count + 1))
 
 
 class Answer(models.Model):
@@ -93,9 +220,148 @@ class Answer(models.Model):
     response = models.ForeignKey(Response, related_name='answers', on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     value = models.JSONField()  # Can store string, number, or array
+    # Copies of response.form and response.submitted_at: a form's answers are scanned without joining responses
+    form = models.ForeignKey(Form, related_name='answers', on_delete=models.CASCADE, editable=False, db_index=False)  # Indexed by (form, question)
+    submitted_at = models.DateTimeField(editable=False)  # Also the partition key (see partitions.py)
+    token_counts = models.JSONField(blank=True, null=True)  # Text answers: cached normalized tokens (see text_analysis)
+    # Typed copies of value, derived at write time (see typed_answer_values)
+    value_num = models.FloatField(blank=True, null=True)  # Numeric answers (rating/scale)
+    value_text = models.TextField(blank=True, null=True)  # Free text answers
+    value_choice = models.TextField(blank=True, null=True)  # Single choice: the option value
+    value_choice_mask = models.BigIntegerField(blank=True, null=True)  # Multi choice: bitmask over question.choice_keys
     
     class Meta:
         unique_together = ['response', 'question']
+        indexes = [
+            models.Index(fields=['form', 'question']),
+            models.Index(fields=['form', 'submitted_at']),
+            models.Index(fields=['question', 'value_num']),
+            models.Index(fields=['question', 'value_choice']),
+            models.Index(fields=['question', 'value_choice_mask']),
+        ]
     
     def __str__(self):
         return f"Answer to {self.question.text[:30]}"
+
+
+CHOICE_MASK_BITS = 63  # value_choice_mask is a signed 64-bit integer
+
+
+def choice_mask(question, values):
+    """
+    Bitmask of a multi choice selection over question.choice_keys, or None
+    when it can't be represented (an unknown or repeated value, or an
+    option past CHOICE_MASK_BITS); those answers are read from value.
+    """
+    keys = question.choice_keys or []
+    mask = 0
+    for value in values:
+        if not isinstance(value, str) or value not in keys:
+            return None
+        index = keys.index(value)
+        if index >= CHOICE_MASK_BITS or mask >> index & 1:
+            return None
+        mask |= 1 << index
+    return mask
+
+
+def choice_mask_values(question, mask):
+    """The option values selected in a value_choice_mask"""
+    return [key for index, key in enumerate(question.choice_keys or []) if mask >> index & 1]
+
+
+def typed_answer_values(question, value):
+    """The typed columns of an answer (all None when value fits none of them)"""
+    typed = {'value_num': None, 'value_text': None, 'value_choice': None, 'value_choice_mask': None}
+    if question.type == 'multi_choice':
+        if isinstance(value, list):
+            typed['value_choice_mask'] = choice_mask(question, value)
+    elif question.type == 'single_choice':
+        if isinstance(value, str):
+            typed['value_choice'] = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        typed['value_num'] = float(value)
+    elif isinstance(value, str):
+        typed['value_text'] = value
+    return typed
+
+
+RETYPE_JOB_KIND = 'answers.retype'
+
+
+def schedule_typed_values_refresh(question):
+    """
+    Queue a job running refresh_typed_values for a question whose type
+    changed, unless one is already waiting; until it has run the question
+    is typed_values_pending and analysis reads the answers' stored values
+    """
+    payload = {'question_id': str(question.id)}
+    queued = Job.objects.filter(kind=RETYPE_JOB_KIND, status='queued', payload__question_id=payload['question_id'])
+    if not queued.exists():
+        Job.objects.create(kind=RETYPE_JOB_KIND, form_id=question.section.form_id, payload=payload)
+
+
+def refresh_typed_values(question, batch_size=2000):
+    """Recompute the typed columns of all of a question's answers; returns the number of answers"""
+    fields = ['value_num', 'value_text', 'value_choice', 'value_choice_mask']
+    batch = []
+    count = 0
+    for answer in Answer.objects.filter(question=question).only('id', 'value').iterator(chunk_size=batch_size):
+        for field, typed in typed_answer_values(question, answer.value).items():
+            setattr(answer, field, typed)
+        batch.append(answer)
+        count += 1
+        if len(batch) >= batch_size:
+            Answer.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Answer.objects.bulk_update(batch, fields)
+    return count
+
+
+class QuestionSketch(models.Model):
+    """Mergeable approximate-analysis state of a question, in shards (see approx.py)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    question = models.ForeignKey(Question, related_name='sketches', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField(default=0)
+    state = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['question', 'shard']
+    
+    def __str__(self):
+        return f"Sketch {self.shard} of {self.question.text[:30]}"
+
+
+class Job(models.Model):
+    """Background job queued for `manage.py run_workers` (see jobs.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    form = models.ForeignKey(Form, related_name='jobs', on_delete=models.CASCADE, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=255, blank=True, null=True)  # Worker that claimed the job
+    created_by = models.ForeignKey(User, related_name='jobs', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} ({self.status})"
@@ -0,0 +1,264 @@
+"""
+Optional monthly range partitioning of the response and answer tables on
+``submitted_at`` (PostgreSQL only).
+
+Answers carry a copy of their response's ``submitted_at`` so the two
+tables are co-partitioned: a month of responses and its answers live in
+partitions of the same name suffix (``forms_response_p2026_10``,
+``forms_answer_p2026_10``), and queries with a submitted_at range (see
+``filters.ResponseFilter``, ``Response.partition_answers``) only touch
+the partitions it covers. Old months can be detached in one cheap
+catalog operation instead of a bulk DELETE.
+
+    manage.py partition_tables      one-time conversion (copies every row)
+    manage.py create_partitions     create the coming months (run monthly)
+    manage.py detach_partitions     detach (and optionally drop) old months
+
+Partitioned tables need the partition key in every primary key and unique
+constraint, so after the conversion the database enforces (id,
+submitted_at) and (response_id, question_id, submitted_at); Django still
+sees ``id`` as the primary key. Rows outside every monthly partition go
+to a ``_default`` partition; ``create_partitions`` moves them into the
+month's partition when it is created.
+"""
+import re
+from datetime import date, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Answer, Response as FormResponse
+
+
+RESPONSE_TABLE = FormResponse._meta.db_table
+ANSWER_TABLE = Answer._meta.db_table
+# Referenced table first
+PARTITIONED_TABLES = (RESPONSE_TABLE, ANSWER_TABLE)
+PARTITION_KEY = 'submitted_at'
+MONTH_SUFFIX = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+class PartitionError(Exception):
+    pass
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def _bounds(month):
+    """FOR VALUES clause of a month's partition (UTC month boundaries)"""
+    return f"FROM ('{month.isoformat()} 00:00:00+00') TO ('{add_months(month, 1).isoformat()} 00:00:00+00')"
+
+
+_partitioned = None
+
+
+def is_partitioned():
+    """Whether the response table is partitioned (looked up once per process)"""
+    global _partitioned
+    if _partitioned is None:
+        _partitioned = connection.vendor == 'postgresql' and _is_partitioned_table(RESPONSE_TABLE)
+    return _partitioned
+
+
+def _is_partitioned_table(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))', [table]
+        )
+        return cursor.fetchone()[0]
+
+
+def _require_postgresql():
+    if connection.vendor != 'postgresql':
+        raise PartitionError('Table partitioning requires PostgreSQL')
+
+
+def partition_months():
+    """Months that have partitions, oldest first"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [RESPONSE_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = MONTH_SUFFIX.search(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def convert(months_ahead=3):
+    """
+    Replace the response and answer tables by partitioned tables with the
+    same columns, constraints and indexes, and copy every row over. Runs
+    in one transaction that holds exclusive locks on both tables for the
+    whole copy, so plan for downtime on large tables. Returns the months
+    created.
+    """
+    _require_postgresql()
+    if _is_partitioned_table(RESPONSE_TABLE):
+        raise PartitionError(f'{RESPONSE_TABLE} is already partitioned')
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conrelid::regclass::text FROM pg_constraint '
+            'WHERE contype = %s AND confrelid = ANY(%s::regclass[]) AND NOT conrelid = ANY(%s::regclass[])',
+            ['f', list(PARTITIONED_TABLES), list(PARTITIONED_TABLES)],
+        )
+        referencing = [row[0] for row in cursor.fetchall()]
+        if referencing:
+            raise PartitionError(f"Tables referencing the responses or answers can't be converted: {referencing}")
+
+        # Recreated on the new tables once the rows are copied
+        constraints = {table: _constraint_definitions(cursor, table) for table in PARTITIONED_TABLES}
+        indexes = {table: _index_definitions(cursor, table) for table in PARTITIONED_TABLES}
+
+        cursor.execute(f'SELECT min({quote(PARTITION_KEY)}) FROM {quote(RESPONSE_TABLE)}')
+        oldest = cursor.fetchone()[0]
+        current = month_start(timezone.now())
+        first = month_start(oldest.astimezone(dt_timezone.utc)) if oldest else current
+        months = []
+        month = first
+        while month <= add_months(current, months_ahead):
+            months.append(month)
+            month = add_months(month, 1)
+
+        for table in PARTITIONED_TABLES:
+            old = f'{table}_unpartitioned'
+            cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+            cursor.execute(
+                f'CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS) '
+                f'PARTITION BY RANGE ({quote(PARTITION_KEY)})'
+            )
+            for month in months:
+                cursor.execute(
+                    f'CREATE TABLE {quote(partition_name(table, month))} '
+                    f'PARTITION OF {quote(table)} FOR VALUES {_bounds(month)}'
+                )
+            cursor.execute(f'CREATE TABLE {quote(default_partition_name(table))} PARTITION OF {quote(table)} DEFAULT')
+            cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+        for table in reversed(PARTITIONED_TABLES):
+            cursor.execute(f'DROP TABLE {quote(table + "_unpartitioned")}')
+
+        for table in PARTITIONED_TABLES:
+            for name, definition in constraints[table]:
+                cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+            for definition in indexes[table]:
+                cursor.execute(definition)
+    global _partitioned
+    _partitioned = True
+    return months
+
+
+def _constraint_definitions(cursor, table):
+    """
+    (name, definition) of a table's constraints, rewritten for the
+    partitioned table: the partition key is added to the primary key and
+    unique constraints, and the answer -> response foreign key references
+    (id, submitted_at)
+    """
+    cursor.execute(
+        'SELECT conname, contype, pg_get_constraintdef(oid), confrelid = to_regclass(%s) '
+        'FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype IN (%s, %s, %s, %s) '
+        'ORDER BY contype DESC, conname',
+        [RESPONSE_TABLE, table, 'p', 'u', 'f', 'c'],
+    )
+    definitions = []
+    for name, kind, definition, references_responses in cursor.fetchall():
+        if kind in ('p', 'u'):
+            definition = re.sub(r'\)', f', {PARTITION_KEY})', definition, count=1)
+        elif kind == 'f' and references_responses:
+            column = re.search(r'FOREIGN KEY \((\w+)\)', definition).group(1)
+            definition = (
+                f'FOREIGN KEY ({column}, {PARTITION_KEY}) '
+                f'REFERENCES {quote(RESPONSE_TABLE)} (id, {PARTITION_KEY}) DEFERRABLE INITIALLY DEFERRED'
+            )
+        definitions.append((name, definition))
+    return definitions
+
+
+def _index_definitions(cursor, table):
+    """CREATE INDEX statements of a table's indexes other than those backing constraints"""
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN '
+        '(SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s)) ORDER BY indexname',
+        [table, table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create_month(month):
+    """
+    Create a month's response and answer partitions; returns False if
+    they already exist. Rows of that month sitting in the default
+    partitions are moved into the new partitions.
+    """
+    _require_postgresql()
+    names = {table: partition_name(table, month) for table in PARTITIONED_TABLES}
+    in_month = (
+        f'{quote(PARTITION_KEY)} >= %s AND {quote(PARTITION_KEY)} < %s',
+        [f'{month.isoformat()} 00:00:00+00', f'{add_months(month, 1).isoformat()} 00:00:00+00'],
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [names[RESPONSE_TABLE]])
+        if cursor.fetchone()[0]:
+            return False
+        for table in PARTITIONED_TABLES:
+            cursor.execute(f'CREATE TABLE {quote(names[table])} (LIKE {quote(table)} INCLUDING DEFAULTS)')
+            cursor.execute(
+                f'INSERT INTO {quote(names[table])} '
+                f'SELECT * FROM {quote(default_partition_name(table))} WHERE {in_month[0]}',
+                in_month[1],
+            )
+        for table in reversed(PARTITIONED_TABLES):
+            cursor.execute(f'DELETE FROM {quote(default_partition_name(table))} WHERE {in_month[0]}', in_month[1])
+        for table in PARTITIONED_TABLES:
+            cursor.execute(
+                f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(names[table])} FOR VALUES {_bounds(month)}'
+            )
+    return True
+
+
+def detach_month(month, drop=False):
+    """
+    Detach a month's partitions from the response and answer tables. The
+    detached tables keep their rows (as plain tables, without foreign
+    keys) unless ``drop`` is set. Returns the detached table names.
+    """
+    _require_postgresql()
+    names = [partition_name(table, month) for table in reversed(PARTITIONED_TABLES)]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table, name in zip(reversed(PARTITIONED_TABLES), names):
+            cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+            # A detached partition keeps copies of the parent's foreign
+            # keys; the answers' one would block detaching the responses
+            cursor.execute(
+                'SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = %s', [name, 'f']
+            )
+            for (constraint,) in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(constraint)}')
+        if drop:
+            for name in names:
+                cursor.execute(f'DROP TABLE {quote(name)}')
+    return names
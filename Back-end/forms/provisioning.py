@@ -0,0 +1,268 @@
+"""
+Bulk user provisioning (``manage.py provision_users``, POST /api/auth/users/bulk/).
+
+Records (username, email, password or an already encoded
+password_hash, first_name, last_name and the public UUIDs of existing
+forms to hand over to the user, like assign_form.py) are provisioned in
+chunks: one ``IN`` query finds the usernames and emails of the chunk
+that are taken, the passwords are hashed across a pool of
+PROVISION_HASH_WORKERS processes (hashing is CPU-bound and deliberately
+slow, so this is where the time goes), and the users are inserted with
+one ``bulk_create`` and their forms reassigned with one ``bulk_update``,
+in one transaction per chunk. Existing users are skipped, not updated,
+so a rerun of the same file only creates what is missing.
+"""
+import csv
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Form
+
+
+FIELDS = ['username', 'email', 'password', 'password_hash', 'first_name', 'last_name', 'forms']
+# Separates form UUIDs in the forms column, like multi-value answers in exports
+FORM_SEPARATOR = ';'
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+class InvalidRecord(Exception):
+    pass
+
+
+def read_csv(path):
+    """Yield (record_number, record or InvalidRecord) from a CSV file with a header row"""
+    with open(path, encoding='utf-8-sig', newline='') as source:
+        reader = csv.DictReader(source)
+        unknown = set(reader.fieldnames or []) - set(FIELDS)
+        if unknown:
+            raise InvalidRecord(f"Unknown columns: {', '.join(sorted(unknown))} (expected {', '.join(FIELDS)})")
+        for number, row in enumerate(reader, start=1):
+            if None in row:
+                yield number, InvalidRecord(f'Expected {len(reader.fieldnames)} columns, got more')
+                continue
+            try:
+                yield number, clean_record(row)
+            except InvalidRecord as e:
+                yield number, e
+
+
+def clean_record(data):
+    """Validated record from a CSV row or an item of the bulk endpoint's ``users`` list"""
+    if not isinstance(data, dict):
+        raise InvalidRecord('Expected an object')
+    username = User.normalize_username((data.get('username') or '').strip())
+    if not username:
+        raise InvalidRecord('Username is required.')
+    try:
+        User.username_validator(username)
+    except ValidationError as e:
+        raise InvalidRecord(f'{username}: {e.messages[0]}')
+    if len(username) > User._meta.get_field('username').max_length:
+        raise InvalidRecord(f'{username}: username is too long')
+
+    email = User.objects.normalize_email((data.get('email') or '').strip())
+    if email:
+        try:
+            validate_email(email)
+        except ValidationError:
+            raise InvalidRecord(f'{username}: invalid email {email!r}')
+
+    password = data.get('password') or ''
+    password_hash = (data.get('password_hash') or '').strip()
+    if password and password_hash:
+        raise InvalidRecord(f'{username}: give a password or a password_hash, not both')
+    if password_hash:
+        try:
+            identify_hasher(password_hash)
+        except ValueError:
+            raise InvalidRecord(f'{username}: password_hash is not in a supported format')
+    elif not password:
+        raise InvalidRecord(f'{username}: password is required.')
+
+    forms = data.get('forms') or []
+    if isinstance(forms, str):
+        forms = [value.strip() for value in forms.split(FORM_SEPARATOR) if value.strip()]
+    try:
+        forms = [uuid.UUID(str(value)) for value in forms]
+    except ValueError:
+        raise InvalidRecord(f'{username}: forms must be form UUIDs')
+
+    return {
+        'username': username,
+        'email': email,
+        'password': password,
+        'password_hash': password_hash,
+        'first_name': (data.get('first_name') or '').strip(),
+        'last_name': (data.get('last_name') or '').strip(),
+        'forms': forms,
+    }
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None and _pool_workers != workers:
+            _pool.shutdown()
+            _pool = None
+        if _pool is None:
+            _pool_workers = workers
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                # The children hash with the PASSWORD_HASHERS of the settings
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def reset_pool():
+    """Shut the hashing processes down (after each command run and bulk request)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+def hash_passwords(passwords, workers=None):
+    """make_password for each password, in a pool of ``workers`` processes when there is more than one"""
+    workers = workers or settings.PROVISION_HASH_WORKERS
+    if (
+        workers <= 1
+        or len(passwords) < 2
+        # Daemonic processes (e.g. multiprocessing.Pool workers) can't have children
+        or multiprocessing.current_process().daemon
+    ):
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    return list(_get_pool(workers).map(make_password, passwords, chunksize=chunksize))
+
+
+class Provisioner:
+    """
+    Provisions records added with ``add`` in chunks of ``chunk_size``;
+    ``finish`` provisions the last partial chunk and returns the report:
+    counts of created users, skipped existing users, rejected records and
+    reassigned forms, and (record_number, message) for each skipped or
+    rejected record. ``progress`` is called with the report after every
+    chunk. ``workers`` defaults to PROVISION_HASH_WORKERS.
+    """
+
+    def __init__(self, chunk_size=1000, workers=None, progress=None):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.progress = progress
+        self.chunk = []
+        # Within the input: a username or email or form may only appear once
+        self.seen_usernames = set()
+        self.seen_emails = set()
+        self.seen_forms = set()
+        self.report = {'created': 0, 'existing': 0, 'rejected': 0, 'forms_assigned': 0, 'messages': []}
+
+    def add(self, number, record):
+        if isinstance(record, InvalidRecord):
+            return self.reject(number, str(record))
+        username, email = record['username'], record['email']
+        if username in self.seen_usernames:
+            return self.reject(number, f'{username}: duplicate username in the input')
+        if email and email in self.seen_emails:
+            return self.reject(number, f'{username}: duplicate email {email} in the input')
+        if self.seen_forms.intersection(record['forms']):
+            return self.reject(number, f'{username}: a form is assigned to more than one user in the input')
+        self.seen_usernames.add(username)
+        if email:
+            self.seen_emails.add(email)
+        self.seen_forms.update(record['forms'])
+        self.chunk.append((number, record))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def reject(self, number, message):
+        self.report['rejected'] += 1
+        self.report['messages'].append((number, message))
+
+    def finish(self):
+        self.flush()
+        return self.report
+
+    def flush(self):
+        chunk, self.chunk = self.chunk, []
+        if not chunk:
+            return
+        usernames = [record['username'] for _, record in chunk]
+        emails = [record['email'] for _, record in chunk if record['email']]
+        taken_usernames, taken_emails = set(), set()
+        for username, email in User.objects.filter(
+            Q(username__in=usernames) | Q(email__in=emails)
+        ).values_list('username', 'email'):
+            taken_usernames.add(username)
+            taken_emails.add(email)
+        form_uuids = {form_uuid for _, record in chunk for form_uuid in record['forms']}
+        forms = {form.uuid: form for form in Form.objects.filter(uuid__in=form_uuids)} if form_uuids else {}
+
+        fresh = []
+        for number, record in chunk:
+            if record['username'] in taken_usernames:
+                self.report['existing'] += 1
+                self.report['messages'].append((number, f"{record['username']}: already exists, skipped"))
+            elif record['email'] and record['email'] in taken_emails:
+                self.reject(number, f"{record['username']}: email {record['email']} already exists")
+            elif any(form_uuid not in forms for form_uuid in record['forms']):
+                missing = [str(form_uuid) for form_uuid in record['forms'] if form_uuid not in forms]
+                self.reject(number, f"{record['username']}: form {', '.join(missing)} not found")
+            else:
+                fresh.append(record)
+
+        to_hash = [record['password'] for record in fresh if not record['password_hash']]
+        hashes = iter(hash_passwords(to_hash, self.workers))
+        users = [
+            User(
+                username=record['username'],
+                email=record['email'],
+                first_name=record['first_name'],
+                last_name=record['last_name'],
+                password=record['password_hash'] or next(hashes),
+            )
+            for record in fresh
+        ]
+        assigned = []
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            if forms and users and users[0].pk is None:
+                # Backends that can't return ids from a bulk insert
+                ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                           .values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+            for user, record in zip(users, fresh):
+                for form_uuid in record['forms']:
+                    forms[form_uuid].created_by = user
+                    assigned.append(forms[form_uuid])
+            if assigned:
+                Form.objects.bulk_update(assigned, ['created_by'])
+        self.report['created'] += len(users)
+        self.report['forms_assigned'] += len(assigned)
+        if self.progress is not None:
+            self.progress(self.report)
+
+
+def provision(records, chunk_size=1000, workers=None, progress=None):
+    """Provision (record_number, record or InvalidRecord) pairs; returns the Provisioner report"""
+    provisioner = Provisioner(chunk_size=chunk_size, workers=workers, progress=progress)
+    for number, record in records:
+        provisioner.add(number, record)
+    return provisioner.finish()
@@ -0,0 +1,100 @@
+"""
+Removal of soft-deleted forms, sections and questions.
+
+Deleting a form, or removing sections and questions while editing one,
+only tombstones them (``ActiveQuerySet.soft_delete``): the default
+managers hide them at once and the request never touches their answers.
+The reaper then deletes each tombstoned object's dependent rows in
+chunks of TOMBSTONE_REAP_CHUNK_SIZE, one short transaction per chunk and
+TOMBSTONE_REAP_PAUSE seconds between chunks so the cleanup doesn't
+monopolize the database, and deletes the object itself last, when its
+cascade has nothing left to collect.
+
+Reaping runs as a ``tombstones.reap`` background job, queued when
+something is tombstoned (``schedule``), or with ``manage.py
+reap_deleted``.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import archives
+from .models import Answer, Form, Job, Question, QuestionSketch, Response as FormResponse, Section
+
+
+REAP_JOB_KIND = 'tombstones.reap'
+
+
+def schedule(user=None):
+    """Queue a reap job unless one is already waiting"""
+    if not Job.objects.filter(kind=REAP_JOB_KIND, status='queued').exists():
+        Job.objects.create(kind=REAP_JOB_KIND, created_by=user)
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class Reaper:
+    """
+    Deletes tombstoned objects oldest first. ``progress`` is called with
+    the counts of deleted rows after every chunk; past ``max_seconds``
+    the run stops between chunks (raising OutOfTime) and the next run
+    picks up where it left off.
+    """
+
+    def __init__(self, chunk_size=None, pause=None, max_seconds=None, progress=None):
+        self.chunk_size = chunk_size or settings.TOMBSTONE_REAP_CHUNK_SIZE
+        self.pause = settings.TOMBSTONE_REAP_PAUSE if pause is None else pause
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.progress = progress
+        self.counts = dict.fromkeys(['forms', 'sections', 'questions', 'responses', 'answers'], 0)
+
+    def run(self):
+        for form in Form.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at'):
+            self.reap_form(form)
+        sections = Section.all_objects.filter(deleted_at__isnull=False, form__deleted_at__isnull=True)
+        for section in sections.order_by('deleted_at'):
+            self.reap_section(section)
+        for question in Question.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at'):
+            self.reap_question(question)
+        return self.counts
+
+    def reap_form(self, form):
+        self.delete_in_chunks(Answer.objects.filter(form=form), 'answers')
+        self.delete_in_chunks(FormResponse.objects.filter(form=form), 'responses')
+        for section in Section.all_objects.filter(form=form):
+            self.reap_section(section)
+        # Jobs of the form go with it
+        self.delete(Form.all_objects.filter(id=form.id), 'forms')
+        for segment in form.archive_manifest:
+            archives.archive_path(segment['file']).unlink(missing_ok=True)
+
+    def reap_section(self, section):
+        for question in Question.all_objects.filter(section=section):
+            self.reap_question(question)
+        self.delete(Section.all_objects.filter(id=section.id), 'sections')
+
+    def reap_question(self, question):
+        self.delete_in_chunks(Answer.objects.filter(question=question), 'answers')
+        QuestionSketch.objects.filter(question=question).delete()
+        self.delete(Question.all_objects.filter(id=question.id), 'questions')
+
+    def delete_in_chunks(self, queryset, counter):
+        while True:
+            ids = list(queryset.values_list('id', flat=True)[:self.chunk_size])
+            if not ids:
+                return
+            self.delete(queryset.model._base_manager.filter(id__in=ids), counter)
+
+    def delete(self, queryset, counter):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise OutOfTime
+        with transaction.atomic():
+            deleted = queryset.delete()[1].get(queryset.model._meta.label, 0)
+        self.counts[counter] += deleted
+        if self.progress is not None:
+            self.progress(dict(self.counts))
+        if self.pause:
+            time.sleep(self.pause)
@@ -0,0 +1,205 @@
+"""
+Read replica routing (DB_REPLICA_HOSTS).
+
+Heavy read endpoints (analysis dashboards, response lists, exports, the
+public form) opt in with ``ReplicaReadsMixin``: their GET requests run
+with reads routed to a replica, while every write still goes to the
+primary (``ReplicaRouter``). Other views, background jobs and management
+commands read from the primary as before.
+
+Reads stay on the primary when
+- the user wrote something within DB_PRIMARY_PIN_SECONDS
+  (``PrimaryPinMiddleware``), or the form was just published or edited
+  (``pin_form``, checked by the public form view), so nobody reads a
+  replica that hasn't replayed their change yet;
+- no replica is healthy: each replica's replay lag is checked at most
+  every DB_REPLICA_CHECK_SECONDS per process, and a replica that lags
+  more than DB_REPLICA_MAX_LAG_SECONDS or can't be reached within
+  DB_REPLICA_CONNECT_TIMEOUT is skipped until the next check. One thread
+  probes a replica at a time; the others keep using its previous result
+  meanwhile.
+"""
+import contextvars
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+PIN_CACHE_PREFIX = 'db-primary-pin'
+
+# Database reads in the current request (or streamed response body) go to this alias
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+
+_health = {}  # alias -> (checked at, healthy)
+_probe_locks = {}  # alias -> lock held by the thread probing it
+
+
+def replica_aliases():
+    return settings.REPLICA_DATABASES
+
+
+class ReplicaRouter:
+    """Route reads to the replica chosen for the current request; writes always go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Without this, saving an instance read from a replica would write to the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        group = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in group and obj2._state.db in group:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
+
+
+def replica_lag(alias):
+    """Seconds the replica is behind the primary (0 when it has replayed everything it received)"""
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    # A short-lived connection of its own, so an unreachable replica fails fast
+    probe = connection.copy()
+    probe.settings_dict['OPTIONS'] = {
+        **probe.settings_dict.get('OPTIONS', {}),
+        'connect_timeout': settings.DB_REPLICA_CONNECT_TIMEOUT,
+    }
+    try:
+        with probe.cursor() as cursor:
+            cursor.execute(
+                'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+            )
+            return float(cursor.fetchone()[0])
+    finally:
+        probe.close()
+
+
+def is_healthy(alias):
+    now = time.monotonic()
+    checked_at, healthy = _health.get(alias, (None, False))
+    if checked_at is not None and now - checked_at < settings.DB_REPLICA_CHECK_SECONDS:
+        return healthy
+    probe_lock = _probe_locks.setdefault(alias, threading.Lock())
+    if not probe_lock.acquire(blocking=False):
+        # Another thread is probing this replica
+        return healthy
+    try:
+        try:
+            healthy = replica_lag(alias) <= settings.DB_REPLICA_MAX_LAG_SECONDS
+        except DatabaseError:
+            healthy = False
+        _health[alias] = (now, healthy)
+    finally:
+        probe_lock.release()
+    return healthy
+
+
+def choose_replica():
+    """A healthy replica, or None to read from the primary"""
+    aliases = list(replica_aliases())
+    random.shuffle(aliases)
+    for alias in aliases:
+        if is_healthy(alias):
+            return alias
+    return None
+
+
+def _pin_key(kind, key):
+    return f'{PIN_CACHE_PREFIX}:{kind}:{key}'
+
+
+def pin_user(user):
+    """Keep the user's reads on the primary for DB_PRIMARY_PIN_SECONDS"""
+    if replica_aliases() and user.is_authenticated:
+        cache.set(_pin_key('user', user.pk), True, timeout=settings.DB_PRIMARY_PIN_SECONDS)
+
+
+def pin_form(form):
+    """Keep reads of the public form on the primary for DB_PRIMARY_PIN_SECONDS"""
+    if replica_aliases():
+        cache.set(_pin_key('form', form.uuid), True, timeout=settings.DB_PRIMARY_PIN_SECONDS)
+
+
+def read_alias(user, form_uuid=None):
+    """The replica a safe request should read from, or None for the primary"""
+    if not replica_aliases():
+        return None
+    keys = []
+    if user.is_authenticated:
+        keys.append(_pin_key('user', user.pk))
+    if form_uuid is not None:
+        keys.append(_pin_key('form', form_uuid))
+    if keys and cache.get_many(keys):
+        return None
+    return choose_replica()
+
+
+def bind(iterable, alias):
+    """Iterate (e.g. a streamed response body) with reads routed to alias"""
+    iterator = iter(iterable)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield item
+
+
+class ReplicaReadsMixin:
+    """
+    APIView mixin serving GET/HEAD requests from a read replica (see
+    read_alias). ``replica_pin_kwarg`` names the URL kwarg holding the
+    form uuid checked against pin_form.
+    """
+    replica_pin_kwarg = None
+
+    def initial(self, request, *args, **kwargs):
+        self._replica_token = None
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            form_uuid = kwargs.get(self.replica_pin_kwarg) if self.replica_pin_kwarg else None
+            alias = read_alias(request.user, form_uuid)
+            if alias is not None:
+                self._replica_token = _read_alias.set(alias)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            if response.streaming:
+                # The body is generated after the view returns
+                response.streaming_content = bind(response.streaming_content, _read_alias.get())
+            _read_alias.reset(token)
+            self._replica_token = None
+        return response
+
+
+class PrimaryPinMiddleware:
+    """Pin the reads of users who just wrote something to the primary (see pin_user)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None:
+                pin_user(user)
+        return response
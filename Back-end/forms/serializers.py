@@ -1,8 +1,75 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, IntegerField, JSONField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
-from .models import Form, Section, Question, Response, Answer
+from .models import Form, Section, Question, Response, Answer, Job, typed_answer_values
+from .fieldsets import SparseFieldsMixin
+from . import analysis_cache, approx, reaper, text_analysis
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+def derived_answer_fields(question, value):
+    """Columns stored alongside an answer value, derived from it"""
+    fields = typed_answer_values(question, value)
+    if question.type in text_analysis.TEXT_QUESTION_TYPES:
+        fields['token_counts'] = text_analysis.token_counts(value)
+    return fields
+
+
+def build_answer(response, question, value):
+    """Build an unsaved Answer with its derived columns populated"""
+    return Answer(
+        response=response, question=question, value=value, form_id=response.form_id, submitted_at=response.submitted_at,
+        **derived_answer_fields(question, value)
+    )
+
+
+def validate_answer_value(question, value):
+    """Check an answer value against its question's type and constraints"""
+    if question.type == 'single_choice':
+        if not isinstance(value, str):
+            raise serializers.ValidationError("Single choice answers must be a string")
+        valid_values = [opt['value'] for opt in question.options or []]
+        if value not in valid_values:
+            raise serializers.ValidationError(f"Invalid choice. Must be one of: {valid_values}")
+
+    elif question.type == 'multi_choice':
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Multi choice answers must be an array")
+        valid_values = [opt['value'] for opt in question.options or []]
+        for v in value:
+            if v not in valid_values:
+                raise serializers.ValidationError(f"Invalid choice: {v}")
+
+        # Check exclusive options
+        if question.exclusive_options:
+            for exclusive in question.exclusive_options:
+                if exclusive in value and len(value) > 1:
+                    raise serializers.ValidationError(
+                        f"Option '{exclusive}' is exclusive and cannot be selected with other options"
+                    )
+
+    elif question.type in ['rating', 'scale']:
+        if not isinstance(value, (int, float)):
+            raise serializers.ValidationError("Rating/scale answers must be a number")
+        scale = question.scale or {}
+        min_val = scale.get('min', 1)
+        max_val = scale.get('max', 5)
+        if value < min_val or value > max_val:
+            raise serializers.ValidationError(f"Value must be between {min_val} and {max_val}")
+
+    elif question.type in ['text', 'textarea']:
+        if not isinstance(value, str):
+            raise serializers.ValidationError("Text answers must be a string")
+        if question.min_length and len(value) < question.min_length:
+            raise serializers.ValidationError(f"Text must be at least {question.min_length} characters")
+        if question.max_length and len(value) > question.max_length:
+            raise serializers.ValidationError(f"Text must be at most {question.max_length} characters")
+
+
+class QuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    required_columns = ['section']  # Prefetched by section
+    
     class Meta:
         model = Question
         fields = [
@@ -42,8 +109,10 @@ class QuestionSerializer(serializers.ModelSerializer):
         return data
 
 
-class SectionSerializer(serializers.ModelSerializer):
+class SectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     questions = QuestionSerializer(many=True, required=False)
+    expandable_fields = ['questions']
+    required_columns = ['form']  # Prefetched by form
     
     class Meta:
         model = Section
@@ -78,10 +147,11 @@ class SectionSerializer(serializers.ModelSerializer):
             existing_question_ids = [q.id for q in instance.questions.all()]
             new_question_ids = [q.get('id') for q in questions_data if q.get('id')]
             
-            # Delete removed questions
-            for question_id in existing_question_ids:
-                if question_id not in new_question_ids:
-                    Question.objects.filter(id=question_id).delete()
+            # Hide removed questions; their answers are deleted in the background (see reaper.py)
+            removed_question_ids = [q for q in existing_question_ids if q not in new_question_ids]
+            if removed_question_ids:
+                Question.objects.filter(id__in=removed_question_ids).soft_delete()
+                reaper.schedule()
             
             # Create or update questions (filter out empty questions)
             for question_data in questions_data:
@@ -102,13 +172,14 @@ class SectionSerializer(serializers.ModelSerializer):
         return instance
 
 
-class FormSerializer(serializers.ModelSerializer):
+class FormSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     sections = SectionSerializer(many=True, required=False)
+    expandable_fields = ['sections']
     
     class Meta:
         model = Form
-        fields = ['id', 'title', 'description', 'status', 'uuid', 'sections', 'welcome_message', 'thank_you_message', 'created_by', 'created_at', 'updated_at']
-        read_only_fields = ['uuid', 'created_by', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'description', 'status', 'uuid', 'sections', 'welcome_message', 'thank_you_message', 'created_by', 'created_at', 'updated_at', 'archive_manifest']
+        read_only_fields = ['uuid', 'created_by', 'created_at', 'updated_at', 'archive_manifest']
     
     def create(self, validated_data):
         sections_data = validated_data.pop('sections', [])
@@ -156,10 +227,11 @@ class FormSerializer(serializers.ModelSerializer):
             existing_section_ids = [s.id for s in instance.sections.all()]
             new_section_ids = [s.get('id') for s in sections_data if s.get('id')]
             
-            # Delete removed sections
-            for section_id in existing_section_ids:
-                if section_id not in new_section_ids:
-                    Section.objects.filter(id=section_id).delete()
+            # Hide removed sections; their answers are deleted in the background (see reaper.py)
+            removed_section_ids = [s for s in existing_section_ids if s not in new_section_ids]
+            if removed_section_ids:
+                Section.objects.filter(id__in=removed_section_ids).soft_delete()
+                reaper.schedule()
             
             # Create or update sections
             for section_data in sections_data:
@@ -183,15 +255,60 @@ class FormSerializer(serializers.ModelSerializer):
         return instance
 
 
-class FormDetailSerializer(serializers.ModelSerializer):
+class FormDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Optimized serializer for public form view"""
     sections = SectionSerializer(many=True, read_only=True)
+    expandable_fields = ['sections']
     
     class Meta:
         model = Form
         fields = ['id', 'title', 'description', 'status', 'uuid', 'sections', 'welcome_message', 'thank_you_message', 'created_by', 'created_at', 'updated_at']
 
 
+def _count_for_outer(queryset, field):
+    """Correlated COUNT(*) of the queryset's rows whose ``field`` is the outer row, 0 when there are none"""
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('*')
+    ).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class FormSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Serializer for listing forms: no sections, counts annotated by prepare_queryset"""
+    section_count = serializers.IntegerField(read_only=True)
+    question_count = serializers.IntegerField(read_only=True)
+    response_count = serializers.SerializerMethodField()
+    last_response_at = serializers.DateTimeField(read_only=True)
+    expandable_fields = ['section_count', 'question_count', 'response_count', 'last_response_at']
+    field_columns = {'response_count': ['archive_manifest']}
+    
+    class Meta:
+        model = Form
+        fields = [
+            'id', 'title', 'description', 'status', 'uuid', 'created_at', 'updated_at',
+            'section_count', 'question_count', 'response_count', 'last_response_at'
+        ]
+    
+    @classmethod
+    def prepare_queryset(cls, queryset, selection):
+        """The selected counts as subqueries of the forms' one statement"""
+        counts = {
+            'section_count': lambda: _count_for_outer(Section.objects.all(), 'form'),
+            'question_count': lambda: _count_for_outer(Question.objects.all(), 'section__form'),
+            'response_count': lambda: _count_for_outer(Response.objects.all(), 'form'),
+            'last_response_at': lambda: Subquery(
+                Response.objects.filter(form=OuterRef('pk')).order_by('-submitted_at').values('submitted_at')[:1]
+            ),
+        }
+        return super().prepare_queryset(queryset, selection).annotate(**{
+            name: count() for name, count in counts.items() if cls.includes(selection, name)
+        })
+    
+    def get_response_count(self, obj):
+        # Archived responses are counted from the archive manifest (see archives.py)
+        return obj.response_count + obj.archived_response_count()
+
+
 class AnswerSerializer(serializers.ModelSerializer):
     question_id = serializers.UUIDField(write_only=True)
     
@@ -208,46 +325,7 @@ class AnswerSerializer(serializers.ModelSerializer):
         except Question.DoesNotExist:
             raise serializers.ValidationError("Question does not exist")
         
-        # Validate based on question type
-        if question.type == 'single_choice':
-            if not isinstance(value, str):
-                raise serializers.ValidationError("Single choice answers must be a string")
-            valid_values = [opt['value'] for opt in question.options or []]
-            if value not in valid_values:
-                raise serializers.ValidationError(f"Invalid choice. Must be one of: {valid_values}")
-        
-        elif question.type == 'multi_choice':
-            if not isinstance(value, list):
-                raise serializers.ValidationError("Multi choice answers must be an array")
-            valid_values = [opt['value'] for opt in question.options or []]
-            for v in value:
-                if v not in valid_values:
-                    raise serializers.ValidationError(f"Invalid choice: {v}")
-            
-            # Check exclusive options
-            if question.exclusive_options:
-                for exclusive in question.exclusive_options:
-                    if exclusive in value and len(value) > 1:
-                        raise serializers.ValidationError(
-                            f"Option '{exclusive}' is exclusive and cannot be selected with other options"
-                        )
-        
-        elif question.type in ['rating', 'scale']:
-            if not isinstance(value, (int, float)):
-                raise serializers.ValidationError("Rating/scale answers must be a number")
-            scale = question.scale or {}
-            min_val = scale.get('min', 1)
-            max_val = scale.get('max', 5)
-            if value < min_val or value > max_val:
-                raise serializers.ValidationError(f"Value must be between {min_val} and {max_val}")
-        
-        elif question.type in ['text', 'textarea']:
-            if not isinstance(value, str):
-                raise serializers.ValidationError("Text answers must be a string")
-            if question.min_length and len(value) < question.min_length:
-                raise serializers.ValidationError(f"Text must be at least {question.min_length} characters")
-            if question.max_length and len(value) > question.max_length:
-                raise serializers.ValidationError(f"Text must be at most {question.max_length} characters")
+        validate_answer_value(question, value)
         
         return data
     
@@ -341,45 +419,64 @@ class ResponseSerializer(serializers.ModelSerializer):
         
         validated_data['form'] = form
         validated_data['ip_address'] = ip_address
-        response = Response.objects.create(**validated_data)
-        
-        # Create answers
-        for answer_data in answers_data:
-            Answer.objects.create(
-                response=response,
-                question_id=answer_data['question_id'],
-                value=answer_data['value']
-            )
+        questions = Question.objects.in_bulk([a['question_id'] for a in answers_data])
+        # The response and its answers are stored together or not at all
+        with transaction.atomic():
+            response = Response.objects.create(**validated_data)
+            answers = Answer.objects.bulk_create([
+                build_answer(response, questions[answer_data['question_id']], answer_data['value'])
+                for answer_data in answers_data
+            ])
+            # Moves the cached analysis watermark once the submission is visible
+            analysis_cache.record_submission_on_commit(form.id)
+            
+            # Keep the approximate-analysis sketches up to date, after the commit
+            if settings.FORM_ANALYSIS_SKETCHES:
+                approx.record_answers_on_commit(answers)
         
         return response
 
 
-class ResponseListSerializer(serializers.ModelSerializer):
-    """Serializer for listing responses"""
-    answer_count = serializers.SerializerMethodField()
+# Questions whose answer names the respondent in the response list
+NAME_KEYWORDS = ['نام', 'name', 'اسم']
+
+
+class ResponseListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Serializer for listing responses; answer_count and display_name read annotations of prepare_queryset"""
+    answer_count = serializers.IntegerField(read_only=True)
     form_title = serializers.SerializerMethodField()
     display_name = serializers.SerializerMethodField()
+    expandable_fields = ['form_title', 'answer_count', 'display_name']
+    field_columns = {'form_title': ['form', 'form__title'], 'display_name': ['user_id']}
     
     class Meta:
         model = Response
         fields = ['id', 'form', 'form_title', 'user_id', 'submitted_at', 'answer_count', 'display_name']
     
-    def get_answer_count(self, obj):
-        return obj.answers.count()
+    @classmethod
+    def prepare_queryset(cls, queryset, selection):
+        """The form's title joined and the answer count and name as subqueries, instead of queries per response"""
+        queryset = super().prepare_queryset(queryset, selection)
+        # Correlating on submitted_at too looks in the response's partition only (see partitions.py)
+        answers = Answer.objects.filter(submitted_at=OuterRef('submitted_at'))
+        if cls.includes(selection, 'form_title'):
+            queryset = queryset.select_related('form')
+        if cls.includes(selection, 'answer_count'):
+            queryset = queryset.annotate(answer_count=_count_for_outer(answers, 'response'))
+        if cls.includes(selection, 'display_name'):
+            names = answers.filter(response=OuterRef('pk')).filter(
+                Q(*[Q(question__text__icontains=keyword) for keyword in NAME_KEYWORDS], _connector=Q.OR)
+            ).exclude(value=None).exclude(value='')
+            queryset = queryset.annotate(name_answer=Subquery(names.values('value')[:1], output_field=JSONField()))
+        return queryset
     
     def get_form_title(self, obj):
         return obj.form.title if obj.form else None
     
     def get_display_name(self, obj):
-        """Extract a name from answers if available, otherwise use user_id or response ID"""
-        # Try to find a name field in answers
-        for answer in obj.answers.all():
-            question = answer.question
-            # Check if question text contains name-related keywords
-            question_text_lower = question.text.lower()
-            if any(keyword in question_text_lower for keyword in ['نام', 'name', 'اسم']):
-                if answer.value:
-                    return str(answer.value)
+        """The answer to a name question if available, otherwise user_id or response ID"""
+        if obj.name_answer:
+            return str(obj.name_answer)
         
         # Fallback to user_id if available
         if obj.user_id:
@@ -389,23 +486,87 @@ class ResponseListSerializer(serializers.ModelSerializer):
         return f"پاسخ #{obj.id}"
 
 
-class ResponseDetailSerializer(serializers.ModelSerializer):
-    """Serializer for detailed response view"""
+class ResponseDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer for detailed response view: the answers grouped by section
+    in form order (``answers`` has them ungrouped, for existing clients),
+    read with their questions and sections in one query, and the form's
+    previous and next responses by (submitted_at, id), annotated by
+    prepare_queryset
+    """
     answers = serializers.SerializerMethodField()
+    sections = serializers.SerializerMethodField()
+    previous_id = serializers.UUIDField(read_only=True)
+    next_id = serializers.UUIDField(read_only=True)
+    expandable_fields = ['answers', 'sections', 'previous_id', 'next_id']
+    field_columns = {'answers': ['submitted_at'], 'sections': ['submitted_at']}
     
     class Meta:
         model = Response
-        fields = ['id', 'form', 'user_id', 'submitted_at', 'ip_address', 'answers']
+        fields = ['id', 'form', 'user_id', 'submitted_at', 'ip_address', 'answers', 'sections', 'previous_id', 'next_id']
+    
+    @classmethod
+    def prepare_queryset(cls, queryset, selection):
+        """The neighbours as keyset subqueries on the form's (submitted_at, id) order"""
+        queryset = super().prepare_queryset(queryset, selection)
+        same_form = Response.objects.filter(form=OuterRef('form')).values('id')
+        if cls.includes(selection, 'previous_id'):
+            earlier = same_form.filter(
+                Q(submitted_at__lt=OuterRef('submitted_at'))
+                | Q(submitted_at=OuterRef('submitted_at'), id__lt=OuterRef('id'))
+            ).order_by('-submitted_at', '-id')
+            queryset = queryset.annotate(previous_id=Subquery(earlier[:1]))
+        if cls.includes(selection, 'next_id'):
+            later = same_form.filter(
+                Q(submitted_at__gt=OuterRef('submitted_at'))
+                | Q(submitted_at=OuterRef('submitted_at'), id__gt=OuterRef('id'))
+            ).order_by('submitted_at', 'id')
+            queryset = queryset.annotate(next_id=Subquery(later[:1]))
+        return queryset
+    
+    def _ordered_answers(self, obj):
+        """The response's answers to current questions in form order, with question and section (one query)"""
+        cached = getattr(self, '_answers_of', None)
+        if cached is None or cached[0] != obj.pk:
+            answers = obj.partition_answers().filter(question__deleted_at__isnull=True).select_related(
+                'question__section'
+            ).only(
+                'response', 'value', 'question', 'question__text', 'question__type', 'question__section',
+                'question__section__title',
+            ).order_by(
+                'question__section__order', 'question__section__created_at', 'question__order', 'question__id'
+            )
+            cached = self._answers_of = (obj.pk, list(answers))
+        return cached[1]
+    
+    @staticmethod
+    def _answer_data(answer):
+        question = answer.question
+        return {
+            'question_id': question.id,
+            'question_text': question.text,
+            'question_type': question.type,
+            'value': answer.value
+        }
     
     def get_answers(self, obj):
-        answers = []
-        for answer in obj.answers.all():
-            question = answer.question
-            answers.append({
-                'question_id': question.id,
-                'question_text': question.text,
-                'question_type': question.type,
-                'value': answer.value
-            })
-        return answers
+        return [self._answer_data(answer) for answer in self._ordered_answers(obj)]
+    
+    def get_sections(self, obj):
+        sections = []
+        for answer in self._ordered_answers(obj):
+            section = answer.question.section
+            if not sections or sections[-1]['id'] != section.id:
+                sections.append({'id': section.id, 'title': section.title, 'answers': []})
+            sections[-1]['answers'].append(self._answer_data(answer))
+        return sections
+
 
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for background job status"""
+    
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'form', 'payload', 'status', 'result', 'error', 'attempts',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
@@ -0,0 +1,202 @@
+"""
+Mergeable streaming sketches with JSON-serializable state.
+
+- ReservoirSample: uniform sample of k items from a stream
+- KLLSketch: quantiles with bounded normalized rank error
+- CountMinSketch: term frequencies with bounded overestimate, plus a small
+  set of heavy-hitter candidates so the top terms can be listed
+
+Every sketch can be merged with another of the same parameters, which lets
+several independently updated shards be combined at read time.
+"""
+import hashlib
+import heapq
+import math
+import random
+
+
+class ReservoirSample:
+    def __init__(self, k=20, seen=0, items=None):
+        self.k = k
+        self.seen = seen
+        self.items = list(items or [])
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            slot = random.randrange(self.seen)
+            if slot < self.k:
+                self.items[slot] = item
+
+    def merge(self, other):
+        # Weighted sampling without replacement (Efraimidis-Spirakis): each
+        # item stands for seen/len(items) stream elements of its reservoir
+        keyed = []
+        for sample in (self, other):
+            if not sample.items:
+                continue
+            weight = sample.seen / len(sample.items)
+            keyed.extend((random.random() ** (1 / weight), item) for item in sample.items)
+        self.items = [item for _, item in heapq.nlargest(self.k, keyed, key=lambda pair: pair[0])]
+        self.seen += other.seen
+
+    def to_state(self):
+        return {'k': self.k, 'seen': self.seen, 'items': self.items}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(**state) if state else cls()
+
+
+class KLLSketch:
+    """
+    KLL quantile sketch (Karnin, Lang, Liberty 2016) with compactor
+    capacities shrinking by 2/3 per level below the top one.
+    """
+
+    def __init__(self, k=200, n=0, compactors=None):
+        self.k = k
+        self.n = n
+        self.compactors = compactors or [[]]
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        self._compress()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def quantile(self, q):
+        weighted = sorted(
+            (value, 2 ** level)
+            for level, items in enumerate(self.compactors)
+            for value in items
+        )
+        if not weighted:
+            return None
+        target = q * sum(weight for _, weight in weighted)
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return weighted[-1][0]
+
+    @property
+    def rank_error(self):
+        """Normalized rank error bound (empirical constant for c = 2/3, 99% confidence)"""
+        return round(2.296 / self.k ** 0.9723, 4)
+
+    def to_state(self):
+        return {'k': self.k, 'n': self.n, 'compactors': self.compactors}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(**state) if state else cls()
+
+    def _capacity(self, level):
+        height = len(self.compactors)
+        return max(2, math.ceil(self.k * (2 / 3) ** (height - level - 1)))
+
+    def _compress(self):
+        while sum(map(len, self.compactors)) >= sum(
+            self._capacity(level) for level in range(len(self.compactors))
+        ):
+            for level, items in enumerate(self.compactors):
+                if len(items) < self._capacity(level):
+                    continue
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                items.sort()
+                kept = items[-1:] if len(items) % 2 else []
+                paired = items[:len(items) - len(kept)]
+                # Promote every other item; each promoted item counts twice
+                self.compactors[level + 1].extend(paired[random.getrandbits(1)::2])
+                self.compactors[level] = kept
+                break
+
+
+class CountMinSketch:
+    """
+    Count-min sketch (Cormode, Muthukrishnan 2005). Estimates never
+    undercount and overcount by at most ``error_bound`` with probability
+    ``confidence``. The ``heavy`` candidates track the terms with the
+    largest estimates seen so far.
+    """
+
+    def __init__(self, width=1024, depth=4, total=0, table=None, heavy=None, heavy_size=200):
+        self.width = width
+        self.depth = depth
+        self.total = total
+        self.table = table or [[0] * width for _ in range(depth)]
+        self.heavy = dict(heavy or {})
+        self.heavy_size = heavy_size
+
+    def add(self, term, count=1):
+        estimate = None
+        for row, index in enumerate(self._indexes(term)):
+            self.table[row][index] += count
+            cell = self.table[row][index]
+            estimate = cell if estimate is None else min(estimate, cell)
+        self.total += count
+        self._track(term, estimate)
+
+    def estimate(self, term):
+        return min(self.table[row][index] for row, index in enumerate(self._indexes(term)))
+
+    def merge(self, other):
+        for row in range(self.depth):
+            mine, theirs = self.table[row], other.table[row]
+            self.table[row] = [a + b for a, b in zip(mine, theirs)]
+        self.total += other.total
+        candidates = set(self.heavy) | set(other.heavy)
+        self.heavy = {}
+        for term in candidates:
+            self._track(term, self.estimate(term))
+
+    def most_common(self):
+        return sorted(self.heavy.items(), key=lambda item: item[1], reverse=True)
+
+    @property
+    def error_bound(self):
+        return math.ceil(math.e / self.width * self.total)
+
+    @property
+    def confidence(self):
+        return round(1 - math.exp(-self.depth), 4)
+
+    def to_state(self):
+        return {
+            'width': self.width,
+            'depth': self.depth,
+            'total': self.total,
+            'table': self.table,
+            'heavy': self.heavy,
+            'heavy_size': self.heavy_size,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(**state) if state else cls()
+
+    def _indexes(self, term):
+        digest = hashlib.blake2b(term.encode(), digest_size=4 * self.depth).digest()
+        for row in range(self.depth):
+            yield int.from_bytes(digest[4 * row:4 * row + 4], 'little') % self.width
+
+    def _track(self, term, estimate):
+        if term in self.heavy or len(self.heavy) < self.heavy_size:
+            self.heavy[term] = estimate
+            return
+        weakest = min(self.heavy, key=self.heavy.get)
+        if estimate > self.heavy[weakest]:
+            del self.heavy[weakest]
+            self.heavy[term] = estimate
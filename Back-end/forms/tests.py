@@ -1,3 +1,363 @@
-from django.test import TestCase
+import itertools
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from . import analysis, analysis_cache, approx, archives, feed, imports, jobs, models, replicas
+from .filters import ResponseFilter
+from .models import Answer, Form, Job, Question, Response as FormResponse, Section
+from .serializers import build_answer
+
+
+class SparseFieldsTests(APITestCase):
+    """?fields= and ?expand= (see fieldsets.py) drop fields and the queries behind them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.form = Form.objects.create(title='Survey', status='published', created_by=cls.user)
+        cls.questions = []
+        for section_order in range(3):
+            section = Section.objects.create(form=cls.form, title=f'Section {section_order}', order=section_order)
+            for question_order in range(2):
+                cls.questions.append(Question.objects.create(
+                    section=section, text=f'Question {section_order}.{question_order}', type='text',
+                    order=question_order,
+                ))
+        cls.name_question = cls.questions[0]
+        cls.name_question.text = 'Your name'
+        cls.name_question.save()
+        cls.responses = []
+        for index in range(4):
+            response = FormResponse.objects.create(form=cls.form)
+            for question in cls.questions:
+                Answer.objects.create(
+                    response=response, form=cls.form, question=question, value=f'answer {index}',
+                    submitted_at=response.submitted_at,
+                )
+            cls.responses.append(response)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_form_retrieve_expansion(self):
+        url = f'/api/forms/{self.form.id}/'
+        with self.assertNumQueries(3):  # Form, sections, questions
+            data = self.client.get(url).json()
+        self.assertEqual(len(data['sections']), 3)
+        self.assertEqual(len(data['sections'][0]['questions']), 2)
+
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {'expand': 'sections'}).json()
+        self.assertEqual(len(data['sections']), 3)
+        self.assertNotIn('questions', data['sections'][0])
+
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'expand': ''}).json()
+        self.assertNotIn('sections', data)
+
+    def test_form_retrieve_fields(self):
+        url = f'/api/forms/{self.form.id}/'
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'fields': 'id,title'}).json()
+        self.assertEqual(set(data), {'id', 'title'})
+
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {'fields': 'id,sections.title'}).json()
+        self.assertEqual(set(data), {'id', 'sections'})
+        self.assertEqual([set(section) for section in data['sections']], [{'title'}] * 3)
+
+    def test_form_list_fields(self):
+        with self.assertNumQueries(2):  # Count, page
+            data = self.client.get('/api/forms/').json()
+        self.assertEqual(data['results'][0]['question_count'], 6)
+        self.assertEqual(data['results'][0]['response_count'], 4)
+
+        with self.assertNumQueries(2) as queries:
+            data = self.client.get('/api/forms/', {'fields': 'id,title'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'title'})
+        self.assertNotIn('forms_response', queries.captured_queries[-1]['sql'])
+
+    def test_public_form_expansion(self):
+        url = f'/api/forms/public/{self.form.uuid}/'
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'fields': 'title,welcome_message'}).json()
+        self.assertEqual(set(data), {'title', 'welcome_message'})
+
+    def test_response_list_queries_dont_grow_with_responses(self):
+        with self.assertNumQueries(3):  # Form ownership, count, page
+            data = self.client.get('/api/responses/', {'form_id': str(self.form.id)}).json()
+        self.assertEqual(len(data['results']), 4)
+        self.assertEqual({row['answer_count'] for row in data['results']}, {6})
+        self.assertEqual({row['form_title'] for row in data['results']}, {'Survey'})
+        self.assertTrue(all(row['display_name'].startswith('answer ') for row in data['results']))
+
+        with self.assertNumQueries(2) as queries:
+            data = self.client.get('/api/responses/', {'fields': 'id,submitted_at'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'submitted_at'})
+        self.assertNotIn('forms_answer', queries.captured_queries[-1]['sql'])
+
+    def test_response_detail_without_answers(self):
+        url = f'/api/responses/{self.responses[0].id}/'
+        with self.assertNumQueries(1):
+            data = self.client.get(url, {'expand': ''}).json()
+        self.assertNotIn('answers', data)
+        data = self.client.get(url).json()
+        self.assertEqual(len(data['answers']), 6)
+
+    def test_response_detail_sections_and_neighbours(self):
+        Question.objects.filter(id=self.questions[-1].id).soft_delete()
+        first, second, third, last = self.responses
+        with self.assertNumQueries(2):  # Response with its neighbours, answers
+            data = self.client.get(f'/api/responses/{second.id}/').json()
+        self.assertEqual((data['previous_id'], data['next_id']), (str(first.id), str(third.id)))
+        self.assertEqual([section['title'] for section in data['sections']], ['Section 0', 'Section 1', 'Section 2'])
+        self.assertEqual(
+            [answer['question_id'] for section in data['sections'] for answer in section['answers']],
+            [str(question.id) for question in self.questions[:-1]],
+        )
+        self.assertEqual(data['answers'], [answer for section in data['sections'] for answer in section['answers']])
+
+        data = self.client.get(f'/api/responses/{first.id}/', {'fields': 'previous_id,next_id'}).json()
+        self.assertEqual(data, {'previous_id': None, 'next_id': str(second.id)})
+        data = self.client.get(f'/api/responses/{last.id}/', {'fields': 'next_id'}).json()
+        self.assertEqual(data, {'next_id': None})
+
+    def test_writes_are_not_pruned(self):
+        url = f'/api/forms/{self.form.id}/'
+        payload = {'title': 'Renamed', 'sections': [{'title': 'Only section', 'order': 0, 'questions': []}]}
+        response = self.client.put(f'{url}?fields=id', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.form.sections.values_list('title', flat=True)), ['Only section'])
+
+        data = self.client.post(f'/api/forms/{self.form.id}/unpublish/?fields=id,status').json()
+        self.assertEqual(data, {'id': str(self.form.id), 'status': 'draft'})
+
+
+class ArchivedAnalysisTests(TestCase):
+    """Analysis merges archived responses (see archives.py) with live ones"""
+
+    def setUp(self):
+        archive_root = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_root.cleanup)
+        archive_settings = override_settings(ARCHIVE_ROOT=Path(archive_root.name))
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.form = Form.objects.create(title='Survey', status='published')
+        section = Section.objects.create(form=self.form, title='Section', order=0)
+        self.question = Question.objects.create(
+            section=section, text='Rating', type='rating', order=0, scale={'min': 1, 'max': 5},
+        )
+        for value in (4, 5):
+            self.respond(value)
+        archives.archive_form(self.form)
+        self.form.refresh_from_db()
+        self.respond(3)
+
+    def respond(self, value):
+        response = FormResponse.objects.create(form=self.form)
+        build_answer(response, self.question, value).save()
+
+    def test_serial_fallback_after_broken_pool_keeps_archived_answers(self):
+        def broken_pool(pool, batches, window):
+            # Reads the batches before the pool dies, like map_in_pool
+            list(batches)
+            raise BrokenProcessPool()
+            yield
+
+        expected = analysis.build_form_analysis(self.form, ResponseFilter(self.form))
+        self.assertEqual(expected['total_responses'], 3)
+        self.assertEqual(expected['questions'][0]['total_answers'], 3)
+        with mock.patch.object(analysis, '_use_pool', return_value=True), \
+                mock.patch.object(analysis, '_get_pool'), \
+                mock.patch.object(analysis, 'map_in_pool', broken_pool):
+            payload = analysis.build_form_analysis(self.form, ResponseFilter(self.form))
+        self.assertEqual(payload, expected)
+
+
+@override_settings(FORM_ANALYSIS_CACHE_WAIT_TIMEOUT=0.5)
+class AnalysisCacheTests(TestCase):
+    """Coalescing of concurrent computations in analysis_cache.get_or_compute"""
+
+    def setUp(self):
+        # Held by another process that never finishes
+        cache.add('busy:lock', 'other', timeout=60, version=analysis_cache.CACHE_VERSION)
+        self.addCleanup(cache.delete_many, ['busy:lock', 'busy', 'free'], version=analysis_cache.CACHE_VERSION)
+
+    def test_waiting_for_another_process_blocks_only_its_key(self):
+        results = []
+        waiter = threading.Thread(
+            target=lambda: results.append(analysis_cache.get_or_compute('busy', 1, lambda: 'busy'))
+        )
+        started = time.monotonic()
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(analysis_cache.get_or_compute('free', 1, lambda: 'free'), ('free', 'miss'))
+        self.assertLess(time.monotonic() - started, 0.4)
+
+        # Gives up on the other process after the wait timeout, leaving its lock alone
+        waiter.join(5)
+        self.assertEqual(results, [('busy', 'miss')])
+        self.assertEqual(cache.get('busy:lock', version=analysis_cache.CACHE_VERSION), 'other')
+
+
+class ApproxAnalysisTests(TestCase):
+    """The sketch-based analysis (see approx.py) returns the exact analysis' keys"""
+
+    def setUp(self):
+        self.form = Form.objects.create(title='Survey', status='published')
+        section = Section.objects.create(form=self.form, title='Section', order=0)
+        self.question = Question.objects.create(section=section, text='Feedback', type='textarea', order=0)
+        for text in ('Fast payment, great app', 'fast payment but slow login', 'slow login again'):
+            response = FormResponse.objects.create(form=self.form)
+            build_answer(response, self.question, text).save()
+        approx.rebuild(self.form)
+
+    def test_text_bigrams(self):
+        exact = analysis.build_form_analysis(self.form, ResponseFilter(self.form))['questions'][0]['data']
+        data = approx.analyze_form(self.form, 3)['questions'][0]['data']
+        self.assertEqual(set(data) - {'error'}, set(exact))
+        # Few enough distinct phrases that the sketch counts them exactly
+        self.assertCountEqual(data['bigrams'], exact['bigrams'])
+        self.assertIn({'phrase': 'fast payment', 'count': 2}, data['bigrams'])
+        self.assertIn('bigram_count_overestimate', data['error'])
+
+
+@override_settings(DB_REPLICA_CHECK_SECONDS=60, DB_REPLICA_CONNECT_TIMEOUT=2)
+class ReplicaHealthTests(TestCase):
+    """Replica health checks (see replicas.py)"""
+
+    def setUp(self):
+        self.addCleanup(replicas._health.clear)
+
+    def test_probe_blocks_neither_other_replicas_nor_other_threads(self):
+        probing = threading.Event()
+        release = threading.Event()
+
+        def replica_lag(alias):
+            if alias == 'slow':
+                probing.set()
+                release.wait(5)
+            return 0.0
+
+        with mock.patch.object(replicas, 'replica_lag', replica_lag):
+            prober = threading.Thread(target=replicas.is_healthy, args=('slow',))
+            prober.start()
+            probing.wait(5)
+            self.assertTrue(replicas.is_healthy('fast'))
+            # No result yet: skipped while it is being probed
+            self.assertFalse(replicas.is_healthy('slow'))
+            release.set()
+            prober.join(5)
+        self.assertTrue(replicas.is_healthy('slow'))
+
+    def test_probe_connects_with_a_timeout(self):
+        probe = mock.MagicMock(settings_dict={'OPTIONS': {'sslmode': 'require'}})
+        probe.cursor.return_value.__enter__.return_value.fetchone.return_value = (1.5,)
+        connection = mock.Mock(vendor='postgresql', **{'copy.return_value': probe})
+        with mock.patch.object(replicas, 'connections', {'replica1': connection}):
+            self.assertEqual(replicas.replica_lag('replica1'), 1.5)
+        self.assertEqual(probe.settings_dict['OPTIONS'], {'sslmode': 'require', 'connect_timeout': 2})
+        probe.close.assert_called_once_with()
+
+
+class TypeChangeTests(APITestCase):
+    """Analysis while answers' typed columns are refreshed after a type change (typed_values_pending)"""
+
+    def setUp(self):
+        user = User.objects.create_user('owner', password='pw')
+        self.client.force_authenticate(user)
+        self.form = Form.objects.create(title='Survey', created_by=user, status='published')
+        section = Section.objects.create(form=self.form, title='Section', order=0)
+        self.question = Question.objects.create(section=section, text='Score', type='single_choice', order=0)
+        self.notes = Question.objects.create(section=section, text='Notes', type='text', order=1)
+        for score, note in ((3, 'ok'), (4, 'fine'), (4, 4), (5, 'great'), ('x', 'meh')):
+            response = FormResponse.objects.create(form=self.form)
+            build_answer(response, self.question, score).save()
+            build_answer(response, self.notes, note).save()
+
+    def analyses(self):
+        analysis = self.client.get(f'/api/forms/{self.form.id}/analysis/').json()
+        timeline = self.client.get(f'/api/forms/{self.form.id}/analysis/timeline/').json()
+        return [question['data'] for question in analysis['questions']], timeline['buckets']
+
+    def test_stored_values_are_aggregated_like_typed_columns(self):
+        self.question.type = 'rating'
+        self.question.scale = {'min': 1, 'max': 5}
+        self.question.save()
+        self.notes.type = 'textarea'
+        self.notes.save()
+        self.assertTrue(Question.objects.get(id=self.question.id).typed_values_pending)
+
+        pending = self.analyses()
+        self.assertEqual(pending[1][0]['ratings'][str(self.question.id)], {'average': 4.0, 'count': 5})
+        self.assertEqual(sorted(pending[0][1]['sample_responses']), ['fine', 'great', 'meh', 'ok'])
+        for job in Job.objects.all():
+            jobs.run(job.id)
+        self.assertFalse(Question.objects.filter(typed_values_pending=True).exists())
+        self.assertEqual(pending, self.analyses())
+
+
+@override_settings(RESPONSE_FEED_SETTLE_SECONDS=1)
+class FeedImportTests(TestCase):
+    """Imported responses reach the change feed (see feed.py) like live ones"""
+
+    def setUp(self):
+        self.form = Form.objects.create(title='Survey', status='published')
+        section = Section.objects.create(form=self.form, title='Section', order=0)
+        self.question = Question.objects.create(section=section, text='Name', type='text', order=0)
+
+    def poll(self, since=0, later=0):
+        now = timezone.now() + timedelta(seconds=later)
+        with mock.patch.object(feed.timezone, 'now', return_value=now):
+            return [seq for _, seq, _, _ in feed.pending(self.form, since, 100)]
+
+    def test_import_interleaved_with_live_submission(self):
+        live = []
+        insert_rows = imports.insert_rows
+
+        def insert_with_live_submission(model, rows, *args, **kwargs):
+            if model is FormResponse:
+                # A live submission drawing its seq while the chunk is in flight
+                response = FormResponse.objects.create(form=self.form)
+                build_answer(response, self.question, 'live').save()
+                live.append(response.seq)
+            return insert_rows(model, rows, *args, **kwargs)
+
+        historical = timezone.now() - timedelta(days=30)
+        chunk = [
+            (number, {'submitted_at': historical, 'user_id': None, 'answers': [(self.question, f'imported {number}')]})
+            for number in range(1, 4)
+        ]
+        # A database sequence, as on PostgreSQL (elsewhere seqs continue from the committed maximum)
+        drawn = itertools.count(1)
+
+        def next_response_seqs(count, using=None):
+            return [next(drawn) for _ in range(count)]
+
+        with mock.patch.object(imports, 'insert_rows', insert_with_live_submission), \
+                mock.patch.object(imports, 'next_response_seqs', next_response_seqs), \
+                mock.patch.object(models, 'next_response_seqs', next_response_seqs):
+            imports.insert_chunk(self.form, 'history.csv', chunk)
+        imported = sorted(
+            FormResponse.objects.filter(form=self.form).exclude(seq__in=live).values_list('seq', flat=True)
+        )
+        self.assertTrue(max(imported) < live[0])
+
+        # Held back by insert time, not by their historical submitted_at
+        self.assertEqual(self.poll(), [])
+        self.assertEqual(self.poll(later=2), imported + live)
+        self.assertEqual(self.poll(since=imported[-1], later=2), live)
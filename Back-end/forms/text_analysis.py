@@ -0,0 +1,193 @@
+"""
+Text analysis pipeline for text/textarea answers.
+
+Answers are normalized and tokenized once, when they are submitted, and the
+resulting token sequence is stored on ``Answer.token_counts`` as one
+space-separated string. Per-question frequency tables are then built by
+counting the unigrams and bigrams of those cached sequences instead of
+re-tokenizing every answer on every analysis request. Per-answer
+unigram/bigram dicts were stored up to version 1: decoding their JSON on
+every request cost more than tokenizing the text again (``manage.py
+benchmark_text_analysis``), while a token string reads back as fast as
+the text itself.
+
+Stopwords are applied when the tables are built, not when counts are stored,
+so changing the stopword lists never requires a backfill.
+"""
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+TEXT_QUESTION_TYPES = ('text', 'textarea')
+
+# Bump when normalization, tokenization or the stored format changes so
+# stale cached tokens are recomputed instead of being merged with new ones.
+TOKEN_COUNTS_VERSION = 2
+
+_CHAR_MAP = {
+    'ي': 'ی',  # Arabic yeh -> Persian yeh
+    'ى': 'ی',  # Alef maksura -> Persian yeh
+    'ك': 'ک',  # Arabic kaf -> Persian keheh
+    'ة': 'ه',  # Teh marbuta -> heh
+    'ۀ': 'ه',  # Heh with yeh above -> heh
+    'أ': 'ا',  # Alef with hamza above -> alef
+    'إ': 'ا',  # Alef with hamza below -> alef
+    'ٱ': 'ا',  # Alef wasla -> alef
+    'ؤ': 'و',  # Waw with hamza -> waw
+    '\u0640': None,      # Tatweel
+    '\u200c': None,      # ZWNJ: "می‌خواهم" and "میخواهم" count as one word
+    '\u200d': None,      # ZWJ
+    '\u200e': None,      # LRM
+    '\u200f': None,      # RLM
+}
+# Arabic diacritics (harakat, superscript alef)
+_CHAR_MAP.update({chr(code): None for code in range(0x064b, 0x0660)})
+_CHAR_MAP['\u0670'] = None
+# Persian and Arabic-Indic digits -> ASCII digits
+_CHAR_MAP.update({chr(0x06f0 + i): str(i) for i in range(10)})
+_CHAR_MAP.update({chr(0x0660 + i): str(i) for i in range(10)})
+_TRANSLATION = str.maketrans(_CHAR_MAP)
+
+_TOKEN_RE = re.compile(r'\w+')
+
+DEFAULT_STOPWORDS = {
+    'fa': [
+        'و', 'در', 'به', 'از', 'که', 'این', 'را', 'با', 'است', 'برای', 'آن',
+        'یک', 'تا', 'هم', 'بر', 'می', 'ها', 'های', 'شد', 'شده', 'بود', 'کرد',
+        'ای', 'یا', 'اما', 'اگر', 'نیز', 'هر', 'چه', 'دیگر', 'خود', 'ما',
+        'من', 'تو', 'او', 'شما', 'آنها', 'اینها', 'ایشان', 'بی', 'باید', 'نه',
+        'هیچ', 'همه', 'کند', 'کنم', 'کنید', 'هست', 'هستند', 'نیست', 'دارد',
+        'دارم', 'داشت', 'ولی', 'چون', 'پس', 'روی', 'بین', 'شود', 'شوند',
+        'همین', 'همان', 'وی', 'اون', 'رو', 'خیلی', 'کنه', 'هستش', 'میشه',
+    ],
+    'en': [
+        'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from',
+        'has', 'have', 'i', 'in', 'is', 'it', 'its', 'me', 'my', 'not', 'of',
+        'on', 'or', 'so', 'that', 'the', 'this', 'to', 'was', 'we', 'were',
+        'with', 'you', 'your', 'they', 'them', 'very', 'just', 'do', 'does',
+    ],
+}
+
+
+def normalize(text):
+    """Normalize Persian/Arabic letter variants, ZWNJ, digits and case."""
+    text = unicodedata.normalize('NFKC', text)
+    return text.translate(_TRANSLATION).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def token_counts(value):
+    """
+    Build the cached tokens stored on a text answer: the normalized tokens
+    joined by spaces (tokens never contain whitespace) and the length of
+    the answer. Returns None for non-string values.
+    """
+    if not isinstance(value, str):
+        return None
+    return {
+        'v': TOKEN_COUNTS_VERSION,
+        'len': len(value.strip()),
+        'tokens': ' '.join(tokenize(value)),
+    }
+
+
+def is_current(counts):
+    return isinstance(counts, dict) and counts.get('v') == TOKEN_COUNTS_VERSION
+
+
+def cached_tokens(counts):
+    """The token string of current cached tokens, None for a blank (or non-text) answer"""
+    return counts['tokens'] if counts and counts.get('len') else None
+
+
+@lru_cache(maxsize=1)
+def get_stopwords():
+    """
+    Stopwords used when building frequency tables.
+
+    ``FORM_ANALYSIS_STOPWORDS`` (a dict of language -> words) replaces the
+    defaults per language; ``FORM_ANALYSIS_EXTRA_STOPWORDS`` is added on top.
+    """
+    lists = dict(DEFAULT_STOPWORDS)
+    lists.update(getattr(settings, 'FORM_ANALYSIS_STOPWORDS', {}) or {})
+    words = set()
+    for language_words in lists.values():
+        words.update(normalize(word) for word in language_words)
+    words.update(normalize(word) for word in getattr(settings, 'FORM_ANALYSIS_EXTRA_STOPWORDS', []) or [])
+    return frozenset(words)
+
+
+@receiver(setting_changed)
+def _reset_stopwords(setting, **kwargs):
+    if setting in ('FORM_ANALYSIS_STOPWORDS', 'FORM_ANALYSIS_EXTRA_STOPWORDS'):
+        get_stopwords.cache_clear()
+
+
+class TermFrequencies:
+    """Counts the cached per-answer tokens into per-question tables"""
+
+    def __init__(self):
+        self.unigrams = Counter()
+        self.bigrams = Counter()  # Keyed by (first, second)
+        self.total = 0
+
+    def add(self, counts):
+        self.add_tokens(cached_tokens(counts))
+
+    def add_tokens(self, tokens):
+        """Count an answer's token string (``cached_tokens``); None is a blank answer"""
+        if tokens is None:
+            return
+        self.total += 1
+        tokens = tokens.split()
+        self.unigrams.update(tokens)
+        self.bigrams.update(zip(tokens, tokens[1:]))
+
+    def merge(self, other):
+        self.total += other.total
+        self.unigrams.update(other.unigrams)
+        self.bigrams.update(other.bigrams)
+
+    def top_words(self, n, stopwords=None):
+        stopwords = get_stopwords() if stopwords is None else stopwords
+        return [
+            {'word': word, 'count': count}
+            for word, count in _most_common(
+                self.unigrams, n, lambda word: is_term(word, stopwords)
+            )
+        ]
+
+    def top_bigrams(self, n, stopwords=None):
+        stopwords = get_stopwords() if stopwords is None else stopwords
+
+        def keep(pair):
+            return is_term(pair[0], stopwords) and is_term(pair[1], stopwords)
+
+        return [
+            {'phrase': ' '.join(pair), 'count': count}
+            for pair, count in _most_common(self.bigrams, n, keep)
+        ]
+
+
+def is_term(token, stopwords):
+    """Whether a normalized token belongs in frequency tables"""
+    return len(token) > 1 and not token.isdigit() and token not in stopwords
+
+
+def _most_common(counter, n, keep):
+    result = []
+    for term, count in counter.most_common():
+        if keep(term):
+            result.append((term, count))
+            if len(result) == n:
+                break
+    return result
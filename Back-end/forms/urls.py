@@ -1,8 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import FormViewSet, PublicFormView, ResponseViewSet, SubmitResponseView, FormAnalysisView
-from .auth_views import SignupView, LoginView, UserView
+from .views import (
+    FormViewSet, PublicFormView, ResponseViewSet, SubmitResponseView,
+    FormAnalysisView, FormTimelineView, FormCrossTabView, AnalysisCacheStatsView,
+    FormJobsView, JobDetailView, JobDownloadView, FormExportView, FormResponseFeedView
+)
+from .auth_views import SignupView, LoginView, UserView, BulkUserProvisionView
 
 router = DefaultRouter()
 router.register(r'forms', FormViewSet, basename='form')
@@ -13,11 +17,20 @@ urlpatterns = [
     path('auth/signup/', SignupView.as_view(), name='signup'),
     path('auth/login/', LoginView.as_view(), name='login'),
     path('auth/user/', UserView.as_view(), name='user'),
+    path('auth/users/bulk/', BulkUserProvisionView.as_view(), name='users-bulk'),
     # JWT token routes
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     # Custom routes must come before router.urls to avoid conflicts
     path('forms/public/<uuid:uuid>/', PublicFormView.as_view(), name='public-form'),
     path('forms/<uuid:pk>/analysis/', FormAnalysisView.as_view(), name='form-analysis'),
+    path('forms/<uuid:pk>/analysis/timeline/', FormTimelineView.as_view(), name='form-analysis-timeline'),
+    path('forms/<uuid:pk>/analysis/crosstab/', FormCrossTabView.as_view(), name='form-analysis-crosstab'),
+    path('forms/<uuid:pk>/jobs/', FormJobsView.as_view(), name='form-jobs'),
+    path('forms/<uuid:pk>/responses/feed/', FormResponseFeedView.as_view(), name='form-response-feed'),
+    path('forms/<uuid:pk>/export.<str:file_format>', FormExportView.as_view(), name='form-export'),
+    path('jobs/<uuid:pk>/', JobDetailView.as_view(), name='job-detail'),
+    path('jobs/<uuid:pk>/download/', JobDownloadView.as_view(), name='job-download'),
+    path('analysis/cache-stats/', AnalysisCacheStatsView.as_view(), name='analysis-cache-stats'),
     # Submit response route - must come before router to avoid 405 conflicts
     path('responses/submit/<uuid:form_id>/', SubmitResponseView.as_view(), name='submit-response'),
     path('', include(router.urls)),
@@ -2,22 +2,39 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
-from .models import Form, Response as FormResponse, Question, Answer
+from django.db.models import Case, Count, F, JSONField, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+from .models import Form, Response as FormResponse, Question, Answer, Job, typed_answer_values
 from .serializers import (
-    FormSerializer, FormDetailSerializer,
-    ResponseSerializer, ResponseListSerializer, ResponseDetailSerializer
+    FormSerializer, FormDetailSerializer, FormSummarySerializer,
+    ResponseSerializer, ResponseListSerializer, ResponseDetailSerializer, JobSerializer
 )
-from collections import Counter
-import re
+from . import analysis_cache, approx, exports, feed, jobs, reaper, replicas
+from .replicas import ReplicaReadsMixin
+from .fieldsets import Selection, SparseFieldsViewMixin
+from .filters import ResponseFilter, parse_datetime_param, parse_timezone
+from .analysis import (
+    CHOICE_QUESTION_TYPES, NUMERIC_QUESTION_TYPES,
+    build_form_analysis, chi_square, typed_field, typed_value, value_categories, value_labels, weighted_median
+)
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+import uuid
 
 
-class FormViewSet(viewsets.ModelViewSet):
+class FormViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing forms (CRUD operations)
     Users can only see and manage their own forms
+    GET /forms/ - Summaries with section, question and response counts
+    GET /forms/{id}/ - The form with its sections and questions
+    GET /forms/{id}/?fields=id,title,sections.title&expand=sections - Only these fields (see fieldsets.py)
     """
     serializer_class = FormSerializer
     permission_classes = [IsAuthenticated]
@@ -27,6 +44,8 @@ class FormViewSet(viewsets.ModelViewSet):
         return Form.objects.filter(created_by=self.request.user)
     
     def get_serializer_class(self):
+        if self.action == 'list':
+            return FormSummarySerializer
         if self.action == 'retrieve':
             return FormDetailSerializer
         return FormSerializer
@@ -65,6 +84,7 @@ class FormViewSet(viewsets.ModelViewSet):
                 {'detail': 'You do not have permission to perform this action.'},
                 status=status.HTTP_403_FORBIDDEN
             )
+        replicas.pin_form(instance)
         return super().update(request, *args, **kwargs)
     
     def destroy(self, request, *args, **kwargs):
@@ -75,7 +95,11 @@ class FormViewSet(viewsets.ModelViewSet):
                 {'detail': 'You do not have permission to perform this action.'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().destroy(request, *args, **kwargs)
+        # Hidden at once; responses and answers are deleted in the background (see reaper.py)
+        Form.objects.filter(id=instance.id).soft_delete()
+        reaper.schedule(request.user)
+        replicas.pin_form(instance)
+        return Response(status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=True, methods=['post'])
     def publish(self, request, pk=None):
@@ -92,6 +116,7 @@ class FormViewSet(viewsets.ModelViewSet):
             )
         form.status = 'published'
         form.save()
+        replicas.pin_form(form)
         serializer = self.get_serializer(form)
         return Response(serializer.data)
     
@@ -110,30 +135,36 @@ class FormViewSet(viewsets.ModelViewSet):
             )
         form.status = 'draft'
         form.save()
+        replicas.pin_form(form)
         serializer = self.get_serializer(form)
         return Response(serializer.data)
 
 
-class PublicFormView(APIView):
+class PublicFormView(ReplicaReadsMixin, APIView):
     """
     Get a published form by UUID (public access - no authentication required)
     GET /forms/public/{uuid}/
     """
     permission_classes = [AllowAny]
+    replica_pin_kwarg = 'uuid'
     
     def get(self, request, uuid):
-        form = get_object_or_404(Form, uuid=uuid, status='published')
-        serializer = FormDetailSerializer(form)
+        selection = Selection.from_request(request)
+        forms = FormDetailSerializer.prepare_queryset(Form.objects.filter(status='published'), selection)
+        form = get_object_or_404(forms, uuid=uuid)
+        serializer = FormDetailSerializer(form, context={'selection': selection})
         return Response(serializer.data)
 
 
-class ResponseViewSet(viewsets.ReadOnlyModelViewSet):
+class ResponseViewSet(ReplicaReadsMixin, SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing form responses
     Users can only see responses to their own forms
     GET /responses/ - List all responses for user's forms
-    GET /responses/{id}/ - Get specific response
+    GET /responses/{id}/ - Get specific response, answers grouped by section, previous_id/next_id in the form
     GET /responses/?form_id=1 - Filter by form
+    GET /responses/?since=2025-01-01&until=2025-02-01&tz=Asia/Tehran - Filter by submission date
+    GET /responses/?fields=id,submitted_at&expand=display_name - Only these fields (see fieldsets.py)
     """
     serializer_class = ResponseListSerializer
     permission_classes = [IsAuthenticated]
@@ -159,6 +190,13 @@ class ResponseViewSet(viewsets.ReadOnlyModelViewSet):
             if not user_forms.filter(id=form_id).exists():
                 return FormResponse.objects.none()
             queryset = queryset.filter(form_id=form_id)
+        
+        # A date range also limits the scan to its months' partitions (see forms/partitions.py)
+        tzinfo = parse_timezone(self.request.query_params.get('tz', 'UTC'))
+        for param, lookup in (('since', 'submitted_at__gte'), ('until', 'submitted_at__lt')):
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: parse_datetime_param(param, value, tzinfo)})
         return queryset
 
 
@@ -182,10 +220,25 @@ class SubmitResponseView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class FormAnalysisView(APIView):
+class FormAnalysisView(ReplicaReadsMixin, APIView):
     """
     Get analysis data for a form
     GET /forms/{id}/analysis/
+    GET /forms/{id}/analysis/?since=2025-01-01&until=2025-02-01&answer={question_id}:{value}
+    
+    Optional filters (see forms/filters.py) restrict every per-question
+    analysis to a subset of the responses. Results are cached (see
+    forms/analysis_cache.py); the X-Analysis-Cache header reports
+    hit/miss/stale/coalesced.
+    
+    GET /forms/{id}/analysis/?approx=1 answers from persisted sketches
+    with error bounds instead (see forms/approx.py). Sketches cover all
+    responses, so with any filter present the exact analysis is returned.
+    
+    GET /forms/{id}/analysis/?background=1 never computes in the request:
+    a fresh cached result is returned as usual, otherwise an
+    analysis.refresh job is queued and 202 is returned with the job to
+    poll at /jobs/{job_id}/.
     """
     permission_classes = [IsAuthenticated]
     
@@ -199,247 +252,580 @@ class FormAnalysisView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Get all responses for this form
-        responses = FormResponse.objects.filter(form=form)
-        total_responses = responses.count()
+        # Get the responses to analyze (all of them unless filtered)
+        response_filter = ResponseFilter.from_query_params(form, request.query_params)
         
-        if total_responses == 0:
-            return Response({
-                'total_responses': 0,
-                'questions': []
-            })
+        # Sketch-based approximation, constant time regardless of form size
+        if request.query_params.get('approx') in ('1', 'true') and response_filter.is_empty:
+            total_responses = FormResponse.objects.filter(form=form).count() + form.archived_response_count()
+            return Response(approx.analyze_form(form, total_responses))
+        
+        # Cached per (form, revision, filter) and recomputed once new
+        # responses move the form's watermark
+        current_watermark = analysis_cache.watermark(form)
         
-        # Get all questions from all sections
-        all_questions = []
-        for section in form.sections.all():
-            for question in section.questions.all():
-                all_questions.append(question)
-        
-        # Analyze each question
-        question_analyses = []
-        for question in all_questions:
-            answers = Answer.objects.filter(
-                question=question,
-                response__in=responses
+        if request.query_params.get('background') in ('1', 'true'):
+            key = analysis_cache.cache_key(form, response_filter)
+            payload = analysis_cache.peek(key, current_watermark)
+            if payload is not None:
+                return Response(payload, headers={'X-Analysis-Cache': 'hit'})
+            query = request.query_params.copy()
+            query.pop('background', None)
+            payload = {'query': query.urlencode()}
+            job = (
+                Job.objects
+                .using('default')  # A job queued moments ago may not be on the replica yet
+                .filter(kind='analysis.refresh', form=form, payload=payload, status__in=['queued', 'running'])
+                .first()
+            ) or jobs.enqueue('analysis.refresh', form, payload, request.user)
+            return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        
+        payload, cache_state = analysis_cache.get_or_compute(
+            analysis_cache.cache_key(form, response_filter),
+            current_watermark,
+            lambda: build_form_analysis(form, response_filter),
+            allow_stale=lambda cached: (
+                cached['total_responses'] >= settings.FORM_ANALYSIS_STALE_WHILE_REVALIDATE_MIN_RESPONSES
+            ),
+        )
+        return Response(payload, headers={'X-Analysis-Cache': cache_state})
+
+
+class FormJobsView(APIView):
+    """
+    Background jobs of a form
+    GET /forms/{id}/jobs/
+    POST /forms/{id}/jobs/ {"kind": "analysis.refresh", "payload": {"query": "since=2025-01-01"}}
+    
+    Jobs are run by `manage.py run_workers`; poll /jobs/{job_id}/ for the outcome.
+    """
+    permission_classes = [IsAuthenticated]
+    ENQUEUEABLE_KINDS = ('analysis.refresh', 'sketches.rebuild', 'export.csv', 'export.parquet', 'export.arrow')
+    
+    def get(self, request, pk):
+        form = get_object_or_404(Form, id=pk)
+        
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
             )
-            
-            analysis = {
-                'question_id': question.id,
-                'question_text': question.text,
-                'question_type': question.type,
-                'total_answers': answers.count(),
-                'data': self._analyze_question(question, answers)
-            }
-            question_analyses.append(analysis)
         
-        return Response({
-            'total_responses': total_responses,
-            'questions': question_analyses
-        })
+        queryset = form.jobs.order_by('-created_at')
+        if request.query_params.get('status'):
+            queryset = queryset.filter(status=request.query_params['status'])
+        return Response(JobSerializer(queryset[:50], many=True).data)
     
-    def _analyze_question(self, question, answers):
-        """Analyze answers based on question type"""
-        if question.type == 'single_choice':
-            return self._analyze_single_choice(question, answers)
-        elif question.type == 'multi_choice':
-            return self._analyze_multi_choice(question, answers)
-        elif question.type in ['rating', 'scale']:
-            return self._analyze_rating_scale(question, answers)
-        elif question.type == 'text':
-            return self._analyze_text(question, answers, short=True)
-        elif question.type == 'textarea':
-            return self._analyze_text(question, answers, short=False)
-        return {}
-    
-    def _analyze_single_choice(self, question, answers):
-        """Analyze single choice questions"""
-        option_counts = Counter()
-        for answer in answers:
-            value = answer.value
-            if isinstance(value, str):
-                option_counts[value] += 1
-        
-        # Get option texts
-        options_map = {opt['value']: opt['text'] for opt in (question.options or [])}
-        
-        distribution = []
-        for value, count in option_counts.most_common():
-            distribution.append({
-                'value': value,
-                'label': options_map.get(value, value),
-                'count': count,
-                'percentage': round((count / len(answers)) * 100, 1) if answers.count() > 0 else 0
-            })
+    def post(self, request, pk):
+        form = get_object_or_404(Form, id=pk)
         
-        return {
-            'distribution': distribution,
-            'total': len(answers)
-        }
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        kind = request.data.get('kind')
+        if kind not in self.ENQUEUEABLE_KINDS:
+            return Response(
+                {'detail': f"kind must be one of: {', '.join(self.ENQUEUEABLE_KINDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        payload = request.data.get('payload') or {}
+        if not isinstance(payload, dict):
+            return Response({'detail': 'payload must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        job = jobs.enqueue(kind, form, payload, request.user)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class JobDetailView(APIView):
+    """
+    Status and result of a background job
+    GET /jobs/{id}/
+    """
+    permission_classes = [IsAuthenticated]
     
-    def _analyze_multi_choice(self, question, answers):
-        """Analyze multiple choice questions"""
-        option_counts = Counter()
-        total_selections = 0
-        co_occurrence = {}
-        
-        for answer in answers:
-            values = answer.value
-            if isinstance(values, list):
-                total_selections += len(values)
-                for value in values:
-                    option_counts[value] += 1
-                
-                # Track co-occurrence
-                for i, v1 in enumerate(values):
-                    if v1 not in co_occurrence:
-                        co_occurrence[v1] = Counter()
-                    for v2 in values[i+1:]:
-                        co_occurrence[v1][v2] += 1
-                        if v2 not in co_occurrence:
-                            co_occurrence[v2] = Counter()
-                        co_occurrence[v2][v1] += 1
-        
-        options_map = {opt['value']: opt['text'] for opt in (question.options or [])}
-        
-        distribution = []
-        for value, count in option_counts.most_common():
-            distribution.append({
-                'value': value,
-                'label': options_map.get(value, value),
-                'count': count,
-                'percentage': round((count / len(answers)) * 100, 1) if answers.count() > 0 else 0
-            })
+    def get(self, request, pk):
+        job = get_object_or_404(Job.objects.select_related('form'), id=pk)
         
-        # Build co-occurrence matrix
-        co_occurrence_matrix = []
-        for value1 in option_counts.keys():
-            row = []
-            for value2 in option_counts.keys():
-                if value1 == value2:
-                    row.append(option_counts[value1])
-                else:
-                    row.append(co_occurrence.get(value1, Counter()).get(value2, 0))
-            co_occurrence_matrix.append({
-                'option': value1,
-                'label': options_map.get(value1, value1),
-                'co_occurrences': row
-            })
+        # Visible to whoever queued it and to the owner of its form
+        if job.created_by_id != request.user.id and (job.form is None or job.form.created_by_id != request.user.id):
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        return {
-            'distribution': distribution,
-            'total_responses': len(answers),
-            'total_selections': total_selections,
-            'average_selections': round(total_selections / len(answers), 2) if answers.count() > 0 else 0,
-            'co_occurrence_matrix': co_occurrence_matrix
-        }
+        return Response(JobSerializer(job).data)
+
+
+class JobDownloadView(APIView):
+    """
+    Download the file written by a finished export job
+    GET /jobs/{id}/download/
+    """
+    permission_classes = [IsAuthenticated]
     
-    def _analyze_rating_scale(self, question, answers):
-        """Analyze rating/scale questions"""
-        values = []
-        for answer in answers:
-            value = answer.value
-            if isinstance(value, (int, float)):
-                values.append(float(value))
-        
-        if not values:
-            return {
-                'distribution': [],
-                'statistics': {}
-            }
+    def get(self, request, pk):
+        job = get_object_or_404(Job.objects.select_related('form'), id=pk)
         
-        # Distribution
-        scale = question.scale or {}
-        min_val = scale.get('min', 1)
-        max_val = scale.get('max', 5)
-        labels = scale.get('labels', [])
-        
-        distribution = []
-        for i in range(int(min_val), int(max_val) + 1):
-            count = values.count(i)
-            distribution.append({
-                'value': i,
-                'label': labels[i - int(min_val)] if i - int(min_val) < len(labels) else str(i),
-                'count': count,
-                'percentage': round((count / len(values)) * 100, 1) if values else 0
-            })
+        if job.created_by_id != request.user.id and (job.form is None or job.form.created_by_id != request.user.id):
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        # Statistics
-        sorted_values = sorted(values)
-        mean = sum(values) / len(values)
-        median = sorted_values[len(sorted_values) // 2] if sorted_values else 0
+        filename = (job.result or {}).get('file') if job.status == 'succeeded' else None
+        path = exports.export_path(filename) if filename else None
+        if path is None or not path.exists():
+            return Response({'detail': 'No file for this job.'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
+
+
+class FormExportView(ReplicaReadsMixin, APIView):
+    """
+    Export responses: one row per response, one column per question
+    GET /forms/{id}/export.csv
+    GET /forms/{id}/export.parquet
+    GET /forms/{id}/export.arrow
+    GET /forms/{id}/export.csv?since=2025-01-01&answer={question_id}:{value}
+    
+    Streamed while it is read from the database, so large forms start
+    downloading immediately. CSV joins multi-choice values with ';';
+    Parquet and Arrow (IPC stream) have typed columns named by question id
+    (see forms/exports.py). Accepts the same filters as the analysis
+    endpoint.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk, file_format='csv'):
+        form = get_object_or_404(Form, id=pk)
         
-        # Calculate standard deviation
-        variance = sum((x - mean) ** 2 for x in values) / len(values) if values else 0
-        std_dev = variance ** 0.5
+        # Ensure user owns this form
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        # NPS-style scoring (promoters vs detractors)
-        mid_point = (min_val + max_val) / 2
-        promoters = sum(1 for v in values if v >= max_val - 1)
-        detractors = sum(1 for v in values if v <= min_val + 1)
-        nps_score = ((promoters - detractors) / len(values)) * 100 if values else 0
+        response_filter = ResponseFilter.from_query_params(form, request.query_params)
+        if file_format == 'csv':
+            response = StreamingHttpResponse(
+                exports.stream_csv(form, response_filter),
+                content_type='text/csv; charset=utf-8'
+            )
+        elif file_format in exports.ARROW_FORMATS:
+            try:
+                exports.require_pyarrow()
+            except ImproperlyConfigured as e:
+                return Response({'detail': str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+            response = StreamingHttpResponse(
+                exports.stream_arrow(form, response_filter, file_format),
+                content_type=exports.ARROW_FORMATS[file_format]
+            )
+        else:
+            return Response({'detail': 'Unknown export format.'}, status=status.HTTP_404_NOT_FOUND)
+        response['Content-Disposition'] = f'attachment; filename="form-{form.id}.{file_format}"'
+        return response
+
+
+class FormResponseFeedView(APIView):
+    """
+    Change feed of a form's responses as NDJSON, oldest first
+    GET /forms/{id}/responses/feed/?since={cursor}&limit=1000&wait=5
+    
+    Each line is a response with its answers inlined. The X-Feed-Cursor
+    header is the cursor to pass as ``since`` on the next poll and
+    X-Feed-Has-More tells whether to poll again right away. With ``wait``
+    (seconds, up to MAX_WAIT) an empty poll is held open until new
+    responses arrive. See forms/feed.py.
+    
+    A held poll occupies a whole (synchronous) worker and queries the
+    database every feed.WAIT_INTERVAL for as long as it waits, so each
+    waiting consumer takes a worker away from every other request; wait
+    is capped at a few seconds and consumers re-poll instead.
+    """
+    permission_classes = [IsAuthenticated]
+    MAX_LIMIT = 10000
+    MAX_WAIT = 5
+    
+    def get(self, request, pk):
+        form = get_object_or_404(Form, id=pk)
         
-        return {
-            'distribution': distribution,
-            'statistics': {
-                'mean': round(mean, 2),
-                'median': round(median, 2),
-                'std_dev': round(std_dev, 2),
-                'min': min(values) if values else 0,
-                'max': max(values) if values else 0,
-                'nps_score': round(nps_score, 1),
-                'promoters': promoters,
-                'detractors': detractors
-            },
-            'total': len(values)
-        }
+        # Ensure user owns this form
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(int(request.query_params.get('limit', 1000)), self.MAX_LIMIT)
+            wait = min(float(request.query_params.get('wait', 0)), self.MAX_WAIT)
+        except ValueError:
+            return Response(
+                {'detail': 'since and limit must be integers, wait a number of seconds'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if limit < 1:
+            return Response({'detail': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rows = feed.wait_for(form, since, limit, wait) if wait > 0 else feed.pending(form, since, limit)
+        response = StreamingHttpResponse(feed.ndjson_lines(rows), content_type='application/x-ndjson')
+        response['X-Feed-Cursor'] = str(rows[-1][1] if rows else since)
+        response['X-Feed-Has-More'] = 'true' if len(rows) == limit else 'false'
+        return response
+
+
+class AnalysisCacheStatsView(APIView):
+    """
+    Hit/miss counters of the analysis cache (staff only)
+    GET /analysis/cache-stats/
+    """
+    permission_classes = [IsAdminUser]
     
-    def _analyze_text(self, question, answers, short=False):
-        """Analyze text/textarea questions"""
-        texts = []
-        for answer in answers:
-            value = answer.value
-            if isinstance(value, str) and value.strip():
-                texts.append(value.strip())
-        
-        if not texts:
-            return {
-                'total': 0,
-                'frequency': [],
-                'word_cloud': []
-            }
+    def get(self, request):
+        return Response(analysis_cache.stats())
+
+
+class FormTimelineView(ReplicaReadsMixin, APIView):
+    """
+    Response volume over time for a form, bucketed in the database
+    GET /forms/{id}/analysis/timeline/?bucket=hour|day|week&tz=Asia/Tehran&since=2025-01-01&until=2025-02-01
+    Accepts the same response filters as the analysis endpoint.
+    
+    Returns the number of responses per bucket and, for rating/scale
+    questions, the average answer per bucket. Only aggregated rows are
+    read from the database; archived responses are bucketed as they are
+    read from their files.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    BUCKETS = {
+        'hour': TruncHour,
+        'day': TruncDay,
+        'week': TruncWeek,
+    }
+    
+    def get(self, request, pk):
+        form = get_object_or_404(Form, id=pk)
+        
+        # Ensure user owns this form
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        if short:
-            # For short text: frequency analysis
-            word_freq = Counter()
-            for text in texts:
-                # Simple word extraction (split by spaces, remove punctuation)
-                words = re.findall(r'\b\w+\b', text.lower())
-                word_freq.update(words)
-            
-            top_words = word_freq.most_common(20)
-            frequency = [{'word': word, 'count': count} for word, count in top_words]
-            
-            return {
-                'total': len(texts),
-                'frequency': frequency,
-                'word_cloud': frequency[:10]  # Top 10 for word cloud
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in self.BUCKETS:
+            return Response(
+                {'detail': f"Invalid bucket. Must be one of: {list(self.BUCKETS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        tz_name = request.query_params.get('tz', 'UTC')
+        tzinfo = parse_timezone(tz_name)
+        response_filter = ResponseFilter.from_query_params(form, request.query_params)
+        
+        trunc = self.BUCKETS[bucket]
+        volume = (
+            response_filter.responses()
+            .annotate(bucket=trunc('submitted_at', tzinfo=tzinfo))
+            .values('bucket')
+            .annotate(count=Count('id'))
+            .order_by('bucket')
+        )
+        
+        rating_questions = list(
+            Question.objects
+            .filter(section__form=form, type__in=['rating', 'scale'])
+            .values('id', 'text', 'typed_values_pending')
+        )
+        typed_ids = [q['id'] for q in rating_questions if not q['typed_values_pending']]
+        averages = (
+            response_filter.answers(Answer.objects.filter(question__in=typed_ids))
+            .annotate(bucket=trunc('submitted_at', tzinfo=tzinfo))
+            .values('bucket', 'question_id')
+            .annotate(total=Sum('value_num'), numeric=Count('value_num'), count=Count('id'))
+            .order_by()
+        ) if typed_ids else []
+        
+        buckets = {}
+        for row in volume:
+            buckets[row['bucket']] = {
+                'start': row['bucket'].isoformat(),
+                'responses': row['count'],
+                'ratings': {}
             }
-        else:
-            # For long text: sentiment and theme analysis (simplified)
-            # In a real implementation, you'd use NLP libraries
-            word_freq = Counter()
-            for text in texts:
-                words = re.findall(r'\b\w+\b', text.lower())
-                word_freq.update(words)
-            
-            top_words = word_freq.most_common(30)
-            frequency = [{'word': word, 'count': count} for word, count in top_words]
-            
-            # Simple sentiment (placeholder - in production use proper NLP)
-            # For now, just return word frequency
-            return {
-                'total': len(texts),
-                'frequency': frequency,
-                'word_cloud': frequency[:15],
-                'sample_responses': texts[:5]  # Show first 5 responses as samples
+        # [sum, numeric answers, answers] per bucket and question
+        ratings = defaultdict(lambda: [0.0, 0, 0])
+        for row in averages:
+            if row['bucket'] in buckets:
+                rating = ratings[(row['bucket'], str(row['question_id']))]
+                rating[0] += row['total'] or 0
+                rating[1] += row['numeric']
+                rating[2] += row['count']
+        
+        # Questions whose value_num is being refreshed after a type change: group on the stored values
+        pending_ids = [q['id'] for q in rating_questions if q['typed_values_pending']]
+        stored = (
+            response_filter.answers(Answer.objects.filter(question__in=pending_ids))
+            .annotate(bucket=trunc('submitted_at', tzinfo=tzinfo))
+            .values_list('bucket', 'question_id', 'value')
+            .annotate(count=Count('id'))
+            .order_by()
+        ) if pending_ids else []
+        for start, question_id, value, count in stored:
+            if start in buckets:
+                self._add_rating(ratings[(start, str(question_id))], value, count)
+        
+        rating_ids = {q['id'] for q in rating_questions}
+        for record in response_filter.archived_records():
+            start = self._bucket_start(bucket, record['submitted_at'], tzinfo)
+            entry = buckets.setdefault(start, {'start': start.isoformat(), 'responses': 0, 'ratings': {}})
+            entry['responses'] += 1
+            for answer in record['answers']:
+                if answer['question_id'] in rating_ids:
+                    self._add_rating(ratings[(start, str(answer['question_id']))], answer['value'])
+        
+        for (start, question_id), (total, numeric, count) in ratings.items():
+            buckets[start]['ratings'][question_id] = {
+                'average': round(total / numeric, 2) if numeric else None,
+                'count': count
             }
+        
+        return Response({
+            'bucket': bucket,
+            'tz': tz_name,
+            'filters': response_filter.describe(),
+            'rating_questions': [
+                {'question_id': q['id'], 'question_text': q['text']} for q in rating_questions
+            ],
+            'buckets': [buckets[key] for key in sorted(buckets)]
+        })
+    
+    @staticmethod
+    def _add_rating(rating, value, count=1):
+        """Count a stored answer value (count times) in a [sum, numeric answers, answers] entry"""
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            rating[0] += value * count
+            rating[1] += count
+        rating[2] += count
+    
+    @staticmethod
+    def _bucket_start(bucket, moment, tzinfo):
+        """Start of the bucket holding a datetime, as truncated by the database"""
+        local = moment.astimezone(tzinfo)
+        if bucket == 'hour':
+            return local.replace(minute=0, second=0, microsecond=0)
+        day = local.date()
+        if bucket == 'week':
+            day -= timedelta(days=day.weekday())
+        return datetime.combine(day, time.min, tzinfo=tzinfo)
+
+
+class FormCrossTabView(ReplicaReadsMixin, APIView):
+    """
+    Cross-tabulate the answers to two questions of a form
+    GET /forms/{id}/analysis/crosstab/?row={question_id}&column={question_id}
+    
+    Counts are aggregated in SQL over respondents who answered both
+    questions (answers self-joined through their response). Adds a
+    chi-square test and Cramér's V when both questions are single choice,
+    and per-segment mean/median when one of them is a rating/scale.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    SUPPORTED_TYPES = CHOICE_QUESTION_TYPES + NUMERIC_QUESTION_TYPES
+    
+    def get(self, request, pk):
+        form = get_object_or_404(Form, id=pk)
+        
+        # Ensure user owns this form
+        if form.created_by != request.user:
+            return Response(
+                {'detail': 'You do not have permission to perform this action.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        questions = {}
+        for param in ('row', 'column'):
+            question_id = request.query_params.get(param)
+            try:
+                question_id = uuid.UUID(str(question_id))
+            except ValueError:
+                return Response(
+                    {'detail': f"'{param}' must be a question id"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            question = Question.objects.filter(id=question_id, section__form=form).first()
+            if question is None:
+                return Response(
+                    {'detail': f"Question '{question_id}' does not belong to this form"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if question.type not in self.SUPPORTED_TYPES:
+                return Response(
+                    {'detail': f"Cross-tabulation supports {list(self.SUPPORTED_TYPES)} questions"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            questions[param] = question
+        row_question, column_question = questions['row'], questions['column']
+        response_filter = ResponseFilter.from_query_params(form, request.query_params)
+        if row_question.id == column_question.id:
+            return Response(
+                {'detail': "'row' and 'column' must be different questions"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # One row per distinct (row value, column value) pair of typed columns
+        pairs = (
+            response_filter.answers(Answer.objects.filter(question=row_question))
+            .filter(response__answers__question=column_question)
+            .annotate(
+                row_typed=self._typed_value(row_question, ''),
+                row_untyped=self._untyped_value(row_question, ''),
+                column_typed=self._typed_value(column_question, 'response__answers__'),
+                column_untyped=self._untyped_value(column_question, 'response__answers__'),
+            )
+            .values('row_typed', 'row_untyped', 'column_typed', 'column_untyped')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        
+        cells = Counter()
+        respondents = 0
+        for pair in pairs:
+            respondents += pair['count']
+            for row_value in self._categories(row_question, pair['row_typed'], pair['row_untyped']):
+                for column_value in self._categories(column_question, pair['column_typed'], pair['column_untyped']):
+                    cells[(row_value, column_value)] += pair['count']
+        
+        # Archived responses, read from their files
+        for record in response_filter.archived_records():
+            values = {answer['question_id']: answer['value'] for answer in record['answers']}
+            if row_question.id not in values or column_question.id not in values:
+                continue
+            respondents += 1
+            for row_value in self._stored_categories(row_question, values[row_question.id]):
+                for column_value in self._stored_categories(column_question, values[column_question.id]):
+                    cells[(row_value, column_value)] += 1
+        
+        rows = self._ordered_categories(row_question, {r for r, _ in cells})
+        columns = self._ordered_categories(column_question, {c for _, c in cells})
+        counts = [[cells[(r['value'], c['value'])] for c in columns] for r in rows]
+        row_totals = [sum(row) for row in counts]
+        column_totals = [sum(column) for column in zip(*counts)] if rows else [0] * len(columns)
+        
+        chi_square_test = None
+        if row_question.type == 'single_choice' and column_question.type == 'single_choice':
+            chi_square_test = chi_square(counts)
+        
+        segments = None
+        if column_question.type in NUMERIC_QUESTION_TYPES:
+            segments = self._segments(rows, columns, counts, by_row=True)
+        elif row_question.type in NUMERIC_QUESTION_TYPES:
+            segments = self._segments(columns, rows, counts, by_row=False)
+        
+        return Response({
+            'row_question': self._describe(row_question),
+            'column_question': self._describe(column_question),
+            'total': respondents,
+            'rows': rows,
+            'columns': columns,
+            'counts': counts,
+            'row_totals': row_totals,
+            'column_totals': column_totals,
+            'row_percentages': [
+                [round(count / total * 100, 1) if total else 0 for count in row]
+                for row, total in zip(counts, row_totals)
+            ],
+            'column_percentages': [
+                [round(count / total * 100, 1) if total else 0 for count, total in zip(row, column_totals)]
+                for row in counts
+            ],
+            'filters': response_filter.describe(),
+            'chi_square': chi_square_test,
+            'segments': segments
+        })
+    
+    @staticmethod
+    def _describe(question):
+        return {
+            'question_id': question.id,
+            'question_text': question.text,
+            'question_type': question.type
+        }
+    
+    @staticmethod
+    def _typed_value(question, prefix):
+        """The typed column of the answers, none while it is being refreshed (typed_values_pending)"""
+        if question.typed_values_pending:
+            return Value(None, output_field=JSONField())
+        return F(prefix + typed_field(question))
+    
+    @staticmethod
+    def _untyped_value(question, prefix):
+        """
+        The stored value of multi choice selections without a mask (see
+        models.choice_mask), and of all answers while the typed column is
+        being refreshed
+        """
+        if question.typed_values_pending:
+            return F(prefix + 'value')
+        if question.type != 'multi_choice':
+            return Value(None, output_field=JSONField())
+        return Case(
+            When(**{prefix + 'value_choice_mask__isnull': True}, then=F(prefix + 'value')),
+            output_field=JSONField(),
+        )
+    
+    @classmethod
+    def _categories(cls, question, typed, untyped):
+        if question.typed_values_pending:
+            return cls._stored_categories(question, untyped)
+        return cls._typed_categories(question, typed, untyped)
+    
+    @staticmethod
+    def _typed_categories(question, typed, untyped):
+        if typed is None:
+            return value_categories(untyped, question)
+        return value_categories(typed_value(question, typed), question)
+    
+    @classmethod
+    def _stored_categories(cls, question, value):
+        """Categories of an answer value, read like its typed columns"""
+        typed = typed_answer_values(question, value)[typed_field(question)]
+        return cls._typed_categories(question, typed, value if question.type == 'multi_choice' else None)
+    
+    @staticmethod
+    def _ordered_categories(question, seen):
+        """Known options/scale points in form order, then any other answered values"""
+        labels = value_labels(question)
+        ordered = [value for value in labels if value in seen]
+        ordered += sorted((value for value in seen if value not in labels), key=str)
+        return [{'value': value, 'label': labels.get(value, value)} for value in ordered]
+    
+    @staticmethod
+    def _segments(segments, numeric_values, counts, by_row):
+        """Mean/median of the numeric question within each segment"""
+        result = []
+        for i, segment in enumerate(segments):
+            distribution = defaultdict(int)
+            for j, numeric in enumerate(numeric_values):
+                count = counts[i][j] if by_row else counts[j][i]
+                if count:
+                    distribution[numeric['value']] += count
+            total = sum(distribution.values())
+            mean = sum(value * count for value, count in distribution.items()) / total if total else None
+            median = weighted_median(distribution)
+            result.append({
+                'value': segment['value'],
+                'label': segment['label'],
+                'count': total,
+                'mean': round(mean, 2) if mean is not None else None,
+                'median': round(median, 2) if median is not None else None
+            })
+        return result